@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'sales.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -65,6 +66,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'sales.context_processors.company',
             ],
         },
     },
@@ -80,6 +82,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Job workers write from other threads/processes; wait for locks instead of failing
+        'OPTIONS': {'timeout': 20},
     }
 }
 
@@ -131,6 +135,46 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Background imports/exports: run workers with `python manage.py run_jobs`.
+# Set SALES_JOBS_ASYNC = False to run jobs inside the request instead.
+SALES_JOBS_ASYNC = True
+SALES_IMPORT_MAX_SIZE = 100 * 1024 * 1024
+
+# Serve the unfiltered invoices page counters from the InvoiceStats table
+SALES_CACHED_INVOICE_STATS = True
+
+# Days to pay an invoice when its client has no payment terms of its own.
+# Schedule `python manage.py mark_overdue` (e.g. daily from cron) to flag the late ones.
+SALES_DEFAULT_PAYMENT_TERMS = 30
+
+# Page the product and invoice lists with next/previous cursors instead of page numbers
+SALES_CURSOR_PAGINATION = True
+
+# Company settings are cached per process for up to this many seconds; a save in any process is
+# seen on the next read, through the 'settings' document version.
+# Name a cache from CACHES (e.g. a shared Redis/Memcached one) in SALES_SETTINGS_CACHE to share it.
+SALES_SETTINGS_LOCAL_TTL = 60
+SALES_SETTINGS_CACHE = None
+
+# Rendered invoice documents (sales.documents). Several worker processes should share a cache,
+# e.g. django.core.cache.backends.filebased.FileBasedCache, instead of per-process memory; the
+# invoice_document_cache command can only read the hit/miss counters from a shared cache.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+SALES_DOCUMENT_CACHE = 'default'
+SALES_DOCUMENT_CACHE_TIMEOUT = 7 * 24 * 3600
+
+# Request profiling (sales.profiling): SQL counts in a Server-Timing header on every response,
+# warnings for query shapes repeated this many times, and cProfile dumps for a sample of slow requests
+SALES_PROFILING_REPEAT_LIMIT = 10
+SALES_PROFILING_SAMPLE_RATE = 0.01
+SALES_PROFILING_SLOW_MS = 500
+SALES_PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
+
 LOGIN_REDIRECT_URL = 'dashboard'
 LOGIN_URL = 'login'
 
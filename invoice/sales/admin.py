@@ -1,8 +1,9 @@
 from django.contrib import admin
-from .models import Client,Product,Settings,Invoice
+from .models import Client,Product,Settings,Invoice,Job
 
 # Register your models here.
 admin.site.register(Client)
 admin.site.register(Product)
 admin.site.register(Settings)
-admin.site.register(Invoice)
\ No newline at end of file
+admin.site.register(Invoice)
+admin.site.register(Job)
\ No newline at end of file
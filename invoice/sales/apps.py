@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SalesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sales'
+
+    def ready(self):
+        # Connects the signals that invalidate the cached company settings
+        from . import company  # noqa: F401
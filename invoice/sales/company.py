@@ -0,0 +1,72 @@
+"""Cached access to the company Settings row.
+
+Company details change perhaps once a month but are read by most pages, so
+``company_settings()`` keeps the row in process memory for
+``SALES_SETTINGS_LOCAL_TTL`` seconds. When ``SALES_SETTINGS_CACHE`` names a
+cache from CACHES, a local miss is served from that shared cache before the
+database.
+
+Both copies are tagged with the 'settings' DocumentVersion row that
+Settings.save()/delete() bump, and only trusted while it is unchanged, so a
+save in one process reaches every other one on its next read. Callers that
+have just read that version (the invoice documents) pass it in.
+"""
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .documents import document_versions
+from .models import Settings
+
+CACHE_KEY = 'sales:company-settings'
+# Marks "no Settings row" in the shared cache, where None means a miss
+MISSING = 'missing'
+
+_local = {}
+
+
+def company_settings(version=None):
+    """The company Settings row, or None when none has been saved yet.
+
+    ``version`` is the current 'settings' document version, read here when
+    not given; the row returned is at least as recent as that version.
+    """
+    if version is None:
+        version, = document_versions('settings')
+    cached = _local.get('settings')
+    if cached is not None and cached[1] == version and cached[2] > time.monotonic():
+        return cached[0]
+
+    shared = _shared_cache()
+    cached = shared.get(CACHE_KEY) if shared else None
+    if cached is not None and cached[0] == version:
+        instance = cached[1]
+    else:
+        instance = Settings.objects.first() or MISSING
+        if shared:
+            shared.set(CACHE_KEY, (version, instance))
+    if instance == MISSING:
+        instance = None
+    _local['settings'] = (instance, version, time.monotonic() + settings.SALES_SETTINGS_LOCAL_TTL)
+    return instance
+
+
+def clear_company_settings():
+    _local.pop('settings', None)
+    shared = _shared_cache()
+    if shared:
+        shared.delete(CACHE_KEY)
+
+
+def _shared_cache():
+    alias = settings.SALES_SETTINGS_CACHE
+    return caches[alias] if alias else None
+
+
+@receiver([post_save, post_delete], sender=Settings, dispatch_uid='sales.company.invalidate')
+def invalidate_company_settings(sender, **kwargs):
+    clear_company_settings()
+    # A read before the transaction commits would cache the uncommitted row: clear again after
+    transaction.on_commit(clear_company_settings)
@@ -0,0 +1,7 @@
+from django.utils.functional import SimpleLazyObject
+from .company import company_settings
+
+
+def company(request):
+    """``company``: the cached company Settings row, only looked up when a template uses it"""
+    return {'company': SimpleLazyObject(company_settings)}
@@ -0,0 +1,174 @@
+"""Render cache for the printable invoice document (templates/partials/invoice_document.html).
+
+An issued invoice rarely changes but is viewed and reprinted all day, so
+its rendered HTML is kept in the SALES_DOCUMENT_CACHE cache. The key holds
+everything the document shows:
+
+* the invoice id and ``last_updated``, which every save of the invoice
+  or of one of its lines moves on (lines refresh the invoice totals);
+* the client's ``last_updated`` (or no client once it is deleted);
+* the ``settings`` version, bumped by Settings.save()/delete(); a miss is
+  rendered with company settings at least that recent (company_settings()
+  checks its copy against the same version);
+* the ``catalog`` version for line items, bumped when the title, price or
+  currency of an existing product changes, or an import bulk-updates
+  products (deleting a product refreshes its invoices' totals instead).
+
+The versions are DocumentVersion rows, so a bump in one process reaches every
+other worker even when SALES_DOCUMENT_CACHE is a per-process cache (locmem).
+Stale entries are never looked up again and expire after
+SALES_DOCUMENT_CACHE_TIMEOUT. Hits and misses are counted in the same cache,
+so the ``invoice_document_cache`` command can only read the web workers'
+counters when that cache is shared (file-based, Redis, Memcached); each
+invoice page also reports its own outcome in the Server-Timing header.
+"""
+from collections import defaultdict
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.template.loader import render_to_string
+
+TEMPLATE = 'partials/invoice_document.html'
+STATS_KEYS = {'hits': 'sales:invoice-document:hits', 'misses': 'sales:invoice-document:misses'}
+
+
+def _cache():
+    return caches[settings.SALES_DOCUMENT_CACHE]
+
+
+def bump_document_version(name):
+    """Invalidate every cached document that shows ``name`` ('settings' or 'catalog'), in every process"""
+    # documents is imported by models
+    from .models import DocumentVersion
+
+    if DocumentVersion.objects.filter(name=name).update(version=F('version') + 1):
+        return
+    try:
+        with transaction.atomic():
+            DocumentVersion.objects.create(name=name, version=1)
+    except IntegrityError:
+        DocumentVersion.objects.filter(name=name).update(version=F('version') + 1)
+
+
+def document_versions(*names):
+    """The current versions of ``names``, 0 for one never bumped"""
+    from .models import DocumentVersion
+
+    found = dict(DocumentVersion.objects.filter(name__in=names).values_list('name', 'version'))
+    return [found.get(name, 0) for name in names]
+
+
+def _timestamp(value):
+    return value.timestamp() if value else '-'
+
+
+def document_key(invoice, versions):
+    settings_version, catalog_version = versions
+    client = invoice.client
+    return 'sales:invoice-document:{}:{}:{}:{}:{}'.format(
+        invoice.pk, _timestamp(invoice.last_updated),
+        f'{client.pk}.{_timestamp(client.last_updated)}' if client else '-',
+        settings_version, catalog_version,
+    )
+
+
+def render_invoice_document(invoice, lines):
+    """(html, hit): the printable document of ``invoice`` (with its client loaded), cached.
+
+    ``lines`` are its InvoiceProduct rows with their products; they are only
+    read on a miss.
+    """
+    # company imports models, which imports this module
+    from .company import company_settings
+
+    cache = _cache()
+    versions = document_versions('settings', 'catalog')
+    key = document_key(invoice, versions)
+    html = cache.get(key)
+    _count('misses' if html is None else 'hits')
+    if html is None:
+        html = render_to_string(TEMPLATE, document_context(invoice, lines, company_settings(versions[0])))
+        cache.set(key, html, settings.SALES_DOCUMENT_CACHE_TIMEOUT)
+        return html, False
+    return html, True
+
+
+def render_invoice_documents(invoices):
+    """Documents of a chunk of ``invoices`` (with clients loaded), in order.
+
+    One cache round trip for the chunk; lines are queried, in one go, only for
+    the invoices whose document is not cached.
+    """
+    from .company import company_settings
+    from .models import InvoiceProduct
+
+    cache = _cache()
+    versions = document_versions('settings', 'catalog')
+    keys = [document_key(invoice, versions) for invoice in invoices]
+    documents = cache.get_many(keys)
+    missing = [(invoice, key) for invoice, key in zip(invoices, keys) if key not in documents]
+    _count('hits', len(keys) - len(missing))
+    _count('misses', len(missing))
+    if missing:
+        lines = defaultdict(list)
+        rows = InvoiceProduct.objects.filter(invoice__in=[invoice for invoice, _ in missing])
+        for line in rows.select_related('product').order_by('id'):
+            lines[line.invoice_id].append(line)
+        company = company_settings(versions[0])
+        rendered = {
+            key: render_to_string(TEMPLATE, document_context(invoice, lines[invoice.pk], company))
+            for invoice, key in missing
+        }
+        cache.set_many(rendered, settings.SALES_DOCUMENT_CACHE_TIMEOUT)
+        documents.update(rendered)
+    return [documents[key] for key in keys]
+
+
+def document_context(invoice, lines, company):
+    invoice_currency = 'TND'
+    products_with_totals = []
+    for line in lines:
+        if invoice_currency == 'TND':
+            invoice_currency = line.product.currency or 'TND'
+        products_with_totals.append({
+            'product': line.product,
+            'invoice_quantity': line.quantity,
+            'unit_price': line.unit_price,  # Price at time of invoice
+            'line_total': line.get_line_total(),
+        })
+    return {
+        'invoice': invoice,
+        'company': company,
+        'products_with_totals': products_with_totals,
+        'invoiceCurrency': invoice_currency,
+    }
+
+
+def _count(outcome, delta=1):
+    if not delta:
+        return
+    try:
+        _cache().incr(STATS_KEYS[outcome], delta)
+    except ValueError:
+        _cache().add(STATS_KEYS[outcome], delta, None)
+
+
+def document_cache_stats():
+    """Hits, misses and hit rate of the document cache since the counters were last reset"""
+    found = _cache().get_many(STATS_KEYS.values())
+    stats = {name: found.get(key, 0) for name, key in STATS_KEYS.items()}
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+    return stats
+
+
+def document_cache_is_shared():
+    """False when SALES_DOCUMENT_CACHE lives in each process's memory, counters included"""
+    return not isinstance(_cache(), (LocMemCache, DummyCache))
+
+
+def reset_document_cache_stats():
+    _cache().delete_many(STATS_KEYS.values())
@@ -0,0 +1,267 @@
+"""Constant-memory Excel/CSV/HTML writers used by the export and print views"""
+import csv
+import json
+from itertools import islice
+from decimal import Decimal
+from tempfile import SpooledTemporaryFile
+from django.db.models import Prefetch
+from django.http import FileResponse
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment
+from openpyxl.utils import get_column_letter
+from .documents import render_invoice_documents
+from .models import Product, InvoiceProduct
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Exports up to this size stay in memory, larger ones spill to a temp file
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 2000
+# Invoices rendered (and their lines prefetched) per chunk of a batch print
+PRINT_CHUNK_SIZE = 100
+
+PRODUCT_HEADERS = ['Product ID', 'Title', 'Currency', 'Description', 'Price', 'Quantity']
+PRODUCT_WIDTHS = [12, 30, 12, 50, 12, 12]
+
+INVOICE_HEADERS = ['Invoice ID', 'Unique ID', 'Title', 'Client', 'Status', 'Date Created', 'Last Updated',
+                   'Subtotal', 'Discount', 'TVA', 'Timbre Fiscal', 'Total', 'Notes']
+INVOICE_WIDTHS = [12, 15, 30, 25, 12, 18, 18, 14, 14, 14, 14, 14, 40]
+INVOICE_FIELDS = ['id', 'uniqueId', 'title', 'client__clientname', 'status', 'date_created', 'last_updated',
+                  'subtotal', 'discount_amount', 'tva_amount', 'timbre_fiscal', 'total', 'notes']
+
+LINE_HEADERS = ['Invoice ID', 'Unique ID', 'Product ID', 'Product', 'Quantity', 'Unit Price', 'Line Total']
+LINE_WIDTHS = [12, 15, 12, 30, 12, 14, 14]
+LINE_FIELDS = ['invoice_id', 'invoice__uniqueId', 'product_id', 'product__title', 'quantity', 'unit_price']
+
+# CSV/JSON lines variants: one record per line item with its invoice header
+FLAT_HEADERS = ['Invoice ID', 'Unique ID', 'Title', 'Client', 'Status', 'Date Created', 'Total',
+                'Product ID', 'Product', 'Quantity', 'Unit Price', 'Line Total']
+
+
+def header_cells(ws, headers):
+    """Styled header row for a write-only worksheet"""
+    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+    header_font = Font(bold=True, color="FFFFFF")
+    cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+        cells.append(cell)
+    return cells
+
+
+def add_sheet(wb, title, headers, widths):
+    """Create a write-only sheet with column widths and a styled header row"""
+    ws = wb.create_sheet(title)
+    for index, width in enumerate(widths, start=1):
+        ws.column_dimensions[get_column_letter(index)].width = width
+    ws.append(header_cells(ws, headers))
+    return ws
+
+
+def write_products_xlsx(fileobj, products=None, chunk_size=CHUNK_SIZE, progress=None):
+    """Write the products workbook to ``fileobj`` without holding the catalog in memory.
+
+    Rows are streamed from a chunked queryset iterator into an openpyxl
+    write-only worksheet, which serialises rows as they are appended.
+    ``progress`` is called with the rows written so far after every chunk.
+    """
+    if products is None:
+        products = Product.objects.all()
+    rows = products.order_by('title', 'id').values_list(
+        'id', 'title', 'currency', 'description', 'price', 'quantity'
+    )
+
+    wb = Workbook(write_only=True)
+    ws = add_sheet(wb, "Products", PRODUCT_HEADERS, PRODUCT_WIDTHS)
+    count = 0
+    for product_id, title, currency, description, price, quantity in rows.iterator(chunk_size=chunk_size):
+        count += 1
+        if progress and count % chunk_size == 0:
+            progress(count)
+        ws.append([
+            product_id,
+            title,
+            currency if currency else 'ZAR',
+            description if description else '',
+            float(price) if price else 0.0,
+            quantity if quantity else 0,
+        ])
+    wb.save(fileobj)
+    if progress:
+        progress(count)
+    return fileobj
+
+
+def _date(value):
+    return value.strftime('%Y-%m-%d %H:%M') if value else ''
+
+
+def _amount(value):
+    return float(value) if value is not None else 0.0
+
+
+def _line_total(quantity, unit_price):
+    return float(Decimal(str(unit_price or 0)) * Decimal(str(quantity or 0)))
+
+
+def write_invoices_xlsx(fileobj, invoices, chunk_size=CHUNK_SIZE, progress=None):
+    """Write an Invoices sheet (headers with stored totals) and a Line Items sheet.
+
+    Both sheets are filled from a single streamed join query each, so the
+    export costs two queries whatever the number of invoices or lines.
+    ``progress`` is called with the invoices written so far after every chunk.
+    """
+    wb = Workbook(write_only=True)
+
+    ws = add_sheet(wb, "Invoices", INVOICE_HEADERS, INVOICE_WIDTHS)
+    count = 0
+    for row in invoices.values_list(*INVOICE_FIELDS).iterator(chunk_size=chunk_size):
+        count += 1
+        if progress and count % chunk_size == 0:
+            progress(count)
+        values = dict(zip(INVOICE_FIELDS, row))
+        ws.append([
+            values['id'],
+            values['uniqueId'] or '',
+            values['title'] or '',
+            values['client__clientname'] or 'No Client',
+            values['status'],
+            _date(values['date_created']),
+            _date(values['last_updated']),
+            _amount(values['subtotal']),
+            _amount(values['discount_amount']),
+            _amount(values['tva_amount']),
+            _amount(values['timbre_fiscal']),
+            _amount(values['total']),
+            values['notes'] or '',
+        ])
+
+    ws = add_sheet(wb, "Line Items", LINE_HEADERS, LINE_WIDTHS)
+    lines = (
+        InvoiceProduct.objects.filter(invoice__in=invoices.order_by().values('id'))
+        .order_by('invoice_id', 'id')
+        .values_list(*LINE_FIELDS)
+    )
+    for invoice_id, unique_id, product_id, product_title, quantity, unit_price in lines.iterator(chunk_size=chunk_size):
+        ws.append([
+            invoice_id,
+            unique_id or '',
+            product_id,
+            product_title or '',
+            quantity,
+            float(unit_price or 0),
+            _line_total(quantity, unit_price),
+        ])
+
+    wb.save(fileobj)
+    if progress:
+        progress(count)
+    return fileobj
+
+
+def iter_invoice_records(invoices, chunk_size=500):
+    """Yield (invoice, lines) with lines and clients prefetched chunk by chunk"""
+    invoices = invoices.select_related('client').prefetch_related(
+        Prefetch('invoice_products', queryset=InvoiceProduct.objects.select_related('product').order_by('id'))
+    )
+    for invoice in invoices.iterator(chunk_size=chunk_size):
+        yield invoice, list(invoice.invoice_products.all())
+
+
+def _flat_rows(invoices):
+    for invoice, lines in iter_invoice_records(invoices):
+        header = [
+            invoice.id,
+            invoice.uniqueId or '',
+            invoice.title or '',
+            invoice.client.clientname if invoice.client else 'No Client',
+            invoice.status,
+            _date(invoice.date_created),
+            _amount(invoice.total),
+        ]
+        if not lines:
+            yield header + ['', '', '', '', '']
+        for line in lines:
+            yield header + [
+                line.product_id,
+                line.product.title or '',
+                line.quantity,
+                float(line.unit_price or 0),
+                _line_total(line.quantity, line.unit_price),
+            ]
+
+
+class _Echo:
+    """File-like object whose write() hands back the value, for streaming csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def iter_invoices_csv(invoices):
+    """Stream invoice line items as CSV rows"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FLAT_HEADERS)
+    for row in _flat_rows(invoices):
+        yield writer.writerow(row)
+
+
+def iter_invoices_jsonl(invoices):
+    """Stream one JSON object per invoice, with its line items nested"""
+    for invoice, lines in iter_invoice_records(invoices):
+        record = {
+            'id': invoice.id,
+            'unique_id': invoice.uniqueId,
+            'title': invoice.title,
+            'client': invoice.client.clientname if invoice.client else None,
+            'status': invoice.status,
+            'date_created': invoice.date_created.isoformat() if invoice.date_created else None,
+            'subtotal': str(invoice.subtotal),
+            'discount_amount': str(invoice.discount_amount),
+            'tva_amount': str(invoice.tva_amount),
+            'timbre_fiscal': str(invoice.timbre_fiscal or 0),
+            'total': str(invoice.total),
+            'notes': invoice.notes,
+            'lines': [
+                {
+                    'product_id': line.product_id,
+                    'product': line.product.title,
+                    'quantity': line.quantity,
+                    'unit_price': line.unit_price,
+                    'line_total': str(line.get_line_total()),
+                }
+                for line in lines
+            ],
+        }
+        yield json.dumps(record) + '\n'
+
+
+def iter_invoices_html(invoices, head, tail, chunk_size=PRINT_CHUNK_SIZE):
+    """Stream ``invoices`` as one printable HTML page between ``head`` and ``tail``.
+
+    The head goes out before the first query. Documents come from the render
+    cache a chunk at a time (lines are only read for uncached ones), so memory
+    stays flat however many invoices are printed.
+    """
+    yield head
+    rows = invoices.select_related('client').iterator(chunk_size=chunk_size)
+    printed = 0
+    while chunk := list(islice(rows, chunk_size)):
+        printed += len(chunk)
+        yield ''.join(f'<section class="invoice">\n{document}\n</section>\n'
+                      for document in render_invoice_documents(chunk))
+    if not printed:
+        yield '<p class="text-center text-muted my-5">No invoices to print.</p>\n'
+    yield tail
+
+
+def spooled_response(write, filename, content_type=XLSX_CONTENT_TYPE):
+    """Run ``write(fileobj)`` into a spooled temp file and stream it back in chunks"""
+    fileobj = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    write(fileobj)
+    fileobj.seek(0)
+    return FileResponse(fileobj, as_attachment=True, filename=filename, content_type=content_type)
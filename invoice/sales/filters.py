@@ -0,0 +1,51 @@
+"""Query-string filters shared by the list views, exports and background jobs"""
+from .models import Invoice
+from .pagination import INVOICE_SORTS, clean_sort
+from .search import full_text_search, order_by_rank
+
+INVOICE_FILTERS = ('search', 'status', 'client', 'date_from', 'date_to')
+
+
+def has_invoice_filters(params):
+    """Whether any filter (as opposed to sorting or paging) is applied"""
+    return any(params.get(name) for name in INVOICE_FILTERS)
+
+
+def invoice_sort(params):
+    """The whitelisted ?sort= of the invoices page; '' (best match) for searches without one"""
+    sort_by = clean_sort(params.get('sort', ''), INVOICE_SORTS, '')
+    if not sort_by and not params.get('search'):
+        return '-date_created'
+    return sort_by
+
+
+def filter_invoices(params):
+    """Invoices matching the search/status/client/date filters of the invoices page"""
+    invoices = Invoice.objects.all()
+    
+    # Search filter
+    search_query = params.get('search', '')
+    if search_query:
+        invoices = full_text_search(invoices, search_query)
+    
+    # Status filter
+    status = params.get('status', '')
+    if status:
+        invoices = invoices.filter(status=status)
+    
+    # Client filter
+    client_id = params.get('client', '')
+    if client_id:
+        invoices = invoices.filter(client_id=client_id)
+    
+    # Date filters
+    date_from = params.get('date_from', '')
+    if date_from:
+        invoices = invoices.filter(date_created__date__gte=date_from)
+    date_to = params.get('date_to', '')
+    if date_to:
+        invoices = invoices.filter(date_created__date__lte=date_to)
+    
+    # Sorting: searches default to best match first
+    sort_by = invoice_sort(params)
+    return invoices.order_by(sort_by) if sort_by else order_by_rank(invoices)
@@ -1,6 +1,7 @@
 from django import forms
 from django.contrib.auth.models import User
 from django.forms import widgets
+from .company import company_settings
 from .models import Product,Client,Invoice,Settings
 import json
 
@@ -90,27 +91,24 @@ class InvoiceForm(forms.ModelForm):
         
         # Auto-populate from settings if creating new invoice
         if not self.instance.pk:
-            try:
-                settings = Settings.objects.first()
-                if settings:
-                    # Set default TVA (typically 19% in Tunisia)
-                    self.fields['tva'].initial = 19.00
-                    # Set default timbre fiscal (typically 1.000 TND in Tunisia)
-                    self.fields['timbre_fiscal'].initial = 1.000
-            except Settings.DoesNotExist:
-                pass
+            if company_settings():
+                # Set default TVA (typically 19% in Tunisia)
+                self.fields['tva'].initial = 19.00
+                # Set default timbre fiscal (typically 1.000 TND in Tunisia)
+                self.fields['timbre_fiscal'].initial = 1.000
 
 
 class ClientForm(forms.ModelForm):
     """Form for client management"""
     class Meta:
         model = Client
-        fields = ['clientname', 'emailAddress', 'adress', 'mf']
+        fields = ['clientname', 'emailAddress', 'adress', 'mf', 'payment_terms']
         widgets = {
             'clientname': forms.TextInput(attrs={'class': 'form-control'}),
             'emailAddress': forms.EmailInput(attrs={'class': 'form-control'}),
             'adress': forms.TextInput(attrs={'class': 'form-control'}),
             'mf': forms.TextInput(attrs={'class': 'form-control'}),
+            'payment_terms': forms.NumberInput(attrs={'class': 'form-control', 'min': '0', 'placeholder': 'Days'}),
         }
 
 
@@ -0,0 +1,414 @@
+"""Batched Excel import pipelines used by the import views"""
+import time
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from openpyxl import load_workbook
+from .documents import bump_document_version
+from .models import (Client, Product, Invoice, InvoiceProduct, InsufficientStock,
+                     bulk_create_unique, deduct_stock, restore_stock, retry_on_slug_conflict)
+
+BATCH_SIZE = 1000
+PRODUCT_UPDATE_FIELDS = ['currency', 'description', 'price', 'quantity', 'last_updated']
+
+INVOICE_BATCH_SIZE = 500
+# A batch also ends once its invoices name this many distinct products, bounding each stock update
+INVOICE_BATCH_PRODUCTS = 1000
+# Rows per bulk INSERT, set rather than left to Django so the statement count of a batch is known:
+# SQLite takes 999 parameters per statement (17 invoice columns, 4 line columns)
+INVOICE_INSERT_BATCH_SIZE = 50
+LINE_INSERT_BATCH_SIZE = 200
+INVOICE_STATUSES = [status for status, _ in Invoice.STATUS]
+INVOICE_UPDATE_FIELDS = ['client', 'status', 'notes', 'tva', 'timbre_fiscal', 'discount',
+                         'inventory_adjusted', 'last_updated'] + Invoice.TOTAL_FIELDS
+
+
+def read_rows(fileobj, required_columns):
+    """Open the first sheet read-only and return (workbook, column index map, row iterator).
+
+    Rows are streamed from the file instead of loading the whole sheet.
+    Raises ValueError naming the first missing required column.
+    """
+    wb = load_workbook(fileobj, read_only=True, data_only=True)
+    rows = wb.active.iter_rows(values_only=True)
+    headers = list(next(rows, None) or [])
+    for col in required_columns:
+        if col not in headers:
+            wb.close()
+            raise ValueError(f'Missing required column: {col}')
+    columns = {header: index for index, header in enumerate(headers) if header is not None}
+    return wb, columns, rows
+
+
+def cell(row, columns, name):
+    """Value of the named column in a row, or None when the column or cell is missing"""
+    index = columns.get(name)
+    if index is None or index >= len(row):
+        return None
+    return row[index]
+
+
+def new_result():
+    return {'created': 0, 'updated': 0, 'errors': 0, 'rows': 0, 'seconds': 0.0, 'rows_per_second': 0}
+
+
+def finish_result(result, started):
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    if result['seconds']:
+        result['rows_per_second'] = round(result['rows'] / result['seconds'])
+    return result
+
+
+def parse_product_row(row, columns):
+    """Field values for one product row, or None for an empty row"""
+    title = cell(row, columns, 'Title')
+    if not title:
+        return None
+
+    currency = cell(row, columns, 'Currency') or 'ZAR'
+    description = cell(row, columns, 'Description') or ''
+
+    # Handle price
+    try:
+        price = float(cell(row, columns, 'Price') or 0)
+    except (ValueError, TypeError):
+        price = 0.0
+
+    # Handle quantity
+    try:
+        quantity = int(cell(row, columns, 'Quantity') or 0)
+    except (ValueError, TypeError):
+        quantity = 0
+
+    return {
+        'title': str(title),
+        'currency': currency,
+        'description': description,
+        'price': price,
+        'quantity': quantity,
+    }
+
+
+def import_products_excel(fileobj, update_existing=False, batch_size=BATCH_SIZE, progress=None):
+    """Import products from an Excel file in bulk_create/bulk_update batches.
+
+    With ``update_existing`` rows are matched to existing products by title;
+    each batch looks its titles up with a single query. A title repeated
+    within a batch is written once, from its last row. Returns a dict with
+    created/updated/error counts, rows processed and rows per second.
+    ``progress`` is called with the rows handled so far after every batch.
+    """
+    started = time.perf_counter()
+    result = new_result()
+    wb, columns, rows = read_rows(fileobj, ['Title'])
+    try:
+        batch = []
+        for row_num, row in enumerate(rows, start=2):
+            try:
+                values = parse_product_row(row, columns)
+            except Exception as e:
+                result['errors'] += 1
+                print(f"Error processing row {row_num}: {str(e)}")
+                continue
+            if values is None:
+                continue
+
+            result['rows'] += 1
+            batch.append(values)
+            if len(batch) >= batch_size:
+                _write_product_batch(batch, update_existing, result)
+                batch = []
+                if progress:
+                    progress(result['rows'])
+
+        if batch:
+            _write_product_batch(batch, update_existing, result)
+        if progress:
+            progress(result['rows'])
+    finally:
+        wb.close()
+
+    return finish_result(result, started)
+
+
+def _write_product_batch(batch, update_existing, result):
+    now = timezone.localtime(timezone.now())
+    # One product per title: a later row with the same title replaces the earlier one
+    batch = {values['title']: values for values in batch}
+
+    existing = {}
+    if update_existing:
+        for product in Product.objects.filter(title__in=batch).only('id', 'title').order_by('id'):
+            existing.setdefault(product.title, product)
+
+    to_create = []
+    to_update = []
+    for title, values in batch.items():
+        product = existing.get(title)
+        if product is None:
+            product = Product(**values)
+            product.populate_defaults(now)
+            to_create.append(product)
+            continue
+
+        for field, value in values.items():
+            setattr(product, field, value)
+        product.last_updated = now
+        to_update.append(product)
+
+    def write():
+        with transaction.atomic():
+            Product.objects.bulk_create(to_create)
+            if to_update:
+                Product.objects.bulk_update(to_update, PRODUCT_UPDATE_FIELDS)
+
+    retry_on_slug_conflict(write, to_create)
+    result['created'] += len(to_create)
+    result['updated'] += len(to_update)
+    if to_update:
+        # bulk_update() skips Product.save(), which invalidates the cached invoice documents
+        bump_document_version('catalog')
+
+
+def _decimal(value):
+    """Decimal for a rate cell, None when empty; raises ValueError when not numeric"""
+    if value is None or value == '':
+        return None
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f'Invalid number: {value}')
+
+
+def parse_invoice_row(row, columns):
+    """Header and line values for one invoice row, or None for an empty row"""
+    title = cell(row, columns, 'Title')
+    client_name = cell(row, columns, 'Client Name')
+    if not title or not client_name:
+        return None
+
+    status = cell(row, columns, 'Status') or 'CURRENT'
+    if status not in INVOICE_STATUSES:
+        status = 'CURRENT'
+
+    quantity = int(cell(row, columns, 'Quantity') or 1)
+    if quantity <= 0:
+        raise ValueError('Quantity must be greater than 0')
+
+    return {
+        'key': str(cell(row, columns, 'Invoice Key') or title),
+        'title': str(title),
+        'client_name': str(client_name),
+        'status': status,
+        'notes': cell(row, columns, 'Notes') or '',
+        'tva': _decimal(cell(row, columns, 'TVA')),
+        'timbre_fiscal': _decimal(cell(row, columns, 'Timbre Fiscal')),
+        'discount': _decimal(cell(row, columns, 'Discount')),
+        'product_title': cell(row, columns, 'Product Title'),
+        'quantity': quantity,
+    }
+
+
+def import_invoices_excel(fileobj, update_existing=False, batch_size=INVOICE_BATCH_SIZE, progress=None,
+                          create_clients=False):
+    """Import multi-line invoices from an Excel file.
+
+    Rows sharing an Invoice Key (the Title when the column is absent) become
+    one invoice; each row adds a product line with its quantity. Clients and
+    products are resolved through name maps loaded once, then every batch of
+    invoices is written with bulk_create/bulk_update and a set-wise stock
+    deduction, so round-trips are constant per batch rather than per row.
+    With ``create_clients`` unknown client names are created in one bulk insert.
+    ``progress`` is called with the rows handled so far after every batch.
+    """
+    started = time.perf_counter()
+    result = new_result()
+    wb, columns, rows = read_rows(fileobj, ['Title', 'Client Name'])
+    groups = {}
+    try:
+        for row_num, row in enumerate(rows, start=2):
+            try:
+                values = parse_invoice_row(row, columns)
+            except Exception as e:
+                result['errors'] += 1
+                print(f"Error processing row {row_num}: {str(e)}")
+                continue
+            if values is None:
+                continue
+
+            result['rows'] += 1
+            group = groups.get(values['key'])
+            if group is None:
+                group = groups[values['key']] = {'header': values, 'lines': {}, 'rows': []}
+            group['rows'].append(row_num)
+            if values['product_title']:
+                title = str(values['product_title'])
+                group['lines'][title] = group['lines'].get(title, 0) + values['quantity']
+    finally:
+        wb.close()
+
+    # Name -> id maps, loaded once; on duplicate names the oldest record wins
+    clients = {}
+    # Client id -> days to pay, for the due dates of new invoices
+    payment_terms = {}
+    for name, client_id, terms in Client.objects.order_by('-id').values_list('clientname', 'id', 'payment_terms'):
+        clients[name] = client_id
+        payment_terms[client_id] = settings.SALES_DEFAULT_PAYMENT_TERMS if terms is None else terms
+    if create_clients:
+        now = timezone.localtime(timezone.now())
+        new_clients = []
+        for name in {group['header']['client_name'] for group in groups.values()} - clients.keys():
+            client = Client(clientname=name)
+            client.populate_defaults(now)
+            new_clients.append(client)
+        bulk_create_unique(Client, new_clients, batch_size=batch_size)
+        clients.update((client.clientname, client.id) for client in new_clients)
+        result['clients_created'] = len(new_clients)
+    products = {}
+    product_ids = {}
+    for title, product_id, price, quantity in Product.objects.order_by('-id').values_list(
+            'title', 'id', 'price', 'quantity'):
+        products[product_id] = {'price': price or 0.0, 'stock': quantity or 0}
+        product_ids[title] = product_id
+
+    done = 0
+    for batch in _invoice_batches(groups.values(), batch_size):
+        _write_invoice_batch(batch, clients, payment_terms, product_ids, products, update_existing, result)
+        done += sum(len(group['rows']) for group in batch)
+        if progress:
+            progress(done)
+
+    return finish_result(result, started)
+
+
+def _invoice_batches(groups, batch_size):
+    """Split invoice groups into batches of at most ``batch_size`` invoices and about INVOICE_BATCH_PRODUCTS products"""
+    batch = []
+    titles = set()
+    for group in groups:
+        new_titles = group['lines'].keys() - titles
+        if batch and (len(batch) >= batch_size or len(titles) + len(new_titles) > INVOICE_BATCH_PRODUCTS):
+            yield batch
+            batch = []
+            titles = set()
+            new_titles = group['lines'].keys()
+        batch.append(group)
+        titles.update(new_titles)
+    if batch:
+        yield batch
+
+
+def _write_invoice_batch(groups, clients, payment_terms, product_ids, products, update_existing, result):
+    now = timezone.localtime(timezone.now())
+
+    existing = {}
+    old_lines = {}
+    if update_existing:
+        titles = {group['header']['title'] for group in groups}
+        for invoice in Invoice.objects.filter(title__in=titles).order_by('id'):
+            existing.setdefault(invoice.title, invoice)
+        lines = InvoiceProduct.objects.filter(invoice__in=[invoice.id for invoice in existing.values()])
+        for invoice_id, product_id, quantity, unit_price in lines.values_list(
+                'invoice_id', 'product_id', 'quantity', 'unit_price'):
+            old_lines.setdefault(invoice_id, {})[product_id] = (quantity, unit_price)
+
+    to_create = []
+    to_update = []
+    new_lines = []
+    deltas = {}  # product_id -> units to deduct (negative: units to give back)
+    failed_rows = 0
+    for group in groups:
+        header = group['header']
+        client_id = clients.get(header['client_name'])
+        if client_id is None:
+            failed_rows += len(group['rows'])
+            print(f"Rows {group['rows']}: Client '{header['client_name']}' not found")
+            continue
+
+        invoice = existing.get(header['title']) if update_existing else None
+        old = old_lines.get(invoice.pk, {}) if invoice is not None else {}
+        # Stock was only deducted for the old lines if the invoice was adjusted
+        previous = old if invoice is not None and invoice.inventory_adjusted else {}
+
+        quantities = {}
+        for product_title, quantity in group['lines'].items():
+            product_id = product_ids.get(product_title)
+            if product_id is None:
+                failed_rows += 1
+                print(f"Rows {group['rows']}: Product '{product_title}' not found, skipping product")
+                continue
+            quantities[product_id] = quantity
+
+        # Check stock against the running in-memory levels before touching the database
+        invoice_deltas = {product_id: quantity - previous.get(product_id, (0, None))[0]
+                          for product_id, quantity in quantities.items()}
+        for product_id, (quantity, _) in previous.items():
+            if product_id not in quantities:
+                invoice_deltas[product_id] = -quantity
+        short = [product_id for product_id, delta in invoice_deltas.items() if delta > products[product_id]['stock']]
+        if short:
+            failed_rows += len(group['rows'])
+            print(f"Rows {group['rows']}: insufficient stock for product id(s) {short}")
+            continue
+        for product_id, delta in invoice_deltas.items():
+            products[product_id]['stock'] -= delta
+            deltas[product_id] = deltas.get(product_id, 0) + delta
+
+        if invoice is None:
+            invoice = Invoice(title=header['title'])
+            to_create.append(invoice)
+        else:
+            to_update.append(invoice)
+        invoice.client_id = client_id
+        invoice.status = header['status']
+        invoice.notes = header['notes']
+        for rate in ('tva', 'timbre_fiscal', 'discount'):
+            if header[rate] is not None:
+                setattr(invoice, rate, header[rate])
+        invoice.inventory_adjusted = True
+
+        lines = [
+            InvoiceProduct(
+                product_id=product_id,
+                quantity=quantity,
+                # Lines already on the invoice keep their invoiced price
+                unit_price=old[product_id][1] if product_id in old else products[product_id]['price'],
+            )
+            for product_id, quantity in quantities.items()
+        ]
+        invoice.subtotal = sum((line.get_line_total() for line in lines), Decimal('0'))
+        # The new lines are not written yet: derive the amounts from them rather than from the stored ones
+        invoice.apply_amounts()
+        invoice.populate_defaults(now, payment_terms.get(client_id, settings.SALES_DEFAULT_PAYMENT_TERMS))
+        new_lines.extend((invoice, line) for line in lines)
+
+    def write():
+        with transaction.atomic():
+            Invoice.objects.bulk_create(to_create, batch_size=INVOICE_INSERT_BATCH_SIZE)
+            if to_update:
+                Invoice.objects.bulk_update(to_update, INVOICE_UPDATE_FIELDS)
+                InvoiceProduct.objects.filter(invoice__in=[invoice.id for invoice in to_update]).delete()
+            # Linked here so a retry picks up the invoices' new primary keys
+            for invoice, line in new_lines:
+                line.invoice_id = invoice.id
+            InvoiceProduct.objects.bulk_create([line for _, line in new_lines], batch_size=LINE_INSERT_BATCH_SIZE)
+            deduct_stock({product_id: delta for product_id, delta in deltas.items() if delta > 0})
+            restore_stock({product_id: -delta for product_id, delta in deltas.items() if delta < 0})
+
+    try:
+        retry_on_slug_conflict(write, to_create)
+    except (InsufficientStock, DatabaseError) as e:
+        # Stock moved underneath us since the maps were loaded, or the database refused a write:
+        # the whole batch is rolled back and the next one still runs
+        print(f"Batch skipped: {str(e)}")
+        rows = [row for group in groups for row in group['rows']]
+        result['errors'] += len(rows)
+        result.setdefault('failed_batches', []).append(f"Rows {min(rows)}-{max(rows)}: {e}")
+        for product_id, delta in deltas.items():
+            products[product_id]['stock'] += delta
+        return
+
+    result['created'] += len(to_create)
+    result['updated'] += len(to_update)
+    result['errors'] += failed_rows
@@ -0,0 +1,150 @@
+"""Local background jobs: rows in the Job table, run by `manage.py run_jobs` worker threads.
+
+Only the database and the filesystem are used. Uploads are stored under
+MEDIA_ROOT/jobs/input and export results under MEDIA_ROOT/jobs/output.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from tempfile import TemporaryFile
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, connection
+from django.utils import timezone
+from .exports import write_products_xlsx, write_invoices_xlsx, iter_invoices_csv, iter_invoices_jsonl
+from .filters import filter_invoices
+from .imports import import_products_excel, import_invoices_excel
+from .models import Job, Product
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register the function that runs jobs of ``kind``; it returns the result dict"""
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+def enqueue_job(kind, params=None, upload=None, user=None):
+    """Create a queued job, storing ``upload`` as its input file.
+
+    With ``SALES_JOBS_ASYNC = False`` the job runs before this returns, which
+    keeps development setups working without a worker process.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    job = Job(kind=kind, params=params or {}, created_by=user)
+    if upload is not None:
+        job.input_file.save(upload.name, upload, save=False)
+    job.save()
+
+    if not getattr(settings, 'SALES_JOBS_ASYNC', True):
+        if Job.objects.filter(pk=job.pk, status='QUEUED').update(
+                status='RUNNING', started=timezone.localtime(timezone.now())):
+            run_job(job)
+            job.refresh_from_db()
+    return job
+
+
+def run_job(job):
+    """Run a claimed job and record its result or error"""
+    try:
+        result = HANDLERS[job.kind](job)
+    except Exception as e:
+        logger.exception('Job %s (%s) failed', job.pk, job.kind)
+        job.status = 'FAILED'
+        job.error = str(e) or e.__class__.__name__
+    else:
+        job.status = 'DONE'
+        job.result = result
+    job.finished = timezone.localtime(timezone.now())
+    job.save(update_fields=['status', 'result', 'error', 'output_file', 'processed', 'total', 'finished'])
+    return job
+
+
+def run_worker(threads=2, poll_interval=1.0, once=False):
+    """Run jobs on a pool of ``threads`` until interrupted (or the queue is empty with ``once``)"""
+    stop = threading.Event()
+
+    def work():
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                job = Job.claim_next()
+                if job is None:
+                    if once:
+                        return
+                    stop.wait(poll_interval)
+                    continue
+                run_job(job)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='job') as pool:
+        futures = [pool.submit(work) for _ in range(threads)]
+        try:
+            for future in futures:
+                future.result()
+        except KeyboardInterrupt:
+            # Let running jobs finish, then exit
+            stop.set()
+            raise
+
+
+def _save_output(job, fileobj, filename):
+    fileobj.seek(0)
+    job.output_file.save(filename, File(fileobj), save=False)
+
+
+def _stamp():
+    return datetime.now().strftime('%Y%m%d')
+
+
+@handler('import_products')
+def run_import_products(job):
+    with job.input_file.open('rb') as fileobj:
+        return import_products_excel(fileobj, update_existing=job.params.get('update_existing', False),
+                                     progress=job.report_progress)
+
+
+@handler('import_invoices')
+def run_import_invoices(job):
+    with job.input_file.open('rb') as fileobj:
+        return import_invoices_excel(fileobj, update_existing=job.params.get('update_existing', False),
+                                     create_clients=job.params.get('create_clients', False),
+                                     progress=job.report_progress)
+
+
+@handler('export_products')
+def run_export_products(job):
+    job.report_progress(0, Product.objects.count())
+    with TemporaryFile() as fileobj:
+        write_products_xlsx(fileobj, progress=job.report_progress)
+        _save_output(job, fileobj, f'products_export_{_stamp()}.xlsx')
+    return {'rows': job.processed}
+
+
+@handler('export_invoices')
+def run_export_invoices(job):
+    invoices = filter_invoices(job.params.get('filters', {}))
+    job.report_progress(0, invoices.count())
+    export_format = job.params.get('format', 'xlsx')
+
+    with TemporaryFile() as fileobj:
+        if export_format in ('csv', 'jsonl'):
+            chunks = iter_invoices_csv(invoices) if export_format == 'csv' else iter_invoices_jsonl(invoices)
+            for chunk in chunks:
+                fileobj.write(chunk.encode('utf-8'))
+        else:
+            export_format = 'xlsx'
+            write_invoices_xlsx(fileobj, invoices, progress=job.report_progress)
+        _save_output(job, fileobj, f'invoices_export_{_stamp()}.{export_format}')
+
+    if export_format != 'xlsx':
+        job.processed = job.total
+    return {'rows': job.processed, 'format': export_format}
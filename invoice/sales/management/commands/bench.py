@@ -0,0 +1,169 @@
+import json
+import resource
+import statistics
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client as TestClient
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from openpyxl import Workbook
+from sales.models import Client, Invoice, Product
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the key pages through the Django test client against the current database "
+            "(fill it with seed_data first) and print one JSON line per scenario with p50/p95/p99 "
+            "latency, queries per request and peak memory. Everything the requests write is rolled "
+            "back afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Requests per page and form')
+        parser.add_argument('--heavy-iterations', type=int, default=3, help='Requests per import and export')
+        parser.add_argument('--lines', type=int, default=10, help='Lines on the invoices created and edited')
+        parser.add_argument('--import-rows', type=int, default=200, help='Rows in each uploaded workbook')
+        parser.add_argument('--only', nargs='+', metavar='SCENARIO', help='Run only these scenarios')
+        parser.add_argument('--output', help='Also write the results to this file, one JSON object per line')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(ALLOWED_HOSTS=['testserver'], MEDIA_ROOT=media_root, SALES_JOBS_ASYNC=False), \
+                transaction.atomic():
+            scenarios = self._scenarios(options)
+            unknown = set(options['only'] or ()) - set(scenarios)
+            if unknown:
+                raise CommandError(f"Unknown scenario(s): {', '.join(sorted(unknown))}. "
+                                   f"Choose from: {', '.join(scenarios)}")
+
+            results = []
+            for name, (heavy, request) in scenarios.items():
+                if options['only'] and name not in options['only']:
+                    continue
+                iterations = options['heavy_iterations'] if heavy else options['iterations']
+                result = {'scenario': name, **self._measure(request, iterations)}
+                results.append(result)
+                self.stdout.write(json.dumps(result))
+            transaction.set_rollback(True)
+
+        if options['output']:
+            with open(options['output'], 'w') as fileobj:
+                for result in results:
+                    fileobj.write(json.dumps(result) + '\n')
+
+    def _scenarios(self, options):
+        """name -> (heavy, request), where request() returns (method, path, data) for one call"""
+        product = Product.objects.filter(quantity__gt=0).order_by('-quantity').first()
+        invoice = Invoice.objects.order_by('-pk').first()
+        client = Client.objects.order_by('pk').first()
+        if product is None or invoice is None or client is None:
+            raise CommandError('Needs at least one client, product and invoice: run seed_data first.')
+
+        user = User.objects.create_user('bench', password=None)
+        self.client = TestClient()
+        self.client.force_login(user)
+
+        # The best-stocked products, so created and edited invoices never run out
+        line_products = list(Product.objects.order_by('-quantity').values_list('id', 'title')[:options['lines']])
+        lines_data = json.dumps([{'product_id': product_id, 'quantity': 1} for product_id, _ in line_products])
+        edited = Invoice.objects.create(title='Bench edit', client=client)
+        word = product.title.split()[0]
+        rows = options['import_rows']
+
+        def get(name, *args, **data):
+            return lambda: ('get', reverse(name, args=args), data)
+
+        def post(name, *args, **data):
+            return lambda: ('post', reverse(name, args=args), {key: value() if callable(value) else value
+                                                               for key, value in data.items()})
+
+        return {
+            'products_list': (False, get('products_list')),
+            'products_sorted': (False, get('products_list', sort='-price')),
+            'products_search': (False, get('products_list', search=word)),
+            'invoices_list': (False, get('invoices_list')),
+            'invoices_filtered': (False, get('invoices_list', status='OVERDUE', sort='-total')),
+            'invoices_search': (False, get('invoices_list', search=client.clientname.split()[0])),
+            'invoice_detail': (False, get('invoice_detail', invoice.id)),
+            'invoice_data': (False, get('invoice_data', invoice.id)),
+            'product_autocomplete': (False, get('product_autocomplete', q=word[:3])),
+            'invoice_create': (False, post(
+                'invoice_create', title='Bench invoice', client=client.id, tva='19', timbre_fiscal='1',
+                discount='0', products_data=lines_data,
+            )),
+            'invoice_edit': (False, post(
+                'invoice_edit', edited.id, title='Bench edit', client=client.id, status='CURRENT', notes='',
+                products_data=lines_data,
+            )),
+            'import_products': (True, post('import_products', update_existing='on', excel_file=lambda: _workbook(
+                ['Title', 'Currency', 'Description', 'Price', 'Quantity'],
+                [[f'Bench import {i}', 'TND', '', 1 + i % 50, 100] for i in range(rows)],
+            ))),
+            'import_invoices': (True, post('import_invoices', create_clients='on', excel_file=lambda: _workbook(
+                ['Invoice Key', 'Title', 'Client Name', 'Product Title', 'Quantity', 'Status', 'Discount'],
+                [[f'B{i // 5}', f'Bench import {i // 5}', client.clientname, line_products[i % len(line_products)][1],
+                  1, 'CURRENT', 0] for i in range(rows)],
+            ))),
+            'export_products': (True, get('export_products')),
+            'export_invoices': (True, get('export_invoices')),
+        }
+
+    def _call(self, request):
+        method, path, data = request()
+        response = getattr(self.client, method)(path, data)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        if response.status_code >= 400:
+            raise CommandError(f'{method.upper()} {path} returned {response.status_code}')
+        return response
+
+    def _measure(self, request, iterations):
+        timings, queries = [], []
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                self._call(request)
+                timings.append(time.perf_counter() - started)
+            queries.append(len(ctx.captured_queries))
+
+        # Separate pass: tracemalloc slows allocation-heavy code several-fold
+        tracemalloc.start()
+        self._call(request)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # ru_maxrss is in KiB on Linux and is a process-wide high-water mark
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        return {
+            'iterations': iterations,
+            **{f'{name}_ms': round(value * 1000, 2) for name, value in zip(('p50', 'p95', 'p99'), _percentiles(timings))},
+            'max_ms': round(max(timings) * 1000, 2),
+            'queries': round(statistics.mean(queries), 1),
+            'max_queries': max(queries),
+            'python_peak_mb': round(peak / 1024 / 1024, 2),
+            'max_rss_mb': round(max_rss / 1024, 2),
+        }
+
+
+def _percentiles(values):
+    """p50, p95 and p99, interpolated between samples"""
+    if len(values) == 1:
+        return values * 3
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return cuts[49], cuts[94], cuts[98]
+
+
+def _workbook(header, rows):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+    buffer = BytesIO()
+    wb.save(buffer)
+    return SimpleUploadedFile('bench.xlsx', buffer.getvalue())
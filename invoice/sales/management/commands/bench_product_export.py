@@ -0,0 +1,67 @@
+import json
+import resource
+import time
+import tracemalloc
+from tempfile import TemporaryFile
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from sales.exports import write_products_xlsx
+from sales.models import Product
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the streaming product export at several catalog sizes. "
+            "Rows are inserted inside a transaction that is rolled back afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 500_000])
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        for rows in options['rows']:
+            with transaction.atomic():
+                self._seed(rows, options['batch_size'])
+                result = self._measure(rows)
+                transaction.set_rollback(True)
+            self.stdout.write(json.dumps(result))
+
+    def _seed(self, rows, batch_size):
+        existing = Product.objects.count()
+        for start in range(existing, rows, batch_size):
+            Product.objects.bulk_create([
+                Product(
+                    title=f'Bench product {i}',
+                    currency='TND',
+                    description=f'Synthetic catalog entry number {i}',
+                    price=round(1 + (i % 997) * 0.137, 3),
+                    quantity=i % 500,
+                    uniqueId=f'bench{i:07d}',
+                    slug=f'bench-product-{i}',
+                )
+                for i in range(start, min(start + batch_size, rows))
+            ])
+
+    def _measure(self, rows):
+        # Timed pass first: tracemalloc slows allocation-heavy code several-fold
+        started = time.perf_counter()
+        with TemporaryFile() as fileobj:
+            write_products_xlsx(fileobj)
+            size = fileobj.tell()
+        elapsed = time.perf_counter() - started
+        # ru_maxrss is in KiB on Linux and is a process-wide high-water mark
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        tracemalloc.start()
+        with TemporaryFile() as fileobj:
+            write_products_xlsx(fileobj)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {
+            'rows': rows,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(rows / elapsed) if elapsed else None,
+            'python_peak_mb': round(peak / 1024 / 1024, 2),
+            'max_rss_mb': round(max_rss / 1024, 2),
+            'file_mb': round(size / 1024 / 1024, 2),
+        }
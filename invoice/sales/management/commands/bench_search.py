@@ -0,0 +1,102 @@
+import json
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from sales.filters import filter_invoices
+from sales.models import Client, Invoice, Product
+from sales.search import full_text_search, order_by_rank
+
+WORDS = ('cable', 'widget', 'ecran', 'souris', 'clavier', 'routeur', 'serveur', 'licence', 'support',
+         'maintenance', 'imprimante', 'cartouche', 'batterie', 'chargeur', 'adaptateur', 'disque',
+         'memoire', 'processeur', 'logiciel', 'formation', 'installation', 'reseau', 'antenne', 'boitier')
+
+
+class Command(BaseCommand):
+    help = ("Compare full-text search with the LIKE '%...%' scans it replaced, on the products and "
+            "invoices pages (count plus first page). Rows are inserted inside a transaction that is "
+            "rolled back afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100_000, help='Products and invoices to create')
+        parser.add_argument('--queries', nargs='+', default=['cab', 'widget', 'maintenance reseau', 'zzz'])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            started = time.perf_counter()
+            self._seed(options['rows'], options['batch_size'])
+            self.stdout.write(json.dumps({
+                'rows': options['rows'],
+                'seed_seconds': round(time.perf_counter() - started, 3),
+            }))
+            for query in options['queries']:
+                for page, like, fts in self._cases(query):
+                    result = {'page': page, 'query': query}
+                    for method, build in (('like', like), ('fts', fts)):
+                        result[f'{method}_ms'], result[f'{method}_matches'] = self._measure(build, options['repeat'])
+                    result['speedup'] = round(result['like_ms'] / result['fts_ms'], 1) if result['fts_ms'] else None
+                    self.stdout.write(json.dumps(result))
+            transaction.set_rollback(True)
+
+    def _seed(self, rows, batch_size):
+        rng = random.Random(42)
+        # Catalog words plus a few thousand made-up ones, so a word matches a realistic share of rows
+        vocabulary = list(WORDS) + [
+            ''.join(rng.choice('bcdfglmnprstv') + rng.choice('aeiou') for _ in range(rng.randint(2, 4)))
+            for _ in range(5000)
+        ]
+
+        def phrase(count):
+            return ' '.join(rng.choice(vocabulary) for _ in range(count))
+
+        clients = [Client(clientname=f'{phrase(2).title()} {i}') for i in range(max(1, rows // 100))]
+        for client in clients:
+            client.populate_defaults()
+        clients = Client.objects.bulk_create(clients, batch_size=batch_size)
+
+        for start in range(0, rows, batch_size):
+            batch = range(start, min(start + batch_size, rows))
+            Product.objects.bulk_create([
+                Product(title=f'{phrase(2)} {i}', description=phrase(12), price=1.0, quantity=10,
+                        uniqueId=f'benchp{i:08d}', slug=f'bench-product-{i}')
+                for i in batch
+            ])
+            Invoice.objects.bulk_create([
+                Invoice(title=f'{phrase(3)} {i}', notes=phrase(8), client=rng.choice(clients), status='CURRENT',
+                        uniqueId=f'benchi{i:08d}', slug=f'bench-invoice-{i}')
+                for i in batch
+            ])
+
+    def _cases(self, query):
+        """(page, LIKE queryset, full-text queryset) builders, mirroring the old and new view code"""
+        def products_like():
+            return Product.objects.filter(Q(title__icontains=query) | Q(description__icontains=query)).order_by('title')
+
+        def products_fts():
+            return order_by_rank(full_text_search(Product.objects.all(), query))
+
+        def invoices_like():
+            return Invoice.objects.filter(
+                Q(title__icontains=query) | Q(client__clientname__icontains=query) |
+                Q(notes__icontains=query) | Q(uniqueId__icontains=query)
+            ).order_by('-date_created')
+
+        def invoices_fts():
+            return filter_invoices({'search': query})
+
+        return [('products', products_like, products_fts), ('invoices', invoices_like, invoices_fts)]
+
+    def _measure(self, build, repeat):
+        """Median milliseconds for what a list page runs: the count, then the first 20 rows"""
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            queryset = build()
+            matches = queryset.count()
+            list(queryset[:20])
+            timings.append(time.perf_counter() - started)
+        return round(statistics.median(timings) * 1000, 2), matches
@@ -0,0 +1,24 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from sales.documents import document_cache_is_shared, document_cache_stats, reset_document_cache_stats
+
+
+class Command(BaseCommand):
+    help = ("Print the hit/miss counts and hit rate of the rendered invoice document cache as JSON. "
+            "Needs a shared SALES_DOCUMENT_CACHE backend: a per-process one (locmem) keeps each web "
+            "worker's counters in that worker's memory, out of reach of this command.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing them')
+
+    def handle(self, *args, **options):
+        if not document_cache_is_shared():
+            raise CommandError(
+                f"The {settings.SALES_DOCUMENT_CACHE!r} cache is per-process, so the web workers' counters are "
+                "not visible from here. Point SALES_DOCUMENT_CACHE at a shared cache (file-based, Redis, "
+                "Memcached), or read the document outcome in the invoice pages' Server-Timing header."
+            )
+        self.stdout.write(json.dumps(document_cache_stats()))
+        if options['reset']:
+            reset_document_cache_stats()
@@ -0,0 +1,27 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from sales.models import Invoice
+
+
+class Command(BaseCommand):
+    help = ("Move every CURRENT invoice whose due date has passed to OVERDUE, keeping the invoice counters "
+            "in step. Meant to run on a schedule, e.g. daily from cron.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Flag invoices due before this day (YYYY-MM-DD) instead of today")
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help="Invoices per UPDATE and transaction; 0 for a single one")
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        if options['date']:
+            try:
+                today = date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError(f"Invalid --date {options['date']!r}, expected YYYY-MM-DD")
+        if options['batch_size'] < 0:
+            raise CommandError("--batch-size cannot be negative")
+
+        moved = Invoice.objects.mark_overdue(today, batch_size=options['batch_size'] or None)
+        self.stdout.write(self.style.SUCCESS(f"Marked {moved} invoice(s) due before {today} as OVERDUE"))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from sales.models import Invoice, compute_totals
+
+
+class Command(BaseCommand):
+    help = "Rebuild (or verify with --check) the stored totals on every invoice"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="Only report invoices whose stored totals are stale")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        invoice_ids = list(Invoice.objects.order_by('id').values_list('id', flat=True))
+
+        stale = []
+        now = timezone.localtime(timezone.now())
+        for start in range(0, len(invoice_ids), batch_size):
+            batch = invoice_ids[start:start + batch_size]
+            # One aggregate query per batch instead of walking every line
+            totals = compute_totals(batch)
+            invoices = Invoice.objects.filter(id__in=batch).only('id', 'uniqueId', *Invoice.TOTAL_FIELDS)
+
+            changed = []
+            for invoice in invoices:
+                amounts = totals[invoice.id]
+                if any(getattr(invoice, field) != amounts[field] for field in Invoice.TOTAL_FIELDS):
+                    for field in Invoice.TOTAL_FIELDS:
+                        setattr(invoice, field, amounts[field])
+                    # Moves the invoice's document cache key, so the old totals are not served again
+                    invoice.last_updated = now
+                    changed.append(invoice)
+
+            stale.extend(changed)
+            if changed and not options['check']:
+                with transaction.atomic():
+                    Invoice.objects.bulk_update(changed, Invoice.TOTAL_FIELDS + ['last_updated'])
+
+        if options['check']:
+            for invoice in stale:
+                self.stdout.write(f"Invoice {invoice.id} ({invoice.uniqueId}) has stale totals")
+            if stale:
+                raise CommandError(f"{len(stale)} of {len(invoice_ids)} invoice(s) have stale totals")
+            self.stdout.write(self.style.SUCCESS(f"All {len(invoice_ids)} invoice totals are up to date"))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt totals for {len(stale)} of {len(invoice_ids)} invoice(s)"
+        ))
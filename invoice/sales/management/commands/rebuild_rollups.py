@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from sales.models import ClientBalance, ClientDailyRevenue, InvoiceStats, ProductDailySales
+
+
+class Command(BaseCommand):
+    help = ("Rebuild (or verify with --check) the daily client revenue and product sales rollups "
+            "behind the dashboard, the client balances and the invoice status counters from the invoices "
+            "and their lines")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="Only report days whose rollups differ from a fresh rebuild")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            before = _snapshot()
+            ClientDailyRevenue.rebuild()
+            ClientBalance.rebuild()
+            InvoiceStats.rebuild()
+            after = _snapshot()
+            if options['check']:
+                transaction.set_rollback(True)
+
+        stale = sorted(key for key in before.keys() | after.keys() if before.get(key) != after.get(key))
+        if options['check']:
+            for table, day, key in stale[:50]:
+                self.stdout.write(f"{table} {day} #{key}: {before.get((table, day, key))} != {after.get((table, day, key))}")
+            if stale:
+                raise CommandError(f"{len(stale)} rollup row(s) are stale")
+            self.stdout.write(self.style.SUCCESS(f"All {len(after)} rollup rows are up to date"))
+            return
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(after)} rollup rows ({len(stale)} changed)"))
+
+
+def _snapshot():
+    """{(table, day, client or product id): figures}, leaving out daily rows that have been emptied"""
+    rows = {}
+    for row in ClientDailyRevenue.objects.values_list('day', 'client_id', 'invoices', 'revenue', 'tva', 'units'):
+        if any(row[2:]):
+            rows['client', row[0], row[1]] = row[2:]
+    for row in ProductDailySales.objects.values_list('day', 'product_id', 'units', 'revenue'):
+        if any(row[2:]):
+            rows['product', row[0], row[1]] = row[2:]
+    for row in ClientBalance.objects.values_list('client_id', 'invoices', 'current_amount', 'overdue_amount',
+                                                 'outstanding', 'paid_amount', 'last_invoice_date'):
+        # Balances are not per day
+        rows['balance', '-', row[0]] = row[1:]
+    for row in InvoiceStats.objects.values_list('status', 'count', 'amount'):
+        if any(row[1:]):
+            rows['stats', '-', row[0]] = row[1:]
+    return rows
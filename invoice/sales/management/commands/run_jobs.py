@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from sales.jobs import run_worker
+from sales.models import Job
+
+
+class Command(BaseCommand):
+    help = "Run queued import/export jobs on a pool of worker threads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2)
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to wait before checking an empty queue again")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty instead of polling")
+        parser.add_argument('--requeue-running', action='store_true',
+                            help="Queue jobs left RUNNING by a worker that died (only when no other worker is up)")
+
+    def handle(self, *args, **options):
+        if options['requeue_running']:
+            requeued = Job.objects.filter(status='RUNNING').update(status='QUEUED', started=None, processed=0)
+            self.stdout.write(f"Requeued {requeued} job(s)")
+
+        self.stdout.write(f"Running jobs on {options['threads']} thread(s)")
+        try:
+            run_worker(threads=options['threads'], poll_interval=options['poll_interval'], once=options['once'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped")
+            return
+        self.stdout.write(self.style.SUCCESS("Job queue is empty"))
@@ -0,0 +1,143 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from sales.models import Client, Invoice, InvoiceProduct, Product, bulk_create_unique
+
+FIRST = ('Atlas', 'Carthage', 'Medina', 'Sahel', 'Jasmin', 'Olivier', 'Nour', 'Dar', 'Cap', 'Byrsa',
+         'Zitouna', 'Sidi', 'El Manar', 'Lac', 'Oasis', 'Hannibal', 'Kairouan', 'Bizerte', 'Tabarka', 'Djerba')
+SECOND = ('Trading', 'Industries', 'Services', 'Distribution', 'Import Export', 'Consulting', 'Logistics',
+          'Technologies', 'Equipements', 'Solutions', 'Group', 'Partners')
+ADJECTIVES = ('Compact', 'Pro', 'Premium', 'Standard', 'Eco', 'Heavy duty', 'Mini', 'Wireless', 'Smart',
+              'Industrial', 'Portable', 'Classic', 'Ultra', 'Basic', 'Advanced')
+NOUNS = ('cable', 'router', 'screen', 'keyboard', 'mouse', 'printer', 'cartridge', 'battery', 'charger',
+         'adapter', 'disk', 'memory module', 'server', 'licence', 'switch', 'camera', 'sensor', 'lamp',
+         'drill', 'pump', 'valve', 'pipe', 'panel', 'inverter', 'chair', 'desk', 'cabinet', 'shelf')
+# Invoice statuses by weight: most history is paid
+STATUSES = (('PAID', 6), ('CURRENT', 3), ('OVERDUE', 1))
+# Client payment terms in days; None falls back to SALES_DEFAULT_PAYMENT_TERMS
+PAYMENT_TERMS = (None, None, 15, 30, 60)
+
+
+class Command(BaseCommand):
+    help = ("Fill the database with synthetic clients, products, invoices and invoice lines using bulk "
+            "inserts, for benchmarking. Rows are added to whatever is already there.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=10_000)
+        parser.add_argument('--products', type=int, default=200_000)
+        parser.add_argument('--invoices', type=int, default=200_000)
+        parser.add_argument('--lines', type=int, default=1_000_000,
+                            help='About this many invoice lines in total, spread unevenly over the invoices')
+        parser.add_argument('--days', type=int, default=730, help='Spread invoice dates over this many days')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=1, help='Random seed, for repeatable datasets')
+
+    def handle(self, *args, **options):
+        if options['lines'] and (not options['invoices'] or not options['products']):
+            raise CommandError('Invoice lines need at least one invoice and one product')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.localtime(timezone.now())
+
+        clients = self._timed('clients', options['clients'], self._seed_clients)
+        products = self._timed('products', options['products'], self._seed_products)
+        self._timed('invoices', options['invoices'],
+                    lambda count: self._seed_invoices(count, options['lines'], options['days'], clients, products))
+
+    def _timed(self, noun, count, seed):
+        started = time.perf_counter()
+        result = seed(count)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{count} {noun} in {elapsed:.1f}s ({count / elapsed if elapsed else 0:.0f}/s)')
+        return result
+
+    def _batches(self, count):
+        for start in range(0, count, self.batch_size):
+            yield range(start, min(start + self.batch_size, count))
+
+    def _seed_clients(self, count):
+        # (id, payment terms) of every client, existing ones included
+        seeded = list(Client.objects.values_list('id', 'payment_terms'))
+        offset = len(seeded)
+        for batch in self._batches(count):
+            clients = []
+            for i in batch:
+                number = offset + i
+                client = Client(
+                    clientname=f'{self.rng.choice(FIRST)} {self.rng.choice(SECOND)} {number}',
+                    emailAddress=f'contact{number}@example.com',
+                    adress=f'{self.rng.randint(1, 250)} Rue {self.rng.choice(FIRST)}, Tunis',
+                    mf=f'{self.rng.randint(1000000, 9999999)}/A/M/000',
+                    payment_terms=self.rng.choice(PAYMENT_TERMS),
+                )
+                client.populate_defaults(self.now)
+                clients.append(client)
+            seeded += [(client.id, client.payment_terms) for client in bulk_create_unique(Client, clients)]
+        return seeded
+
+    def _seed_products(self, count):
+        """Returns [(id, price)] of every product, to price the invoice lines"""
+        products = list(Product.objects.values_list('id', 'price'))
+        offset = len(products)
+        for batch in self._batches(count):
+            created = []
+            for i in batch:
+                product = Product(
+                    title=f'{self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS)} {offset + i}',
+                    currency='TND',
+                    description=f'{self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS)} for '
+                                f'{self.rng.choice(SECOND).lower()}',
+                    price=round(self.rng.uniform(0.5, 2500), 3),
+                    quantity=self.rng.randint(0, 5000),
+                )
+                product.populate_defaults(self.now)
+                created.append(product)
+            products += [(product.id, product.price) for product in bulk_create_unique(Product, created)]
+        return products
+
+    def _seed_invoices(self, count, lines, days, clients, products):
+        statuses = [status for status, weight in STATUSES for _ in range(weight)]
+        average = lines / count if count else 0
+        lines_left = lines
+        for batch in self._batches(count):
+            invoices, invoice_lines = [], []
+            for i in batch:
+                # Exponentially distributed line counts: mostly short invoices, a few long ones
+                line_count = 0
+                if average:
+                    line_count = min(lines_left, len(products), max(1, round(self.rng.expovariate(1 / average))))
+                lines_left -= line_count
+                quantities = {product_id: (self.rng.randint(1, 20), price)
+                              for product_id, price in self.rng.sample(products, line_count)}
+                subtotal = sum(Decimal(str(price or 0)) * quantity for quantity, price in quantities.values())
+
+                client_id, payment_terms = self.rng.choice(clients) if clients else (None, None)
+                invoice = Invoice(
+                    title=f'{self.rng.choice(ADJECTIVES)} order {i}',
+                    status=self.rng.choice(statuses),
+                    client_id=client_id,
+                    tva=Decimal('19.00'),
+                    timbre_fiscal=Decimal('1.000'),
+                    discount=Decimal(self.rng.choice(('0.00', '0.00', '0.00', '5.00', '10.00'))),
+                    subtotal=subtotal,
+                    inventory_adjusted=True,
+                    date_created=self.now - timedelta(seconds=self.rng.randint(0, days * 86400)),
+                )
+                invoice.populate_defaults(
+                    self.now, settings.SALES_DEFAULT_PAYMENT_TERMS if payment_terms is None else payment_terms)
+                invoices.append(invoice)
+                invoice_lines.append(quantities)
+
+            with transaction.atomic():
+                bulk_create_unique(Invoice, invoices)
+                InvoiceProduct.objects.bulk_create([
+                    InvoiceProduct(invoice_id=invoice.id, product_id=product_id, quantity=quantity, unit_price=price or 0)
+                    for invoice, quantities in zip(invoices, invoice_lines)
+                    for product_id, (quantity, price) in quantities.items()
+                ], batch_size=self.batch_size)
+        self.stdout.write(f'{lines - lines_left} invoice lines')
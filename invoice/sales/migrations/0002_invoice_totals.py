@@ -0,0 +1,85 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:38
+
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+from django.db.models import F, FloatField, Sum
+
+AMOUNT_QUANTUM = Decimal('0.001')
+LINE_SUBTOTAL_QUANTUM = Decimal('1e-9')
+TOTAL_FIELDS = ['subtotal', 'discount_amount', 'tva_amount', 'total']
+
+
+def quantize_amount(value):
+    return Decimal(str(value or 0)).quantize(AMOUNT_QUANTUM, rounding=ROUND_HALF_UP)
+
+
+def invoice_amounts(subtotal, discount, tva, timbre_fiscal):
+    """The calculation of sales.models.compute_totals(), frozen for this migration"""
+    discount_amount = subtotal * Decimal(str(discount)) / Decimal('100') if discount else Decimal('0')
+    after_discount = subtotal - discount_amount
+    tva_amount = after_discount * Decimal(str(tva)) / Decimal('100') if tva else Decimal('0')
+    total = after_discount + tva_amount + Decimal(str(timbre_fiscal or 0))
+    return {
+        'subtotal': quantize_amount(subtotal),
+        'discount_amount': quantize_amount(discount_amount),
+        'tva_amount': quantize_amount(tva_amount),
+        'total': quantize_amount(total),
+    }
+
+
+def fill_totals(apps, schema_editor):
+    Invoice = apps.get_model('sales', 'Invoice')
+    InvoiceProduct = apps.get_model('sales', 'InvoiceProduct')
+    subtotals = dict(
+        InvoiceProduct.objects.order_by().values('invoice_id')
+        .annotate(subtotal=Sum(F('quantity') * F('unit_price'), output_field=FloatField()))
+        .values_list('invoice_id', 'subtotal')
+    )
+    batch = []
+    for invoice in Invoice.objects.only('id', 'discount', 'tva', 'timbre_fiscal').iterator(chunk_size=2000):
+        # SQL sums floats: drop the float noise, keep the exact subtotal, round only the results
+        subtotal = Decimal(str(subtotals.get(invoice.id) or 0)).quantize(LINE_SUBTOTAL_QUANTUM, rounding=ROUND_HALF_UP)
+        for field, value in invoice_amounts(subtotal, invoice.discount, invoice.tva, invoice.timbre_fiscal).items():
+            setattr(invoice, field, value)
+        batch.append(invoice)
+        if len(batch) >= 2000:
+            Invoice.objects.bulk_update(batch, TOTAL_FIELDS)
+            batch = []
+    Invoice.objects.bulk_update(batch, TOTAL_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='discount_amount',
+            field=models.DecimalField(decimal_places=3, default=0, help_text='Discount amount (D)', max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=3, default=0, help_text='Sum of line totals', max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='total',
+            field=models.DecimalField(decimal_places=3, default=0, help_text='Grand total including TVA and timbre fiscal', max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='tva_amount',
+            field=models.DecimalField(decimal_places=3, default=0, help_text='TVA amount (D)', max_digits=14),
+        ),
+        migrations.AlterField(
+            model_name='invoiceproduct',
+            name='quantity',
+            field=models.IntegerField(default=1, help_text='Quantity of this product in the invoice'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
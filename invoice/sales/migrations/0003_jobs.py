@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0002_invoice_totals'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('import_products', 'Product import'), ('import_invoices', 'Invoice import'), ('export_products', 'Product export'), ('export_invoices', 'Invoice export')], max_length=30)),
+                ('status', models.CharField(choices=[('QUEUED', 'QUEUED'), ('RUNNING', 'RUNNING'), ('DONE', 'DONE'), ('FAILED', 'FAILED')], default='QUEUED', max_length=10)),
+                ('params', models.JSONField(blank=True, default=dict)),
+                ('input_file', models.FileField(blank=True, upload_to='jobs/input')),
+                ('output_file', models.FileField(blank=True, upload_to='jobs/output')),
+                ('processed', models.IntegerField(default=0)),
+                ('total', models.IntegerField(blank=True, null=True)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('date_created', models.DateTimeField(blank=True, null=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'id'], name='sales_job_status_cbf8fe_idx')],
+            },
+        ),
+    ]
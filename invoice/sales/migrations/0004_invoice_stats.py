@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:55
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def build_stats(apps, schema_editor):
+    Invoice = apps.get_model('sales', 'Invoice')
+    InvoiceStats = apps.get_model('sales', 'InvoiceStats')
+    stats = {status: InvoiceStats(status=status) for status in ('CURRENT', 'OVERDUE', 'PAID')}
+    for row in Invoice.objects.order_by().values('status').annotate(count=Count('id'), amount=Sum('total')):
+        stats[row['status']] = InvoiceStats(status=row['status'], count=row['count'], amount=row['amount'] or 0)
+    InvoiceStats.objects.bulk_create(stats.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0003_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(max_length=100, unique=True)),
+                ('count', models.IntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=3, default=0, max_digits=16)),
+            ],
+        ),
+        migrations.RunPython(build_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:58
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def normalize_name(value):
+    value = unicodedata.normalize('NFKD', str(value or ''))
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return ' '.join(value.casefold().split())[:200]
+
+
+def fill_search_names(apps, schema_editor):
+    for model_name, name_field in (('Product', 'title'), ('Client', 'clientname')):
+        model = apps.get_model('sales', model_name)
+        batch = []
+        for obj in model.objects.only('id', name_field).iterator(chunk_size=2000):
+            obj.search_name = normalize_name(getattr(obj, name_field))
+            batch.append(obj)
+            if len(batch) >= 2000:
+                model.objects.bulk_update(batch, ['search_name'])
+                batch = []
+        model.objects.bulk_update(batch, ['search_name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0004_invoice_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='search_name',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='search_name',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(fill_search_names, migrations.RunPython.noop),
+    ]
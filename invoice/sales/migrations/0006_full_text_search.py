@@ -0,0 +1,105 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:03
+
+import django.db.models.deletion
+import sales.models
+from django.db import migrations, models
+
+# unicode61 with remove_diacritics folds case and accents ("écran" matches "ECRAN");
+# the prefix indexes make 2- and 3-character prefix queries cheap.
+TOKENIZE = "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'"
+
+CREATE_INDEXES = [
+    f"CREATE VIRTUAL TABLE sales_product_fts USING fts5(title, description, {TOKENIZE})",
+    f"CREATE VIRTUAL TABLE sales_invoice_fts USING fts5(title, notes, unique_id, client_name, {TOKENIZE})",
+    # Column weights for bm25(): a hit in a title outranks one in a description or notes
+    "INSERT INTO sales_product_fts(sales_product_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+    "INSERT INTO sales_invoice_fts(sales_invoice_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0, 5.0, 5.0)')",
+
+    """CREATE TRIGGER sales_product_fts_insert AFTER INSERT ON sales_product BEGIN
+        INSERT INTO sales_product_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER sales_product_fts_update AFTER UPDATE OF title, description ON sales_product
+    WHEN old.title IS NOT new.title OR old.description IS NOT new.description BEGIN
+        DELETE FROM sales_product_fts WHERE rowid = old.id;
+        INSERT INTO sales_product_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER sales_product_fts_delete AFTER DELETE ON sales_product BEGIN
+        DELETE FROM sales_product_fts WHERE rowid = old.id;
+    END""",
+
+    """CREATE TRIGGER sales_invoice_fts_insert AFTER INSERT ON sales_invoice BEGIN
+        INSERT INTO sales_invoice_fts(rowid, title, notes, unique_id, client_name)
+        VALUES (new.id, new.title, new.notes, new."uniqueId",
+                (SELECT clientname FROM sales_client WHERE id = new.client_id));
+    END""",
+    # Clearing the client on delete (SET_NULL) goes through this trigger too
+    """CREATE TRIGGER sales_invoice_fts_update AFTER UPDATE OF title, notes, "uniqueId", client_id ON sales_invoice
+    WHEN old.title IS NOT new.title OR old.notes IS NOT new.notes
+      OR old."uniqueId" IS NOT new."uniqueId" OR old.client_id IS NOT new.client_id BEGIN
+        DELETE FROM sales_invoice_fts WHERE rowid = old.id;
+        INSERT INTO sales_invoice_fts(rowid, title, notes, unique_id, client_name)
+        VALUES (new.id, new.title, new.notes, new."uniqueId",
+                (SELECT clientname FROM sales_client WHERE id = new.client_id));
+    END""",
+    """CREATE TRIGGER sales_invoice_fts_delete AFTER DELETE ON sales_invoice BEGIN
+        DELETE FROM sales_invoice_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER sales_client_fts_rename AFTER UPDATE OF clientname ON sales_client
+    WHEN old.clientname IS NOT new.clientname BEGIN
+        DELETE FROM sales_invoice_fts WHERE rowid IN (SELECT id FROM sales_invoice WHERE client_id = new.id);
+        INSERT INTO sales_invoice_fts(rowid, title, notes, unique_id, client_name)
+        SELECT id, title, notes, "uniqueId", new.clientname FROM sales_invoice WHERE client_id = new.id;
+    END""",
+
+    "INSERT INTO sales_product_fts(rowid, title, description) SELECT id, title, description FROM sales_product",
+    """INSERT INTO sales_invoice_fts(rowid, title, notes, unique_id, client_name)
+    SELECT invoice.id, invoice.title, invoice.notes, invoice."uniqueId", client.clientname
+    FROM sales_invoice invoice LEFT JOIN sales_client client ON client.id = invoice.client_id""",
+]
+
+DROP_INDEXES = [
+    "DROP TRIGGER sales_client_fts_rename",
+    "DROP TRIGGER sales_invoice_fts_delete",
+    "DROP TRIGGER sales_invoice_fts_update",
+    "DROP TRIGGER sales_invoice_fts_insert",
+    "DROP TRIGGER sales_product_fts_delete",
+    "DROP TRIGGER sales_product_fts_update",
+    "DROP TRIGGER sales_product_fts_insert",
+    "DROP TABLE sales_invoice_fts",
+    "DROP TABLE sales_product_fts",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0005_search_names'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceSearch',
+            fields=[
+                ('invoice', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='sales.invoice')),
+                ('document', sales.models.SearchDocumentField(db_column='sales_invoice_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'sales_invoice_fts',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSearch',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='sales.product')),
+                ('document', sales.models.SearchDocumentField(db_column='sales_product_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'sales_product_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(CREATE_INDEXES, DROP_INDEXES),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0006_full_text_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['date_created', 'id'], name='sales_invoi_date_cr_1223ca_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['total', 'id'], name='sales_invoi_total_9348ea_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['title', 'id'], name='sales_produ_title_c03a3b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], name='sales_produ_price_0bbfd9_idx'),
+        ),
+    ]
@@ -0,0 +1,145 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Per-day rollups kept in step by row triggers, so bulk writes (imports, bulk_update, cascades) are
+# counted too. Days are date(date_created) in UTC, the project time zone.
+# The SELECTs feeding an upsert carry a WHERE clause, which SQLite needs to parse ON CONFLICT.
+
+# Units on an invoice, for moving them with it between (day, client) buckets
+INVOICE_UNITS = "(SELECT coalesce(sum(quantity), 0) FROM sales_invoiceproduct WHERE invoice_id = {}.id)"
+
+
+def add_invoice(row):
+    return f"""INSERT INTO sales_client_daily(day, client_id, invoices, revenue, tva, units)
+        SELECT date({row}.date_created), coalesce({row}.client_id, 0), 1, coalesce({row}.total, 0),
+               coalesce({row}.tva_amount, 0), {INVOICE_UNITS.format(row)}
+        WHERE {row}.date_created IS NOT NULL
+        ON CONFLICT(day, client_id) DO UPDATE SET invoices = invoices + 1, revenue = revenue + excluded.revenue,
+            tva = tva + excluded.tva, units = units + excluded.units;"""
+
+
+def remove_invoice(row):
+    return f"""UPDATE sales_client_daily SET invoices = invoices - 1, revenue = revenue - coalesce({row}.total, 0),
+            tva = tva - coalesce({row}.tva_amount, 0), units = units - {INVOICE_UNITS.format(row)}
+        WHERE day = date({row}.date_created) AND client_id = coalesce({row}.client_id, 0);"""
+
+
+def add_line(row, sign='+'):
+    return f"""INSERT INTO sales_product_daily(day, product_id, units, revenue)
+        SELECT date(invoice.date_created), {row}.product_id, {sign}{row}.quantity, {sign}{row}.quantity * {row}.unit_price
+        FROM sales_invoice invoice WHERE invoice.id = {row}.invoice_id AND invoice.date_created IS NOT NULL
+        ON CONFLICT(day, product_id) DO UPDATE SET units = units + excluded.units, revenue = revenue + excluded.revenue;
+        UPDATE sales_client_daily SET units = units {sign} {row}.quantity
+        WHERE (day, client_id) = (SELECT date(date_created), coalesce(client_id, 0) FROM sales_invoice WHERE id = {row}.invoice_id);"""
+
+
+def move_lines(sign, row):
+    """Add (or with sign '-' remove) every line of invoice ``row`` on that invoice's day"""
+    return f"""INSERT INTO sales_product_daily(day, product_id, units, revenue)
+        SELECT date({row}.date_created), product_id, {sign}sum(quantity), {sign}sum(quantity * unit_price)
+        FROM sales_invoiceproduct WHERE invoice_id = {row}.id AND {row}.date_created IS NOT NULL
+        GROUP BY product_id
+        ON CONFLICT(day, product_id) DO UPDATE SET units = units + excluded.units, revenue = revenue + excluded.revenue;"""
+
+
+CREATE_ROLLUPS = [
+    # Django deletes an invoice's lines before the invoice, so lines only ever join a live invoice
+    f"""CREATE TRIGGER sales_rollup_invoice_insert AFTER INSERT ON sales_invoice BEGIN
+        {add_invoice('new')}
+    END""",
+    f"""CREATE TRIGGER sales_rollup_invoice_delete AFTER DELETE ON sales_invoice BEGIN
+        {remove_invoice('old')}
+    END""",
+    # Clearing the client on delete (SET_NULL) goes through this trigger too
+    f"""CREATE TRIGGER sales_rollup_invoice_update AFTER UPDATE OF date_created, client_id, total, tva_amount ON sales_invoice
+    WHEN old.date_created IS NOT new.date_created OR old.client_id IS NOT new.client_id
+      OR old.total IS NOT new.total OR old.tva_amount IS NOT new.tva_amount BEGIN
+        {remove_invoice('old')}
+        {add_invoice('new')}
+    END""",
+    f"""CREATE TRIGGER sales_rollup_invoice_redate AFTER UPDATE OF date_created ON sales_invoice
+    WHEN date(old.date_created) IS NOT date(new.date_created) BEGIN
+        {move_lines('-', 'old')}
+        {move_lines('', 'new')}
+    END""",
+
+    f"""CREATE TRIGGER sales_rollup_line_insert AFTER INSERT ON sales_invoiceproduct BEGIN
+        {add_line('new')}
+    END""",
+    f"""CREATE TRIGGER sales_rollup_line_delete AFTER DELETE ON sales_invoiceproduct BEGIN
+        {add_line('old', '-')}
+    END""",
+    f"""CREATE TRIGGER sales_rollup_line_update AFTER UPDATE OF invoice_id, product_id, quantity, unit_price ON sales_invoiceproduct
+    WHEN old.invoice_id IS NOT new.invoice_id OR old.product_id IS NOT new.product_id
+      OR old.quantity IS NOT new.quantity OR old.unit_price IS NOT new.unit_price BEGIN
+        {add_line('old', '-')}
+        {add_line('new')}
+    END""",
+
+    # Backfill, as ClientDailyRevenue.rebuild() does
+    """INSERT INTO sales_client_daily(day, client_id, invoices, revenue, tva, units)
+    SELECT date(invoice.date_created), coalesce(invoice.client_id, 0), count(*),
+           coalesce(sum(invoice.total), 0), coalesce(sum(invoice.tva_amount), 0),
+           coalesce(sum((SELECT sum(quantity) FROM sales_invoiceproduct WHERE invoice_id = invoice.id)), 0)
+    FROM sales_invoice invoice WHERE invoice.date_created IS NOT NULL
+    GROUP BY 1, 2""",
+    """INSERT INTO sales_product_daily(day, product_id, units, revenue)
+    SELECT date(invoice.date_created), line.product_id, sum(line.quantity), sum(line.quantity * line.unit_price)
+    FROM sales_invoiceproduct line JOIN sales_invoice invoice ON invoice.id = line.invoice_id
+    WHERE invoice.date_created IS NOT NULL
+    GROUP BY 1, 2""",
+]
+
+DROP_ROLLUPS = [
+    "DROP TRIGGER sales_rollup_line_update",
+    "DROP TRIGGER sales_rollup_line_delete",
+    "DROP TRIGGER sales_rollup_line_insert",
+    "DROP TRIGGER sales_rollup_invoice_redate",
+    "DROP TRIGGER sales_rollup_invoice_update",
+    "DROP TRIGGER sales_rollup_invoice_delete",
+    "DROP TRIGGER sales_rollup_invoice_insert",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0007_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientDailyRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('invoices', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=3, default=0, max_digits=16)),
+                ('tva', models.DecimalField(decimal_places=3, default=0, max_digits=16)),
+                ('units', models.IntegerField(default=0)),
+                ('client', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='sales.client')),
+            ],
+            options={
+                'db_table': 'sales_client_daily',
+                'constraints': [models.UniqueConstraint(fields=('day', 'client'), name='sales_client_daily_day_client')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=3, default=0, max_digits=16)),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='sales.product')),
+            ],
+            options={
+                'db_table': 'sales_product_daily',
+                'constraints': [models.UniqueConstraint(fields=('day', 'product'), name='sales_product_daily_day_product')],
+            },
+        ),
+        migrations.RunSQL(CREATE_ROLLUPS, DROP_ROLLUPS),
+    ]
@@ -0,0 +1,120 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# One sales_client_balance row per client, kept in step by row triggers so bulk writes (imports,
+# status sweeps, cascades) are counted too. A client's latest invoice date cannot be decremented,
+# so it is looked up again on the (client_id, date_created) index when an invoice leaves a client.
+
+def amount(row, *statuses):
+    """``row``'s total if its status is one of ``statuses``, else 0"""
+    listed = ', '.join(f"'{status}'" for status in statuses)
+    return f"CASE WHEN {row}.status IN ({listed}) THEN coalesce({row}.total, 0) ELSE 0 END"
+
+
+def add_invoice(row):
+    return f"""INSERT INTO sales_client_balance(client_id, invoices, current_amount, overdue_amount, outstanding,
+                                                paid_amount, last_invoice_date)
+        SELECT {row}.client_id, 1, {amount(row, 'CURRENT')}, {amount(row, 'OVERDUE')},
+               {amount(row, 'CURRENT', 'OVERDUE')}, {amount(row, 'PAID')}, {row}.date_created
+        WHERE {row}.client_id IS NOT NULL
+        ON CONFLICT(client_id) DO UPDATE SET invoices = invoices + 1,
+            current_amount = current_amount + excluded.current_amount,
+            overdue_amount = overdue_amount + excluded.overdue_amount,
+            outstanding = outstanding + excluded.outstanding,
+            paid_amount = paid_amount + excluded.paid_amount,
+            last_invoice_date = CASE WHEN last_invoice_date IS NULL OR excluded.last_invoice_date > last_invoice_date
+                                     THEN excluded.last_invoice_date ELSE last_invoice_date END;"""
+
+
+def remove_invoice(row):
+    return f"""UPDATE sales_client_balance SET invoices = invoices - 1,
+            current_amount = current_amount - {amount(row, 'CURRENT')},
+            overdue_amount = overdue_amount - {amount(row, 'OVERDUE')},
+            outstanding = outstanding - {amount(row, 'CURRENT', 'OVERDUE')},
+            paid_amount = paid_amount - {amount(row, 'PAID')},
+            last_invoice_date = (SELECT max(date_created) FROM sales_invoice WHERE client_id = {row}.client_id)
+        WHERE client_id = {row}.client_id;"""
+
+
+CREATE_BALANCES = [
+    # Every client has a row, so the clients page can walk the exposure index and join clients to it
+    """CREATE TRIGGER sales_balance_client_insert AFTER INSERT ON sales_client BEGIN
+        INSERT OR IGNORE INTO sales_client_balance(client_id, invoices, current_amount, overdue_amount,
+                                                   outstanding, paid_amount)
+        VALUES (new.id, 0, 0, 0, 0, 0);
+    END""",
+    # Runs after Django has cleared the client from its invoices (SET_NULL)
+    """CREATE TRIGGER sales_balance_client_delete AFTER DELETE ON sales_client BEGIN
+        DELETE FROM sales_client_balance WHERE client_id = old.id;
+    END""",
+
+    f"""CREATE TRIGGER sales_balance_invoice_insert AFTER INSERT ON sales_invoice BEGIN
+        {add_invoice('new')}
+    END""",
+    f"""CREATE TRIGGER sales_balance_invoice_delete AFTER DELETE ON sales_invoice BEGIN
+        {remove_invoice('old')}
+    END""",
+    f"""CREATE TRIGGER sales_balance_invoice_update AFTER UPDATE OF client_id, status, total, date_created ON sales_invoice
+    WHEN old.client_id IS NOT new.client_id OR old.status IS NOT new.status
+      OR old.total IS NOT new.total OR old.date_created IS NOT new.date_created BEGIN
+        {remove_invoice('old')}
+        {add_invoice('new')}
+    END""",
+
+    # Backfill, as ClientBalance.rebuild() does
+    """INSERT INTO sales_client_balance(client_id, invoices, current_amount, overdue_amount, outstanding,
+                                        paid_amount, last_invoice_date)
+    SELECT client.id, count(invoice.id),
+           coalesce(sum(CASE WHEN invoice.status = 'CURRENT' THEN invoice.total END), 0),
+           coalesce(sum(CASE WHEN invoice.status = 'OVERDUE' THEN invoice.total END), 0),
+           coalesce(sum(CASE WHEN invoice.status IN ('CURRENT', 'OVERDUE') THEN invoice.total END), 0),
+           coalesce(sum(CASE WHEN invoice.status = 'PAID' THEN invoice.total END), 0),
+           max(invoice.date_created)
+    FROM sales_client client LEFT JOIN sales_invoice invoice ON invoice.client_id = client.id
+    GROUP BY client.id""",
+]
+
+DROP_BALANCES = [
+    "DROP TRIGGER sales_balance_invoice_update",
+    "DROP TRIGGER sales_balance_invoice_delete",
+    "DROP TRIGGER sales_balance_invoice_insert",
+    "DROP TRIGGER sales_balance_client_delete",
+    "DROP TRIGGER sales_balance_client_insert",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0008_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientBalance',
+            fields=[
+                ('client', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='balance', serialize=False, to='sales.client')),
+                ('invoices', models.IntegerField(default=0)),
+                ('current_amount', models.DecimalField(decimal_places=3, default=0, max_digits=16)),
+                ('overdue_amount', models.DecimalField(decimal_places=3, default=0, max_digits=16)),
+                ('outstanding', models.DecimalField(decimal_places=3, default=0, max_digits=16)),
+                ('paid_amount', models.DecimalField(decimal_places=3, default=0, max_digits=16)),
+                ('last_invoice_date', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'sales_client_balance',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['client', 'date_created'], name='sales_invoi_client__6a7949_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clientbalance',
+            index=models.Index(fields=['outstanding', 'client'], name='sales_client_balance_exposure'),
+        ),
+        migrations.RunSQL(CREATE_BALANCES, DROP_BALANCES),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_due_dates(apps, schema_editor):
+    # No client has payment terms yet, so every invoice gets the default; days are UTC, the project time zone
+    schema_editor.execute(
+        "UPDATE sales_invoice SET due_date = date(date_created, %s) WHERE due_date IS NULL AND date_created IS NOT NULL",
+        [f'+{settings.SALES_DEFAULT_PAYMENT_TERMS} days'],
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0009_client_balances'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='payment_terms',
+            field=models.PositiveIntegerField(blank=True, help_text='Days to pay an invoice; the company default when empty', null=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='due_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', 'due_date'], name='sales_invoi_status_852738_idx'),
+        ),
+        migrations.RunPython(fill_due_dates, migrations.RunPython.noop),
+    ]
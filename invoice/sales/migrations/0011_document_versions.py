@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:48
+
+from django.db import migrations, models
+
+
+def create_versions(apps, schema_editor):
+    # Bumps are then a single UPDATE
+    DocumentVersion = apps.get_model('sales', 'DocumentVersion')
+    DocumentVersion.objects.bulk_create([DocumentVersion(name='settings'), DocumentVersion(name='catalog')])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0010_due_dates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentVersion',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'sales_document_version',
+            },
+        ),
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
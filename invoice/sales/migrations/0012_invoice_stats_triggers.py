@@ -0,0 +1,58 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:12
+
+from django.db import migrations
+
+
+# The per-status counters were kept in step by Invoice.save()/delete() only, so QuerySet.delete()
+# (the admin bulk delete included) and update() left them wrong. Row triggers count every write,
+# as for the rollups and the client balances.
+
+def add_invoice(row):
+    return f"""INSERT INTO sales_invoicestats(status, count, amount)
+        SELECT {row}.status, 1, coalesce({row}.total, 0) WHERE {row}.status IS NOT NULL
+        ON CONFLICT(status) DO UPDATE SET count = count + 1, amount = amount + excluded.amount;"""
+
+
+def remove_invoice(row):
+    return f"""UPDATE sales_invoicestats SET count = count - 1, amount = amount - coalesce({row}.total, 0)
+        WHERE status = {row}.status;"""
+
+
+CREATE_STATS = [
+    f"""CREATE TRIGGER sales_stats_invoice_insert AFTER INSERT ON sales_invoice BEGIN
+        {add_invoice('new')}
+    END""",
+    f"""CREATE TRIGGER sales_stats_invoice_delete AFTER DELETE ON sales_invoice BEGIN
+        {remove_invoice('old')}
+    END""",
+    f"""CREATE TRIGGER sales_stats_invoice_update AFTER UPDATE OF status, total ON sales_invoice
+    WHEN old.status IS NOT new.status OR old.total IS NOT new.total BEGIN
+        {remove_invoice('old')}
+        {add_invoice('new')}
+    END""",
+
+    # Recount, as InvoiceStats.rebuild() does, in case earlier bulk writes left the counters behind
+    "DELETE FROM sales_invoicestats",
+    """INSERT INTO sales_invoicestats(status, count, amount)
+    SELECT status, count(*), coalesce(sum(total), 0) FROM sales_invoice GROUP BY status
+    UNION ALL
+    SELECT status, 0, 0 FROM (SELECT 'CURRENT' AS status UNION ALL SELECT 'OVERDUE' UNION ALL SELECT 'PAID')
+    WHERE status NOT IN (SELECT status FROM sales_invoice)""",
+]
+
+DROP_STATS = [
+    "DROP TRIGGER sales_stats_invoice_update",
+    "DROP TRIGGER sales_stats_invoice_delete",
+    "DROP TRIGGER sales_stats_invoice_insert",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0011_document_versions'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_STATS, DROP_STATS),
+    ]
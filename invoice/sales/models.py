@@ -1,8 +1,220 @@
-from django.db import models
+import secrets
+import unicodedata
+from contextlib import nullcontext
+from datetime import timedelta
+from itertools import islice
+from django.conf import settings
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Case, Count, F, FloatField, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.template.defaultfilters import slugify
-from uuid import uuid4
+from decimal import Decimal, ROUND_HALF_UP
 from django.contrib.auth.models import User
+from .documents import bump_document_version
+
+# Amounts are stored with millimes precision (3 decimals, as printed on invoices)
+AMOUNT_QUANTUM = Decimal('0.001')
+# SQL sums line amounts as floats; rounding to this removes the float noise but keeps every real digit
+LINE_SUBTOTAL_QUANTUM = Decimal('1e-9')
+
+
+def quantize_amount(value):
+    """Round a monetary value to the stored invoice precision"""
+    return Decimal(str(value or 0)).quantize(AMOUNT_QUANTUM, rounding=ROUND_HALF_UP)
+
+
+def invoice_amounts(subtotal, discount=None, tva=None, timbre_fiscal=None):
+    """Derive discount, TVA and total from a subtotal and the invoice rates"""
+    subtotal = Decimal(str(subtotal or 0))
+    discount_amount = Decimal('0')
+    if discount:
+        discount_amount = (subtotal * Decimal(str(discount))) / Decimal('100')
+    subtotal_after_discount = subtotal - discount_amount
+    tva_amount = Decimal('0')
+    if tva:
+        tva_amount = (subtotal_after_discount * Decimal(str(tva))) / Decimal('100')
+    timbre = Decimal(str(timbre_fiscal or 0))
+    return {
+        'subtotal': subtotal,
+        'discount_amount': discount_amount,
+        'subtotal_after_discount': subtotal_after_discount,
+        'tva_amount': tva_amount,
+        'timbre_fiscal': timbre,
+        'total': subtotal - discount_amount + tva_amount + timbre,
+    }
+
+
+SEARCH_NAME_LENGTH = 200
+
+
+def normalize_name(value):
+    """Case- and accent-insensitive, single-spaced form of a name, stored for indexed lookups"""
+    value = unicodedata.normalize('NFKD', str(value or ''))
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return ' '.join(value.casefold().split())[:SEARCH_NAME_LENGTH]
+
+
+class Match(models.Lookup):
+    """``document__match=query``: an FTS5 MATCH against the index table"""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class SearchDocumentField(models.TextField):
+    """The hidden column named after an FTS5 table, which MATCH queries run against"""
+
+
+SearchDocumentField.register_lookup(Match)
+
+
+# uniqueId: 12 Crockford base32 characters (60 random bits), safe to use in slugs
+UNIQUE_ID_ALPHABET = '0123456789abcdefghjkmnpqrstvwxyz'
+UNIQUE_ID_LENGTH = 12
+# Attempts before a slug collision is reported as an IntegrityError
+IDENTITY_ATTEMPTS = 3
+
+
+def new_unique_id():
+    return ''.join(secrets.choice(UNIQUE_ID_ALPHABET) for _ in range(UNIQUE_ID_LENGTH))
+
+
+def assign_identity(instance, name, fallback):
+    """Give a record its uniqueId and "<name>-<uniqueId>" slug, in memory and without queries.
+
+    The slug is only rebuilt when it no longer matches the name, so ordinary
+    edits keep it. Uniqueness is left to the slug's unique constraint.
+    """
+    if not instance.uniqueId:
+        instance.uniqueId = new_unique_id()
+    slug = f"{slugify(name or '') or fallback}-{instance.uniqueId}"
+    if instance.slug != slug:
+        instance.slug = slug
+
+
+def _is_slug_conflict(error):
+    return 'slug' in str(error)
+
+
+def save_unique(instance, save, *args, **kwargs):
+    """Run ``save``; on a slug collision draw a new uniqueId and try again.
+
+    Inside a transaction each attempt gets a savepoint so a collision does
+    not break the surrounding atomic block.
+    """
+    for attempt in range(IDENTITY_ATTEMPTS):
+        try:
+            with transaction.atomic() if connection.in_atomic_block else nullcontext():
+                return save(*args, **kwargs)
+        except IntegrityError as e:
+            if attempt == IDENTITY_ATTEMPTS - 1 or not _is_slug_conflict(e):
+                raise
+            instance.uniqueId = None
+            instance.populate_defaults()
+
+
+def retry_on_slug_conflict(write, new_objects):
+    """Call ``write()``, which must be atomic; on a slug collision give
+    ``new_objects`` fresh uniqueIds and call it again"""
+    for attempt in range(IDENTITY_ATTEMPTS):
+        try:
+            return write()
+        except IntegrityError as e:
+            if attempt == IDENTITY_ATTEMPTS - 1 or not _is_slug_conflict(e):
+                raise
+            for obj in new_objects:
+                # The failed bulk_create may already have handed out primary keys
+                obj.pk = None
+                obj._state.adding = True
+                obj.uniqueId = None
+                obj.populate_defaults()
+
+
+def bulk_create_unique(model, objects, batch_size=None):
+    """bulk_create() records prepared with populate_defaults(), retrying on slug collisions"""
+    def write():
+        with transaction.atomic():
+            return model.objects.bulk_create(objects, batch_size=batch_size)
+    return retry_on_slug_conflict(write, objects)
+
+class InsufficientStock(ValueError):
+    """Raised when products do not have enough stock; nothing has been deducted"""
+
+    def __init__(self, shortages):
+        # [{'product_id', 'title', 'available', 'requested'}, ...]
+        self.shortages = shortages
+        details = ', '.join(
+            f"{s['title']} (Available: {s['available']}, Requested: {s['requested']})" for s in shortages
+        )
+        super().__init__(f'Insufficient inventory for {details}')
+
+
+# Products per stock UPDATE: the id list and the two CASE maps stay under SQLite's 999 parameters
+STOCK_CHUNK_SIZE = 150
+
+
+def _quantity_case(quantities):
+    """CASE id WHEN ... THEN quantity END for a {product_id: quantity} map"""
+    return Case(
+        *[When(id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def _stock_chunks(quantities):
+    """Split a {product_id: quantity} map into maps of at most STOCK_CHUNK_SIZE products"""
+    items = iter(quantities.items())
+    while chunk := dict(islice(items, STOCK_CHUNK_SIZE)):
+        yield chunk
+
+
+def deduct_stock(quantities):
+    """Deduct {product_id: quantity} from stock with one conditional UPDATE per chunk of products.
+
+    Only rows with ``quantity >= requested`` are touched, so concurrent
+    requests cannot oversell. All-or-nothing: if any product is short the
+    updates are rolled back and InsufficientStock lists every short product.
+    """
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity}
+    if not quantities:
+        return
+
+    with transaction.atomic():
+        updated = 0
+        for chunk in _stock_chunks(quantities):
+            case = _quantity_case(chunk)
+            updated += Product.objects.filter(id__in=chunk, quantity__gte=case).update(quantity=F('quantity') - case)
+        if updated == len(quantities):
+            return
+        transaction.set_rollback(True)
+
+    shortages = []
+    for chunk in _stock_chunks(quantities):
+        for product in Product.objects.filter(id__in=chunk).only('id', 'title', 'quantity'):
+            available = product.quantity or 0
+            if available < quantities[product.id]:
+                shortages.append({
+                    'product_id': product.id,
+                    'title': product.title,
+                    'available': available,
+                    'requested': quantities[product.id],
+                })
+    raise InsufficientStock(shortages)
+
+
+def restore_stock(quantities):
+    """Add {product_id: quantity} back to stock with one UPDATE per chunk of products"""
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity}
+    for chunk in _stock_chunks(quantities):
+        Product.objects.filter(id__in=chunk).update(
+            quantity=Coalesce(F('quantity'), Value(0)) + _quantity_case(chunk)
+        )
+
 
 class Client(models.Model):
     clientname = models.CharField(null=True, blank=True, max_length=200)
@@ -10,38 +222,30 @@ class Client(models.Model):
     uniqueId = models.CharField(null=True, blank=True, max_length=100)
     adress = models.CharField(null=True, blank=True, max_length=200)
     mf = models.CharField(null=True, blank=True, max_length=100)
+    payment_terms = models.PositiveIntegerField(null=True, blank=True,
+                                                help_text="Days to pay an invoice; the company default when empty")
     slug = models.SlugField(max_length=500, unique=True, blank=True, null=True)
+    # normalize_name(clientname), indexed for the client autocomplete
+    search_name = models.CharField(max_length=SEARCH_NAME_LENGTH, blank=True, default='', db_index=True, editable=False)
     date_created = models.DateTimeField(blank=True, null=True)
     last_updated = models.DateTimeField(blank=True, null=True)
 
     def __str__(self):
         return f"{self.clientname} {self.uniqueId}"
 
-    def save(self, *args, **kwargs):
-
-        # Set creation timestamp only first time
+    def populate_defaults(self, now=None):
+        """Fill timestamps, uniqueId and slug; also used before bulk_create(), which skips save()"""
+        now = now or timezone.localtime(timezone.now())
         if not self.date_created:
-            self.date_created = timezone.localtime(timezone.now())
-
-        # Generate unique id if missing
-        if not self.uniqueId:
-            self.uniqueId = str(uuid4()).split('-')[4]
-
-        # Create slug based on name + unique id
-        base_slug = slugify(f"{self.clientname}-{self.uniqueId}")
-        slug = base_slug
-        counter = 1
-
-        # Ensure slug is unique
-        while Client.objects.filter(slug=slug).exclude(pk=self.pk).exists():
-            slug = f"{base_slug}-{counter}"
-            counter += 1
+            self.date_created = now
+        assign_identity(self, self.clientname, "client")
+        self.search_name = normalize_name(self.clientname)
+        self.last_updated = now
 
-        self.slug = slug
-        self.last_updated = timezone.localtime(timezone.now())
+    def save(self, *args, **kwargs):
+        self.populate_defaults()
+        save_unique(self, super().save, *args, **kwargs)
 
-        super().save(*args, **kwargs)
-        
 class Product(models.Model):
     CURRENCY = [
         ('TND', 'Tunisian Dinar'),
@@ -56,31 +260,66 @@ class Product(models.Model):
 
     uniqueId = models.CharField(null=True, blank=True, max_length=100)
     slug = models.SlugField(max_length=500, unique=True, blank=True, null=True)
+    # normalize_name(title), indexed for the product autocomplete
+    search_name = models.CharField(max_length=SEARCH_NAME_LENGTH, blank=True, default='', db_index=True, editable=False)
     date_created = models.DateTimeField(blank=True, null=True)
     last_updated = models.DateTimeField(blank=True, null=True)
 
+    class Meta:
+        # Keyset pagination: one index per sortable column, id as tiebreaker (see pagination.py)
+        indexes = [models.Index(fields=['title', 'id']), models.Index(fields=['price', 'id'])]
+
     def __str__(self):
         return '{}{}'.format(self.title, self.uniqueId)
 
     def get_absolute_url(self):
         return reversed('product-detail', kwargs={'slug': self.slug})
 
-    def save(self, *args, **kwargs):
-        now = timezone.localtime(timezone.now())
+    def populate_defaults(self, now=None):
+        """Fill timestamps, uniqueId and slug; also used before bulk_create(), which skips save()"""
+        now = now or timezone.localtime(timezone.now())
         
         if self.date_created is None:
             self.date_created = now
         
-        if self.uniqueId is None:
-            self.uniqueId = str(uuid4()).split('-')[4]
-
-        # Generate a unique slug using title + uniqueId
-        if not self.slug:
-            base_slug = slugify(self.title or "product")
-            self.slug = f"{base_slug}-{self.uniqueId}"
+        # Slug is title + uniqueId
+        assign_identity(self, self.title, "product")
+        self.search_name = normalize_name(self.title)
 
         self.last_updated = now
-        super(Product, self).save(*args, **kwargs)
+
+    # What invoice documents show of a product
+    DOCUMENT_FIELDS = ('title', 'price', 'currency')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._document_snapshot = instance.document_fields(loaded_only=True)
+        return instance
+
+    def document_fields(self, loaded_only=False):
+        if loaded_only and not set(self.DOCUMENT_FIELDS) <= self.__dict__.keys():
+            return None
+        return tuple(getattr(self, field) for field in self.DOCUMENT_FIELDS)
+
+    def save(self, *args, **kwargs):
+        self.populate_defaults()
+        adding = self._state.adding
+        previous = getattr(self, '_document_snapshot', None)
+        save_unique(self, super(Product, self).save, *args, **kwargs)
+        current = self.document_fields()
+        # A new product is on no invoice yet; an edit only matters if it shows on the documents
+        if not adding and previous != current:
+            bump_document_version('catalog')
+        self._document_snapshot = current
+
+    def delete(self, *args, **kwargs):
+        # Deleting a product cascades to its invoice lines, so refresh those invoices' totals; that moves
+        # their last_updated, and with it their document cache keys
+        invoice_ids = list(self.invoiceproduct_set.values_list('invoice_id', flat=True))
+        result = super().delete(*args, **kwargs)
+        Invoice.objects.filter(id__in=invoice_ids).refresh_totals()
+        return result
 
 
 class InvoiceProduct(models.Model):
@@ -108,6 +347,95 @@ class InvoiceProduct(models.Model):
         if not self.unit_price:
             self.unit_price = self.product.price
         super().save(*args, **kwargs)
+        self.invoice.refresh_totals()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self.invoice.refresh_totals()
+        return result
+
+
+def empty_stats(statuses):
+    """Zeroed status statistics: total/<status> invoice counts and amounts"""
+    stats = {'total_invoices': 0, 'total_amount': quantize_amount(0)}
+    for status in statuses:
+        stats[f'{status.lower()}_invoices'] = 0
+        stats[f'{status.lower()}_amount'] = quantize_amount(0)
+    return stats
+
+
+class InvoiceQuerySet(models.QuerySet):
+    def status_stats(self):
+        """Invoice counts and summed totals, overall and per status, from one aggregate query"""
+        aggregates = {'total_invoices': Count('id'), 'total_amount': Sum('total')}
+        for status, _ in self.model.STATUS:
+            key = status.lower()
+            aggregates[f'{key}_invoices'] = Count('id', filter=Q(status=status))
+            aggregates[f'{key}_amount'] = Sum('total', filter=Q(status=status))
+        stats = self.order_by().aggregate(**aggregates)
+        for key, value in stats.items():
+            if key.endswith('_amount'):
+                stats[key] = quantize_amount(value)
+        return stats
+
+    def refresh_totals(self):
+        """Recompute the stored totals of these invoices in bulk (a fixed number of queries).
+
+        The bulk counterpart of Invoice.refresh_totals().
+        """
+        invoices = list(self.only('id', *self.model.TOTAL_FIELDS))
+        totals = compute_totals([invoice.id for invoice in invoices])
+        now = timezone.localtime(timezone.now())
+        for invoice in invoices:
+            for field in self.model.TOTAL_FIELDS:
+                setattr(invoice, field, totals[invoice.id][field])
+            invoice.last_updated = now
+        self.model.objects.bulk_update(invoices, self.model.TOTAL_FIELDS + ['last_updated'], batch_size=500)
+
+    def mark_overdue(self, today, batch_size=None):
+        """Move the CURRENT invoices due before ``today`` to OVERDUE; returns how many moved.
+
+        Each batch is one UPDATE over a range of the (status, due_date) index,
+        committed on its own. ``batch_size`` bounds how long each transaction
+        holds the write lock (None: a single batch).
+        """
+        due = self.filter(status='CURRENT', due_date__lt=today).order_by('due_date', 'id')
+        moved = 0
+        while True:
+            batch = self.model.objects.filter(pk__in=due.values('pk')[:batch_size]) if batch_size else due
+            updated = batch.update(status='OVERDUE', last_updated=timezone.localtime(timezone.now()))
+            moved += updated
+            if not updated or not batch_size:
+                return moved
+
+    def with_line_subtotal(self):
+        """Annotate each invoice with SUM(quantity * unit_price) over its lines"""
+        return self.annotate(
+            line_subtotal=Coalesce(
+                Sum(F('invoice_products__quantity') * F('invoice_products__unit_price'), output_field=FloatField()),
+                Value(0.0),
+            )
+        )
+
+
+def compute_totals(invoice_ids):
+    """Compute subtotal/discount/TVA/timbre/total for many invoices in one query.
+
+    ``invoice_ids`` may be a list of ids or an Invoice queryset. Returns a dict
+    mapping invoice id to its amounts, rounded like the stored totals.
+    """
+    rows = (
+        Invoice.objects.filter(id__in=invoice_ids)
+        .with_line_subtotal()
+        .values_list('id', 'line_subtotal', 'discount', 'tva', 'timbre_fiscal')
+    )
+    totals = {}
+    for invoice_id, line_subtotal, discount, tva, timbre_fiscal in rows:
+        # Derive from the exact subtotal, like the per-instance calculators; only the results are rounded
+        line_subtotal = Decimal(str(line_subtotal or 0)).quantize(LINE_SUBTOTAL_QUANTUM, rounding=ROUND_HALF_UP)
+        amounts = invoice_amounts(line_subtotal, discount, tva, timbre_fiscal)
+        totals[invoice_id] = {key: quantize_amount(value) for key, value in amounts.items()}
+    return totals
 
 
 class Invoice(models.Model):
@@ -130,33 +458,70 @@ class Invoice(models.Model):
     timbre_fiscal = models.DecimalField(max_digits=10, decimal_places=3, default=1.000, help_text="Timbre fiscal amount (D)", null=True, blank=True)
     discount = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, help_text="Discount percentage", null=True, blank=True)
 
+    # Stored totals, kept current by InvoiceProduct.save()/delete() and Invoice.save()
+    subtotal = models.DecimalField(max_digits=14, decimal_places=3, default=0, help_text="Sum of line totals")
+    discount_amount = models.DecimalField(max_digits=14, decimal_places=3, default=0, help_text="Discount amount (D)")
+    tva_amount = models.DecimalField(max_digits=14, decimal_places=3, default=0, help_text="TVA amount (D)")
+    total = models.DecimalField(max_digits=14, decimal_places=3, default=0, help_text="Grand total including TVA and timbre fiscal")
+
     uniqueId = models.CharField(null=True, blank=True, max_length=100)
     slug = models.SlugField(max_length=500, unique=True, null=True)
     date_created = models.DateTimeField(blank=True, null=True)
+    due_date = models.DateField(blank=True, null=True)
     last_updated = models.DateTimeField(blank=True, null=True)
 
+    objects = InvoiceQuerySet.as_manager()
+
+    class Meta:
+        # Keyset pagination: one index per sortable column, id as tiebreaker (see pagination.py)
+        indexes = [models.Index(fields=['date_created', 'id']), models.Index(fields=['total', 'id']),
+                   # A client's latest invoice, looked up by the balance triggers when one goes away
+                   models.Index(fields=['client', 'date_created']),
+                   # The overdue sweep: CURRENT invoices due before a date are one range
+                   models.Index(fields=['status', 'due_date'])]
+
+    TOTAL_FIELDS = ['subtotal', 'discount_amount', 'tva_amount', 'total']
+
     def __str__(self):
         return f"{self.title} {self.uniqueId}"
 
     def get_absolute_url(self):
         return reversed('invoice-detail', kwargs={'slug': self.slug})
+
+    @property
+    def subtotal_after_discount(self):
+        return self.subtotal - self.discount_amount
     
-    def adjust_inventory(self):
-        """Deduct invoice quantities from product inventory"""
+    def line_quantities(self):
+        """Map of product id to invoiced quantity"""
+        quantities = {}
+        for product_id, quantity in self.invoice_products.values_list('product_id', 'quantity'):
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        return quantities
+
+    def adjust_inventory(self, quantities=None):
+        """Deduct invoice quantities from product inventory.
+
+        All lines are deducted atomically or not at all; raises
+        InsufficientStock naming the short products. Callers that already
+        hold the {product_id: quantity} map can pass it to skip reading the lines.
+        """
         if self.inventory_adjusted:
             return False  # Already adjusted
         
-        for invoice_product in self.invoice_products.all():
-            product = invoice_product.product
-            if product.quantity >= invoice_product.quantity:
-                product.quantity -= invoice_product.quantity
-                product.save()
-            else:
-                # Not enough stock
+        if quantities is None:
+            quantities = self.line_quantities()
+        # last_updated moves too: the printed invoice warns while stock is not deducted
+        now = timezone.localtime(timezone.now())
+        with transaction.atomic():
+            # Claim the invoice first so two workers cannot deduct it twice
+            if not Invoice.objects.filter(pk=self.pk, inventory_adjusted=False).update(inventory_adjusted=True,
+                                                                                         last_updated=now):
                 return False
+            deduct_stock(quantities)
         
         self.inventory_adjusted = True
-        self.save()
+        self.last_updated = now
         return True
     
     def restore_inventory(self):
@@ -164,15 +529,75 @@ class Invoice(models.Model):
         if not self.inventory_adjusted:
             return False
         
-        for invoice_product in self.invoice_products.all():
-            product = invoice_product.product
-            product.quantity += invoice_product.quantity
-            product.save()
+        quantities = self.line_quantities()
+        now = timezone.localtime(timezone.now())
+        with transaction.atomic():
+            if not Invoice.objects.filter(pk=self.pk, inventory_adjusted=True).update(inventory_adjusted=False,
+                                                                                        last_updated=now):
+                return False
+            restore_stock(quantities)
         
         self.inventory_adjusted = False
-        self.save()
+        self.last_updated = now
         return True
     
+    def reconcile_lines(self, quantities):
+        """Bring the lines in line with a {product_id: quantity} map.
+
+        Only added, removed and re-quantified lines are written, in bulk, and
+        when inventory has been adjusted only the net stock deltas are applied.
+        Existing lines keep their invoiced unit price; new lines take the
+        product's current price. Sets the subtotal (the caller saves the invoice).
+        """
+        lines = {line.product_id: line for line in self.invoice_products.all()}
+
+        deltas = {}
+        removed = []
+        for product_id, line in lines.items():
+            if product_id not in quantities:
+                removed.append(line)
+                deltas[product_id] = -line.quantity
+
+        changed = []
+        for product_id, quantity in quantities.items():
+            line = lines.get(product_id)
+            if line is not None and line.quantity != quantity:
+                deltas[product_id] = quantity - line.quantity
+                line.quantity = quantity
+                changed.append(line)
+
+        added_ids = [product_id for product_id in quantities if product_id not in lines]
+        products = Product.objects.in_bulk(added_ids) if added_ids else {}
+        if len(products) != len(added_ids):
+            raise Product.DoesNotExist('One or more selected products do not exist.')
+        added = [
+            InvoiceProduct(
+                invoice=self,
+                product=products[product_id],
+                quantity=quantities[product_id],
+                unit_price=products[product_id].price or 0.0,
+            )
+            for product_id in added_ids
+        ]
+        for line in added:
+            deltas[line.product_id] = line.quantity
+
+        with transaction.atomic():
+            if self.inventory_adjusted:
+                deduct_stock({product_id: delta for product_id, delta in deltas.items() if delta > 0})
+                restore_stock({product_id: -delta for product_id, delta in deltas.items() if delta < 0})
+            if removed:
+                InvoiceProduct.objects.filter(id__in=[line.id for line in removed]).delete()
+            if changed:
+                InvoiceProduct.objects.bulk_update(changed, ['quantity'])
+            if added:
+                InvoiceProduct.objects.bulk_create(added)
+
+        kept = [line for product_id, line in lines.items() if product_id in quantities] + added
+        self.subtotal = sum((line.get_line_total() for line in kept), Decimal('0'))
+        self.apply_amounts()
+        return bool(removed or changed or added)
+
     def calculate_subtotal(self):
         """Calculate subtotal (before TVA and fees)"""
         from decimal import Decimal
@@ -201,32 +626,273 @@ class Invoice(models.Model):
     
     def calculate_total(self):
         """Calculate final total (subtotal - discount + TVA + timbre fiscal)"""
-        from decimal import Decimal
-        subtotal = self.calculate_subtotal()
-        discount_amount = self.calculate_discount_amount()
-        tva_amount = self.calculate_tva_amount()
-        timbre = self.timbre_fiscal or Decimal('0')
-        
-        total = subtotal - discount_amount + tva_amount + timbre
-        return total
+        amounts = invoice_amounts(self.calculate_subtotal(), self.discount, self.tva, self.timbre_fiscal)
+        return amounts['total']
 
-    def save(self, *args, **kwargs):
-        now = timezone.localtime(timezone.now())
+    def apply_amounts(self):
+        """Derive the stored discount, TVA and total from the exact (unrounded) line subtotal in ``subtotal``"""
+        amounts = invoice_amounts(self.subtotal, self.discount, self.tva, self.timbre_fiscal)
+        self.subtotal = quantize_amount(self.subtotal)
+        self.discount_amount = quantize_amount(amounts['discount_amount'])
+        self.tva_amount = quantize_amount(amounts['tva_amount'])
+        self.total = quantize_amount(amounts['total'])
+        self._amount_inputs = self.amount_inputs()
+
+    def amount_inputs(self):
+        return (self.subtotal, self.discount, self.tva, self.timbre_fiscal)
+
+    def sync_amounts(self):
+        """Bring the derived amounts in step with the subtotal and rates before a save"""
+        derived = getattr(self, '_amount_inputs', None)
+        if derived is None and self._state.adding or derived is not None and self.subtotal != derived[0]:
+            # A new invoice, or a subtotal just set from the lines: it is exact
+            self.apply_amounts()
+        elif derived is None or self.amount_inputs() != derived:
+            # The rates changed, but the stored subtotal is rounded: start again from the lines
+            self.refresh_totals(save=False)
+
+    def refresh_totals(self, save=True):
+        """Recompute the stored totals from the invoice lines (one query)"""
+        subtotal = Decimal('0')
+        for quantity, unit_price in self.invoice_products.values_list('quantity', 'unit_price'):
+            subtotal += Decimal(str(unit_price)) * Decimal(str(quantity))
+        self.subtotal = subtotal
+        self.apply_amounts()
+        if save and self.pk:
+            self.save(update_fields=self.TOTAL_FIELDS + ['last_updated'])
+
+    def populate_defaults(self, now=None, payment_terms=None):
+        """Fill timestamps, due date, uniqueId, slug and derived amounts; also used before bulk_create().
+
+        Bulk callers pass the client's ``payment_terms`` to spare a client lookup per invoice.
+        """
+        now = now or timezone.localtime(timezone.now())
         if not self.date_created:
             self.date_created = now
-        if not self.uniqueId:
-            self.uniqueId = str(uuid4()).split('-')[4]
-        if not self.slug:
-            base_slug = slugify(self.title or "invoice")
-            self.slug = f"{base_slug}-{self.uniqueId}"
+        if not self.due_date:
+            self.due_date = self.default_due_date(payment_terms)
+        assign_identity(self, self.title, "invoice")
         self.last_updated = now
-        super().save(*args, **kwargs)
+        # tva/discount/timbre may have changed, so keep the derived amounts in step
+        self.sync_amounts()
+
+    def default_due_date(self, payment_terms=None):
+        """The creation day plus the client's payment terms, or SALES_DEFAULT_PAYMENT_TERMS days"""
+        if payment_terms is None and self.client_id is not None:
+            payment_terms = self.client.payment_terms
+        if payment_terms is None:
+            payment_terms = settings.SALES_DEFAULT_PAYMENT_TERMS
+        return timezone.localdate(self.date_created) + timedelta(days=payment_terms)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The inputs the stored amounts were derived from, when all were loaded
+        if {'subtotal', 'discount', 'tva', 'timbre_fiscal'} <= instance.__dict__.keys():
+            instance._amount_inputs = instance.amount_inputs()
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.populate_defaults()
+        save_unique(self, super().save, *args, **kwargs)
     
     def delete(self, *args, **kwargs):
         # Restore inventory before deleting invoice
         self.restore_inventory()
         super().delete(*args, **kwargs)
 
+
+class InvoiceStats(models.Model):
+    """Invoice count and summed total per status.
+
+    Lets the unfiltered invoices page read its counters without scanning the
+    invoice table. Maintained by the triggers of migration 0012 on every
+    invoice write, bulk deletes and updates included; rebuild() recomputes
+    everything from the invoices.
+    """
+    status = models.CharField(max_length=100, unique=True)
+    count = models.IntegerField(default=0)
+    amount = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+
+    def __str__(self):
+        return f"{self.status}: {self.count} ({self.amount})"
+
+    @classmethod
+    def summary(cls):
+        """The counters in the same shape as InvoiceQuerySet.status_stats(), from one small query"""
+        stats = empty_stats(status for status, _ in Invoice.STATUS)
+        for status, count, amount in cls.objects.values_list('status', 'count', 'amount'):
+            stats['total_invoices'] += count
+            stats['total_amount'] += amount
+            stats[f'{status.lower()}_invoices'] = count
+            stats[f'{status.lower()}_amount'] = quantize_amount(amount)
+        stats['total_amount'] = quantize_amount(stats['total_amount'])
+        return stats
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every counter from the invoice table"""
+        # Every known status gets a row, even before its first invoice
+        stats = {status: cls(status=status) for status, _ in Invoice.STATUS}
+        for row in Invoice.objects.order_by().values('status').annotate(count=Count('id'), amount=Sum('total')):
+            stats[row['status']] = cls(status=row['status'], count=row['count'], amount=quantize_amount(row['amount']))
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(stats.values())
+
+class DocumentVersion(models.Model):
+    """A version counter in the invoice document cache keys (see documents.py), shared by every process"""
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'sales_document_version'
+
+    def __str__(self):
+        return f"{self.name}: {self.version}"
+
+class ProductSearch(models.Model):
+    """A row of the sales_product_fts FTS5 index over product title and description.
+
+    The table and the triggers that keep it in step with sales_product are
+    created by migration 0006; Django only reads it.
+    """
+    product = models.OneToOneField(Product, primary_key=True, db_column='rowid', db_constraint=False,
+                                   on_delete=models.DO_NOTHING, related_name='search_entry')
+    document = SearchDocumentField(db_column='sales_product_fts')
+    # bm25() with the column weights configured on the table: lower is a better match
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'sales_product_fts'
+
+class InvoiceSearch(models.Model):
+    """A row of the sales_invoice_fts FTS5 index over invoice title, notes, uniqueId and client name.
+
+    Triggers on sales_invoice and sales_client (migration 0006) keep it in
+    step, including when a client is renamed.
+    """
+    invoice = models.OneToOneField(Invoice, primary_key=True, db_column='rowid', db_constraint=False,
+                                   on_delete=models.DO_NOTHING, related_name='search_entry')
+    document = SearchDocumentField(db_column='sales_invoice_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'sales_invoice_fts'
+
+class ClientDailyRevenue(models.Model):
+    """Invoice count, revenue (totals TTC), TVA and units sold per client and day.
+
+    Maintained by the triggers of migration 0008 on every invoice and line
+    write, including bulk ones; rebuild() recomputes it from scratch.
+    """
+    day = models.DateField()
+    # 0 for invoices without a client, so the (day, client) upsert always has a key
+    client = models.ForeignKey(Client, null=True, db_constraint=False, on_delete=models.DO_NOTHING, related_name='+')
+    invoices = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+    tva = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+    units = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'sales_client_daily'
+        # Date ranges are index range scans
+        constraints = [models.UniqueConstraint(fields=['day', 'client'], name='sales_client_daily_day_client')]
+
+    def __str__(self):
+        return f"{self.day} client {self.client_id}: {self.revenue}"
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute both rollup tables from the invoices and their lines"""
+        with transaction.atomic(), connection.cursor() as cursor:
+            for statement in REBUILD_ROLLUPS:
+                cursor.execute(statement)
+
+
+class ProductDailySales(models.Model):
+    """Units sold and line revenue (quantity x unit price, before discount and TVA) per product and day.
+
+    Maintained by the same triggers as ClientDailyRevenue.
+    """
+    day = models.DateField()
+    product = models.ForeignKey(Product, db_constraint=False, on_delete=models.DO_NOTHING, related_name='+')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+
+    class Meta:
+        db_table = 'sales_product_daily'
+        constraints = [models.UniqueConstraint(fields=['day', 'product'], name='sales_product_daily_day_product')]
+
+    def __str__(self):
+        return f"{self.day} product {self.product_id}: {self.units}"
+
+
+# The triggers of migration 0008 keep these in step; this is their from-scratch equivalent
+REBUILD_ROLLUPS = [
+    "DELETE FROM sales_client_daily",
+    "DELETE FROM sales_product_daily",
+    """INSERT INTO sales_client_daily(day, client_id, invoices, revenue, tva, units)
+    SELECT date(invoice.date_created), coalesce(invoice.client_id, 0), count(*),
+           coalesce(sum(invoice.total), 0), coalesce(sum(invoice.tva_amount), 0),
+           coalesce(sum((SELECT sum(quantity) FROM sales_invoiceproduct WHERE invoice_id = invoice.id)), 0)
+    FROM sales_invoice invoice WHERE invoice.date_created IS NOT NULL
+    GROUP BY 1, 2""",
+    """INSERT INTO sales_product_daily(day, product_id, units, revenue)
+    SELECT date(invoice.date_created), line.product_id, sum(line.quantity), sum(line.quantity * line.unit_price)
+    FROM sales_invoiceproduct line JOIN sales_invoice invoice ON invoice.id = line.invoice_id
+    WHERE invoice.date_created IS NOT NULL
+    GROUP BY 1, 2""",
+]
+
+
+class ClientBalance(models.Model):
+    """What a client owes (CURRENT and OVERDUE totals) and has paid, one row per client.
+
+    Maintained by the triggers of migration 0009 on every client and invoice
+    write, bulk status updates included; rebuild() recomputes it from scratch.
+    """
+    client = models.OneToOneField(Client, primary_key=True, db_constraint=False, on_delete=models.DO_NOTHING,
+                                  related_name='balance')
+    invoices = models.IntegerField(default=0)
+    current_amount = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+    overdue_amount = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+    # current_amount + overdue_amount, stored so that sorting by exposure reads an index
+    outstanding = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+    paid_amount = models.DecimalField(max_digits=16, decimal_places=3, default=0)
+    last_invoice_date = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'sales_client_balance'
+        indexes = [models.Index(fields=['outstanding', 'client'], name='sales_client_balance_exposure')]
+
+    def __str__(self):
+        return f"client {self.client_id}: {self.outstanding} outstanding"
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every client's balance from the invoices"""
+        with transaction.atomic(), connection.cursor() as cursor:
+            for statement in REBUILD_BALANCES:
+                cursor.execute(statement)
+
+
+REBUILD_BALANCES = [
+    "DELETE FROM sales_client_balance",
+    """INSERT INTO sales_client_balance(client_id, invoices, current_amount, overdue_amount, outstanding,
+                                        paid_amount, last_invoice_date)
+    SELECT client.id, count(invoice.id),
+           coalesce(sum(CASE WHEN invoice.status = 'CURRENT' THEN invoice.total END), 0),
+           coalesce(sum(CASE WHEN invoice.status = 'OVERDUE' THEN invoice.total END), 0),
+           coalesce(sum(CASE WHEN invoice.status IN ('CURRENT', 'OVERDUE') THEN invoice.total END), 0),
+           coalesce(sum(CASE WHEN invoice.status = 'PAID' THEN invoice.total END), 0),
+           max(invoice.date_created)
+    FROM sales_client client LEFT JOIN sales_invoice invoice ON invoice.client_id = client.id
+    GROUP BY client.id""",
+]
+
 class Settings(models.Model):
     clientname = models.CharField(null=True, blank=True, max_length=200)
     clientLogo = models.ImageField(default='default_logo.jpg', upload_to='company_logos')
@@ -246,14 +912,97 @@ class Settings(models.Model):
     def get_absolute_url(self):
         return reversed('settings-detail', kwargs={'slug': self.slug})
 
-    def save(self, *args, **kwargs):
-        now = timezone.localtime(timezone.now())
+    def populate_defaults(self, now=None):
+        now = now or timezone.localtime(timezone.now())
         if not self.date_created:
             self.date_created = now
-        if not self.uniqueId:
-            self.uniqueId = str(uuid4()).split('-')[4]
-        if not self.slug:
-            base_slug = slugify(self.clientname or "settings")
-            self.slug = f"{base_slug}-{self.uniqueId}"
+        assign_identity(self, self.clientname, "settings")
         self.last_updated = now
+
+    def save(self, *args, **kwargs):
+        self.populate_defaults()
+        save_unique(self, super().save, *args, **kwargs)
+        bump_document_version('settings')
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        bump_document_version('settings')
+        return result
+
+
+class Job(models.Model):
+    """Import/export work queued by the views and run by `manage.py run_jobs`"""
+    KINDS = [
+        ('import_products', 'Product import'),
+        ('import_invoices', 'Invoice import'),
+        ('export_products', 'Product export'),
+        ('export_invoices', 'Invoice export'),
+    ]
+
+    STATUS = [
+        ('QUEUED', 'QUEUED'),
+        ('RUNNING', 'RUNNING'),
+        ('DONE', 'DONE'),
+        ('FAILED', 'FAILED'),
+    ]
+
+    kind = models.CharField(max_length=30, choices=KINDS)
+    status = models.CharField(max_length=10, choices=STATUS, default='QUEUED')
+    params = models.JSONField(default=dict, blank=True)
+    input_file = models.FileField(upload_to='jobs/input', blank=True)
+    output_file = models.FileField(upload_to='jobs/output', blank=True)
+    processed = models.IntegerField(default=0)
+    total = models.IntegerField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, blank=True, null=True, on_delete=models.SET_NULL)
+    date_created = models.DateTimeField(blank=True, null=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'id'])]
+
+    def __str__(self):
+        return f"Job {self.id} {self.kind} {self.status}"
+
+    @property
+    def is_finished(self):
+        return self.status in ('DONE', 'FAILED')
+
+    @classmethod
+    def claim_next(cls):
+        """Mark the oldest queued job RUNNING and return it, or None when the queue is empty.
+
+        The claim is a conditional UPDATE, so concurrent workers never run the
+        same job and no long write transaction is held on SQLite.
+        """
+        while True:
+            job_id = cls.objects.filter(status='QUEUED').order_by('id').values_list('id', flat=True).first()
+            if job_id is None:
+                return None
+            claimed = cls.objects.filter(pk=job_id, status='QUEUED').update(
+                status='RUNNING', started=timezone.localtime(timezone.now())
+            )
+            if claimed:
+                return cls.objects.get(pk=job_id)
+
+    def report_progress(self, processed, total=None):
+        """Store the number of rows handled so far without touching other fields"""
+        self.processed = processed
+        values = {'processed': processed}
+        if total is not None:
+            self.total = values['total'] = total
+        Job.objects.filter(pk=self.pk).update(**values)
+
+    def save(self, *args, **kwargs):
+        if not self.date_created:
+            self.date_created = timezone.localtime(timezone.now())
         super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        # Remove the uploaded file and the export result along with the job
+        for fieldfile in (self.input_file, self.output_file):
+            if fieldfile:
+                fieldfile.delete(save=False)
+        super().delete(*args, **kwargs)
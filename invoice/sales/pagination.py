@@ -0,0 +1,139 @@
+"""Keyset (cursor) pagination for the product and invoice lists.
+
+A page is fetched with a range condition on ``(sort column, id)`` read from an
+index, instead of COUNT(*) plus OFFSET, so deep pages cost the same as the
+first one. Only whitelisted sort columns with a matching index are accepted.
+
+Next/previous links carry a signed token holding the sort and the boundary
+row's ``(value, id)``. Rows with a NULL sort value are served as their own
+segment (first when ascending, last when descending, as SQLite orders them),
+so every step is still an index range scan.
+"""
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db.models import Max, Q
+
+CURSOR_SALT = 'sales.pagination'
+
+# ?sort= values each list accepts; each column has an (column, id) index
+PRODUCT_SORTS = ('title', '-title', 'price', '-price')
+INVOICE_SORTS = ('-date_created', 'date_created', '-total', 'total')
+# Exposure, from the (outstanding, client) index of the balance table
+CLIENT_SORTS = ('-outstanding',)
+
+
+def clean_sort(value, allowed, default):
+    """``value`` if it is a whitelisted sort, else ``default``"""
+    return value if value in allowed else default
+
+
+def estimate_rows(model):
+    """Upper-bound row count from the highest id: one index lookup instead of a COUNT(*) scan"""
+    return model.objects.aggregate(highest=Max('pk'))['highest'] or 0
+
+
+class CursorPage:
+    """One page of rows plus the tokens for its neighbours; iterates like a Paginator page"""
+
+    def __init__(self, object_list, sort, next_position=None, previous_position=None, estimated_total=None):
+        self.object_list = object_list
+        self.sort = sort
+        self.next_cursor = next_position and _dump(sort, 'next', next_position)
+        self.previous_cursor = previous_position and _dump(sort, 'previous', previous_position)
+        self.estimated_total = estimated_total
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return bool(self.next_cursor)
+
+    def has_previous(self):
+        return bool(self.previous_cursor)
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def cursor_page(queryset, sort, cursor=None, per_page=20, estimated_total=None):
+    """The page of ``queryset`` ordered by ``sort`` (a whitelisted column, '-' for descending) then id.
+
+    ``cursor`` is a token from a previous page; a missing, tampered or stale
+    one (issued for another sort) gives the first page.
+    """
+    field_name = sort.lstrip('-')
+    descending = sort.startswith('-')
+    field = queryset.model._meta.get_field(field_name)
+    direction, position = _load(cursor, sort, field)
+
+    if direction == 'previous':
+        # Walk backwards from the first row of the page the link was on
+        rows = _rows_after(queryset, field_name, not descending, position, per_page + 1)
+        if len(rows) > per_page:
+            rows = rows[:per_page][::-1]
+            return CursorPage(rows, sort, _position(rows[-1], field), _position(rows[0], field), estimated_total)
+        # Fewer rows than a page before the boundary: show the first page instead
+        position = None
+
+    rows = _rows_after(queryset, field_name, descending, position, per_page + 1)
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    return CursorPage(
+        rows, sort,
+        next_position=_position(rows[-1], field) if has_next else None,
+        previous_position=_position(rows[0], field) if position is not None and rows else None,
+        estimated_total=estimated_total,
+    )
+
+
+def _rows_after(queryset, field_name, descending, position, limit):
+    """Up to ``limit`` rows strictly after ``position`` in (field, id) order"""
+    op = 'lt' if descending else 'gt'
+    # SQLite puts NULLs first when ascending and last when descending
+    segments = (False, True) if descending else (True, False)
+    start = 0 if position is None else segments.index(position[0] is None)
+
+    rows = []
+    for index, nulls in enumerate(segments[start:], start):
+        segment = queryset.filter(**{f'{field_name}__isnull': nulls})
+        if index == start and position is not None:
+            value, pk = position
+            if nulls:
+                segment = segment.filter(**{f'pk__{op}': pk})
+            else:
+                # Written so SQLite turns it into one index range: field <= v AND (field < v OR id < pk)
+                segment = segment.filter(Q(**{f'{field_name}__{op}e': value}) &
+                                         (Q(**{f'{field_name}__{op}': value}) | Q(**{f'pk__{op}': pk})))
+        order = ('-pk',) if descending else ('pk',)
+        if not nulls:
+            order = (f'-{field_name}' if descending else field_name,) + order
+        rows += segment.order_by(*order)[:limit - len(rows)]
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+def _position(obj, field):
+    return field.value_from_object(obj), obj.pk
+
+
+def _dump(sort, direction, position):
+    value, pk = position
+    field_value = None if value is None else str(value)
+    return signing.dumps([sort, direction, field_value, pk], salt=CURSOR_SALT, compress=True)
+
+
+def _load(cursor, sort, field):
+    """(direction, (value, id)) from a token, or (None, None) for the first page"""
+    if not cursor:
+        return None, None
+    try:
+        token_sort, direction, value, pk = signing.loads(cursor, salt=CURSOR_SALT)
+        if token_sort != sort or direction not in ('next', 'previous'):
+            return None, None
+        return direction, (None if value is None else field.to_python(value), int(pk))
+    except (signing.BadSignature, ValidationError, ValueError, TypeError):
+        return None, None
@@ -0,0 +1,107 @@
+"""Per-request profiling, cheap enough to leave on in production.
+
+Every request gets its SQL counted and timed through a database execute
+wrapper and a ``Server-Timing`` header (visible in the browser's network
+panel). A query shape repeated ``SALES_PROFILING_REPEAT_LIMIT`` times or
+more in one request, the usual sign of an N+1 loop, is logged as a warning
+on the ``sales.profiling`` logger.
+
+A ``SALES_PROFILING_SAMPLE_RATE`` share of requests also runs under
+cProfile; the profile is written to ``SALES_PROFILING_DIR`` when the request
+took ``SALES_PROFILING_SLOW_MS`` or longer. Open dumps with
+``python -m pstats <file>`` or snakeviz.
+
+Queries run while a streaming response is consumed are not counted.
+"""
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# IN (%s, %s, ...) and multi-row VALUES lists differ only in length: same shape
+PARAMETER_LIST = re.compile(r'\((?:%s, )+%s\)')
+
+
+def query_shape(sql):
+    return PARAMETER_LIST.sub('(%s, ...)', sql)
+
+
+class QueryRecorder:
+    """Execute wrapper counting and timing the queries of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+            # Shapes are normalised once at the end, not on every query
+            self.statements[sql] = self.statements.get(sql, 0) + 1
+
+    def repeated(self, limit):
+        """[(count, shape)] of the shapes run ``limit`` times or more, most repeated first"""
+        shapes = {}
+        for sql, count in self.statements.items():
+            shape = query_shape(sql)
+            shapes[shape] = shapes.get(shape, 0) + count
+        return sorted(((count, shape) for shape, count in shapes.items() if count >= limit), reverse=True)
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        profile = cProfile.Profile() if random.random() < settings.SALES_PROFILING_SAMPLE_RATE else None
+
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            if profile is None:
+                response = self.get_response(request)
+            else:
+                response = profile.runcall(self.get_response, request)
+        elapsed = time.perf_counter() - started
+
+        repeated = recorder.repeated(settings.SALES_PROFILING_REPEAT_LIMIT)
+        for count, shape in repeated:
+            logger.warning('%s %s ran the same query %d times: %s', request.method, request.path, count, shape[:300])
+
+        timings = [
+            f'db;dur={recorder.seconds * 1000:.1f};desc="{recorder.count} queries"',
+            f'app;dur={(elapsed - recorder.seconds) * 1000:.1f}',
+        ]
+        if repeated:
+            timings.append(f'repeated;desc="{len(repeated)} repeated query shapes"')
+        if response.has_header('Server-Timing'):
+            # Keep what the view reported, e.g. the invoice document cache outcome
+            timings.append(response['Server-Timing'])
+        response['Server-Timing'] = ', '.join(timings)
+
+        if profile is not None and elapsed * 1000 >= settings.SALES_PROFILING_SLOW_MS:
+            self.dump(profile, request, elapsed)
+        return response
+
+    def dump(self, profile, request, elapsed):
+        match = request.resolver_match
+        name = match.url_name if match and match.url_name else 'unresolved'
+        os.makedirs(settings.SALES_PROFILING_DIR, exist_ok=True)
+        path = os.path.join(settings.SALES_PROFILING_DIR,
+                            f'{time.strftime("%Y%m%d-%H%M%S")}-{name}-{elapsed * 1000:.0f}ms-{os.getpid()}.prof')
+        profile.dump_stats(path)
+        logger.info('Profile of %s %s (%.0f ms) written to %s', request.method, request.path, elapsed * 1000, path)
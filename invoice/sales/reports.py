@@ -0,0 +1,63 @@
+"""Dashboard figures, read from the daily rollup tables instead of scanning invoices and lines"""
+from datetime import date
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+from .models import ClientDailyRevenue, ProductDailySales, quantize_amount
+
+CLIENT_FIGURES = ('invoices', 'revenue', 'tva', 'units')
+PRODUCT_FIGURES = ('units', 'revenue')
+
+
+def add_months(day, count):
+    """The first day of the month ``count`` months after (or before, if negative) ``day``'s month"""
+    month = day.year * 12 + day.month - 1 + count
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def period_report(today, months=12, top=10):
+    """Totals, figures per month and the top clients and products over the last ``months`` months"""
+    start = add_months(today, 1 - months)
+    # Every query is a range scan on the (day, ...) unique index of a rollup table
+    clients = ClientDailyRevenue.objects.filter(day__gte=start)
+    products = ProductDailySales.objects.filter(day__gte=start)
+    client_sums = {figure: Sum(figure) for figure in CLIENT_FIGURES}
+
+    found = {
+        row['month']: _figures(row, CLIENT_FIGURES)
+        for row in clients.annotate(month=TruncMonth('day')).values('month').annotate(**client_sums)
+    }
+    monthly = []
+    for index in range(months):
+        month = add_months(start, index)
+        monthly.append({'month': month, **found.get(month, _figures({}, CLIENT_FIGURES))})
+
+    totals = {figure: sum(row[figure] for row in monthly) for figure in CLIENT_FIGURES}
+    best = max(row['revenue'] for row in monthly)
+    for row in monthly:
+        # Bar length on the dashboard, relative to the best month
+        row['share'] = round(row['revenue'] / best * 100) if best > 0 else 0
+
+    top_clients = [
+        {'client_id': row['client_id'], 'name': row['client__clientname'], **_figures(row, CLIENT_FIGURES)}
+        for row in clients.values('client_id', 'client__clientname').annotate(**client_sums).order_by('-revenue')[:top]
+    ]
+    top_products = [
+        {'product_id': row['product_id'], 'title': row['product__title'], **_figures(row, PRODUCT_FIGURES)}
+        for row in products.values('product_id', 'product__title')
+        .annotate(units=Sum('units'), revenue=Sum('revenue')).order_by('-revenue')[:top]
+    ]
+    return {
+        'start': start,
+        'totals': totals,
+        'monthly': monthly,
+        'top_clients': top_clients,
+        'top_products': top_products,
+    }
+
+
+def _figures(row, figures):
+    """The summed figures of ``row``: missing ones as zero, amounts rounded like invoice totals"""
+    return {
+        figure: quantize_amount(row.get(figure)) if figure in ('revenue', 'tva') else row.get(figure) or 0
+        for figure in figures
+    }
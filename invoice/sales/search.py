@@ -0,0 +1,60 @@
+"""Name lookups for the product and client pickers, and full-text search for the list views"""
+import re
+from .models import normalize_name
+
+AUTOCOMPLETE_LIMIT = 20
+AUTOCOMPLETE_MAX_LIMIT = 50
+
+# Sorts after every character, so [prefix, prefix + PREFIX_END) covers all keys starting with prefix
+PREFIX_END = '\U0010ffff'
+
+
+def autocomplete_limit(params):
+    try:
+        limit = int(params.get('limit', AUTOCOMPLETE_LIMIT))
+    except (TypeError, ValueError):
+        limit = AUTOCOMPLETE_LIMIT
+    return max(1, min(limit, AUTOCOMPLETE_MAX_LIMIT))
+
+
+def match_names(queryset, query, limit=AUTOCOMPLETE_LIMIT, field='search_name'):
+    """Rows whose normalized name starts with ``query``, then rows containing it elsewhere.
+
+    Prefix matches are a range scan on the ``field`` index; substring matches
+    only fill what is left of ``limit``. An empty query lists names in order.
+    """
+    key = normalize_name(query)
+    ordered = queryset.order_by(field, 'id')
+    if not key:
+        return list(ordered[:limit])
+
+    prefix = {f'{field}__gte': key, f'{field}__lt': key + PREFIX_END}
+    results = list(ordered.filter(**prefix)[:limit])
+    if len(results) < limit:
+        results += list(ordered.filter(**{f'{field}__contains': key}).exclude(**prefix)[:limit - len(results)])
+    return results
+
+
+def fts_query(text):
+    """FTS5 query matching every word of ``text`` as a prefix.
+
+    Each word is quoted, so operators and punctuation typed into a search box
+    are never parsed as FTS5 syntax.
+    """
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text or ''))
+
+
+def full_text_search(queryset, text):
+    """Rows of ``queryset`` (products or invoices) matching ``text`` in their search_entry index.
+
+    Text without any word characters leaves ``queryset`` unfiltered.
+    """
+    query = fts_query(text)
+    if not query:
+        return queryset
+    return queryset.filter(search_entry__document__match=query)
+
+
+def order_by_rank(queryset):
+    """Best matches first; only meaningful after full_text_search()"""
+    return queryset.order_by('search_entry__rank', '-pk')
@@ -1,3 +1,1467 @@
-from django.test import TestCase
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import time
+import warnings
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import F
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import Workbook, load_workbook
+from .company import _local, clear_company_settings, company_settings
+from .documents import document_cache_stats
+from .exports import iter_invoices_html
+from .filters import filter_invoices
+from .imports import INVOICE_INSERT_BATCH_SIZE, import_products_excel, import_invoices_excel
+from .jobs import enqueue_job, run_job
+from .models import (Client, ClientBalance, ClientDailyRevenue, DocumentVersion, Product, ProductDailySales, Invoice, InvoiceProduct,
+                     InvoiceStats, InsufficientStock, Job, Settings, compute_totals, deduct_stock, quantize_amount,
+                     restore_stock)
+from .pagination import PRODUCT_SORTS, cursor_page
+from .profiling import ProfilingMiddleware
+from .reports import period_report
+from .search import full_text_search, order_by_rank
 
-# Create your tests here.
+
+class ComputeTotalsTests(TestCase):
+    """The batch totals engine must agree with the per-instance calculators"""
+
+    @classmethod
+    def setUpTestData(cls):
+        client = Client.objects.create(clientname='Acme')
+        prices = [12.345, 0.1, 7.5, 199.999, 3.333]
+        products = [
+            Product.objects.create(title=f'Product {i}', price=price, quantity=1000)
+            for i, price in enumerate(prices)
+        ]
+        rates = [
+            (Decimal('19.00'), Decimal('1.000'), Decimal('0.00')),
+            (Decimal('7.00'), Decimal('0.600'), Decimal('12.50')),
+            (None, None, None),
+            (Decimal('13.00'), Decimal('1.000'), Decimal('33.33')),
+        ]
+        cls.invoices = []
+        for i, (tva, timbre, discount) in enumerate(rates):
+            invoice = Invoice.objects.create(
+                title=f'Invoice {i}', client=client,
+                tva=tva, timbre_fiscal=timbre, discount=discount,
+            )
+            for j, product in enumerate(products[:i + 2]):
+                InvoiceProduct.objects.create(
+                    invoice=invoice, product=product,
+                    quantity=j * 3 + i + 1, unit_price=product.price,
+                )
+            cls.invoices.append(invoice)
+        # An invoice without lines still gets its timbre fiscal
+        cls.invoices.append(Invoice.objects.create(title='Empty', client=client))
+
+    def test_matches_per_instance_calculators(self):
+        ids = [invoice.id for invoice in self.invoices]
+        with self.assertNumQueries(1):
+            totals = compute_totals(ids)
+
+        for invoice in Invoice.objects.filter(id__in=ids):
+            amounts = totals[invoice.id]
+            self.assertEqual(amounts['subtotal'], quantize_amount(invoice.calculate_subtotal()))
+            self.assertEqual(amounts['discount_amount'], quantize_amount(invoice.calculate_discount_amount()))
+            self.assertEqual(amounts['tva_amount'], quantize_amount(invoice.calculate_tva_amount()))
+            self.assertEqual(amounts['timbre_fiscal'], quantize_amount(invoice.timbre_fiscal))
+            self.assertEqual(amounts['total'], quantize_amount(invoice.calculate_total()))
+
+    def test_prices_with_more_than_three_decimals(self):
+        product = Product.objects.create(title='Fine', price=89.3317, quantity=100)
+        invoice = Invoice.objects.create(title='Fine', tva=Decimal('7.00'), timbre_fiscal=Decimal('1.000'),
+                                         discount=Decimal('0.00'))
+        InvoiceProduct.objects.create(invoice=invoice, product=product, quantity=7, unit_price=product.price)
+        invoice = Invoice.objects.get(pk=invoice.pk)
+
+        self.assertEqual(quantize_amount(invoice.calculate_total()), Decimal('670.094'))
+        self.assertEqual(compute_totals([invoice.id])[invoice.id]['total'], Decimal('670.094'))
+        self.assertEqual(invoice.total, Decimal('670.094'))
+
+        # Saving again, or with new rates, starts from the exact line subtotal, not the rounded stored one
+        invoice.save()
+        invoice.tva = Decimal('19.00')
+        invoice.save()
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.total, quantize_amount(invoice.calculate_total()))
+        Invoice.objects.filter(pk=invoice.pk).refresh_totals()
+        self.assertEqual(Invoice.objects.get(pk=invoice.pk).total, invoice.total)
+
+    def test_matches_stored_totals(self):
+        totals = compute_totals(Invoice.objects.all())
+        for invoice in Invoice.objects.all():
+            for field in Invoice.TOTAL_FIELDS:
+                self.assertEqual(getattr(invoice, field), totals[invoice.id][field])
+
+
+class InventoryAdjustmentTests(TestCase):
+    """Stock deduction is all-or-nothing and never oversells"""
+
+    def setUp(self):
+        self.apple = Product.objects.create(title='Apple', price=1.0, quantity=5)
+        self.pear = Product.objects.create(title='Pear', price=2.0, quantity=1)
+        self.invoice = Invoice.objects.create(title='Fruit')
+        InvoiceProduct.objects.create(invoice=self.invoice, product=self.apple, quantity=3, unit_price=1.0)
+        InvoiceProduct.objects.create(invoice=self.invoice, product=self.pear, quantity=2, unit_price=2.0)
+
+    def test_shortage_deducts_nothing_and_names_short_products(self):
+        with self.assertRaises(InsufficientStock) as ctx:
+            self.invoice.adjust_inventory()
+
+        self.assertEqual(ctx.exception.shortages, [
+            {'product_id': self.pear.id, 'title': 'Pear', 'available': 1, 'requested': 2},
+        ])
+        self.apple.refresh_from_db()
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.apple.quantity, 5)
+        self.assertFalse(self.invoice.inventory_adjusted)
+
+    def test_adjust_and_restore_in_constant_queries(self):
+        Product.objects.filter(id=self.pear.id).update(quantity=2)
+        # Lines, claim and one stock UPDATE, plus savepoints; independent of line count
+        with self.assertNumQueries(7):
+            self.assertTrue(self.invoice.adjust_inventory())
+        self.assertFalse(self.invoice.adjust_inventory())
+
+        quantities = dict(Product.objects.values_list('title', 'quantity'))
+        self.assertEqual(quantities, {'Apple': 2, 'Pear': 0})
+
+        self.assertTrue(self.invoice.restore_inventory())
+        quantities = dict(Product.objects.values_list('title', 'quantity'))
+        self.assertEqual(quantities, {'Apple': 5, 'Pear': 2})
+
+    def test_more_than_a_thousand_products(self):
+        products = Product.objects.bulk_create(
+            [Product(title=f'Bulk {i}', price=1.0, quantity=3) for i in range(1200)], batch_size=200,
+        )
+        quantities = {product.id: 2 for product in products}
+        deduct_stock(quantities)
+        self.assertEqual(Product.objects.filter(title__startswith='Bulk', quantity=1).count(), 1200)
+
+        # One short product, in the last chunk, rolls back every chunk
+        with self.assertRaises(InsufficientStock) as ctx:
+            deduct_stock({**{product.id: 1 for product in products}, products[-1].id: 5})
+        self.assertEqual([s['product_id'] for s in ctx.exception.shortages], [products[-1].id])
+        self.assertEqual(Product.objects.filter(title__startswith='Bulk', quantity=1).count(), 1200)
+
+        restore_stock(quantities)
+        self.assertEqual(Product.objects.filter(title__startswith='Bulk', quantity=3).count(), 1200)
+
+
+class InvoiceCreateTests(TestCase):
+    """invoice_create issues the same number of queries whatever the line count"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('clerk', password='secret')
+        self.client.force_login(self.user)
+        self.customer = Client.objects.create(clientname='Acme')
+        self.products = [
+            Product.objects.create(title=f'Product {i}', price=1.5 + i, quantity=100)
+            for i in range(40)
+        ]
+
+    def post_invoice(self, line_count):
+        products_data = [{'product_id': p.id, 'quantity': 2} for p in self.products[:line_count]]
+        return self.client.post(reverse('invoice_create'), {
+            'title': f'{line_count} lines',
+            'client': self.customer.id,
+            'tva': '19', 'timbre_fiscal': '1', 'discount': '0',
+            'products_data': json.dumps(products_data),
+        })
+
+    def count_queries(self, line_count):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post_invoice(line_count)
+        self.assertEqual(response.status_code, 302)
+        return len(ctx.captured_queries)
+
+    def test_query_count_independent_of_lines(self):
+        self.assertEqual(self.count_queries(2), self.count_queries(40))
+
+        invoice = Invoice.objects.get(title='40 lines')
+        self.assertTrue(invoice.inventory_adjusted)
+        self.assertEqual(invoice.invoice_products.count(), 40)
+        self.assertEqual(invoice.total, quantize_amount(invoice.calculate_total()))
+        self.assertEqual(Product.objects.get(id=self.products[0].id).quantity, 96)
+
+
+class InvoiceEditTests(TestCase):
+    """invoice_edit applies only the difference between old and new lines"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('clerk', password='secret')
+        self.client.force_login(self.user)
+        self.customer = Client.objects.create(clientname='Acme')
+        self.apple = Product.objects.create(title='Apple', price=1.0, quantity=10)
+        self.pear = Product.objects.create(title='Pear', price=2.0, quantity=10)
+        self.plum = Product.objects.create(title='Plum', price=3.0, quantity=10)
+        self.invoice = Invoice.objects.create(title='Fruit', client=self.customer)
+        InvoiceProduct.objects.create(invoice=self.invoice, product=self.apple, quantity=2, unit_price=1.0)
+        InvoiceProduct.objects.create(invoice=self.invoice, product=self.pear, quantity=3, unit_price=2.0)
+        self.invoice.adjust_inventory()
+
+    def edit(self, lines, **fields):
+        data = {'title': 'Fruit', 'client': self.customer.id, 'status': 'CURRENT', 'notes': ''}
+        data.update(fields)
+        data['products_data'] = json.dumps([
+            {'product_id': product.id, 'quantity': quantity} for product, quantity in lines
+        ])
+        return self.client.post(reverse('invoice_edit', args=[self.invoice.id]), data)
+
+    def stock(self):
+        return dict(Product.objects.values_list('title', 'quantity'))
+
+    def test_notes_only_edit_leaves_lines_and_stock_alone(self):
+        line_ids = set(self.invoice.invoice_products.values_list('id', flat=True))
+        with CaptureQueriesContext(connection) as ctx:
+            self.edit([(self.apple, 2), (self.pear, 3)], notes='Deliver on Monday')
+
+        writes = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith(('UPDATE "sales_product"', 'INSERT', 'DELETE'))]
+        self.assertEqual(writes, [])
+        self.assertEqual(set(self.invoice.invoice_products.values_list('id', flat=True)), line_ids)
+        self.assertEqual(self.stock(), {'Apple': 8, 'Pear': 7, 'Plum': 10})
+
+    def test_applies_net_stock_deltas(self):
+        self.edit([(self.apple, 5), (self.plum, 4)])
+
+        self.assertEqual(self.stock(), {'Apple': 5, 'Pear': 10, 'Plum': 6})
+        self.invoice.refresh_from_db()
+        self.assertEqual(
+            dict(self.invoice.invoice_products.values_list('product__title', 'quantity')),
+            {'Apple': 5, 'Plum': 4},
+        )
+        self.assertEqual(self.invoice.subtotal, Decimal('17.000'))
+        self.assertEqual(self.invoice.total, quantize_amount(self.invoice.calculate_total()))
+
+    def test_shortage_rolls_back_the_whole_edit(self):
+        self.edit([(self.apple, 2), (self.pear, 20)], notes='Too many pears')
+
+        self.assertEqual(self.stock(), {'Apple': 8, 'Pear': 7, 'Plum': 10})
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.notes, None)
+        self.assertEqual(self.invoice.invoice_products.get(product=self.pear).quantity, 3)
+
+
+class InvoiceListTests(TestCase):
+    """The invoices page renders one shared edit modal, filled from invoice_data"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('clerk', password='secret')
+        self.client.force_login(self.user)
+        customer = Client.objects.create(clientname='Acme')
+        self.product = Product.objects.create(title='Widget', price=2.5, quantity=50)
+        self.invoice = Invoice.objects.create(title='Widgets', client=customer)
+        InvoiceProduct.objects.create(invoice=self.invoice, product=self.product, quantity=4, unit_price=2.5)
+        self.invoice.adjust_inventory()
+        for i in range(5):
+            Invoice.objects.create(title=f'Empty {i}', client=customer)
+
+    def test_single_edit_modal(self):
+        response = self.client.get(reverse('invoices_list'))
+        html = response.content.decode()
+        self.assertEqual(html.count('id="editInvoiceModal"'), 1)
+        self.assertIn(reverse('invoice_data', args=[self.invoice.id]), html)
+
+    def test_invoice_data(self):
+        with self.assertNumQueries(4):  # session, user, invoice with client, lines with products
+            data = self.client.get(reverse('invoice_data', args=[self.invoice.id])).json()
+        self.assertEqual((data['title'], data['edit_url']), ('Widgets', reverse('invoice_edit', args=[self.invoice.id])))
+        self.assertEqual(data['lines'], [{
+            'product_id': self.product.id, 'title': 'Widget', 'currency': 'TND', 'price': 2.5,
+            'available_quantity': 50, 'quantity': 4,
+        }])
+
+    def test_catalog_is_not_embedded(self):
+        Product.objects.create(title='Unlisted Gadget', price=1.0, quantity=1)
+        Client.objects.create(clientname='Unlisted Customer')
+        html = self.client.get(reverse('invoices_list')).content.decode()
+        self.assertNotIn('Unlisted Gadget', html)
+        self.assertNotIn('Unlisted Customer', html)
+        self.assertIn(reverse('product_autocomplete'), html)
+
+
+class AutocompleteTests(TestCase):
+    """Pickers query an indexed, accent-insensitive name column: prefix matches first"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('clerk', password='secret')
+        self.client.force_login(self.user)
+        for title in ['Écran 24"', 'Ecrou M6', 'Grand écran', 'Cable', 'Souris']:
+            Product.objects.create(title=title, price=1.0, quantity=3)
+        Client.objects.create(clientname='Société Générale')
+        Client.objects.create(clientname='Acme')
+
+    def titles(self, query, **params):
+        response = self.client.get(reverse('product_autocomplete'), {'q': query, **params})
+        return [product['title'] for product in response.json()['results']]
+
+    def test_prefix_then_substring_ignoring_accents_and_case(self):
+        self.assertEqual(self.titles('ecr'), ['Écran 24"', 'Ecrou M6', 'Grand écran'])
+        self.assertEqual(self.titles('ÉCRAN'), ['Écran 24"', 'Grand écran'])
+        self.assertEqual(self.titles('ecr', limit=1), ['Écran 24"'])
+
+    def test_search_name_follows_renames(self):
+        product = Product.objects.get(title='Souris')
+        product.title = 'Clé USB'
+        product.save()
+        self.assertEqual(self.titles('cle'), ['Clé USB'])
+        self.assertEqual(self.titles('souris'), [])
+
+    def test_clients(self):
+        response = self.client.get(reverse('client_autocomplete'), {'q': 'societe'})
+        self.assertEqual([c['name'] for c in response.json()['results']], ['Société Générale'])
+
+    def test_prefix_lookup_uses_the_index(self):
+        plan = Product.objects.filter(search_name__gte='ecr', search_name__lt='ecr\U0010ffff').explain()
+        self.assertIn('USING INDEX', plan)
+        self.assertNotIn('SCAN', plan)
+
+
+class InvoiceFilterTests(TestCase):
+    def test_date_bounds_are_inclusive_calendar_days(self):
+        for title, created in [('Early', '2026-03-01T00:30'), ('Late', '2026-03-01T23:30'),
+                               ('Next day', '2026-03-02T01:00'), ('Day before', '2026-02-28T23:59')]:
+            Invoice.objects.create(title=title, date_created=timezone.make_aware(datetime.fromisoformat(created)))
+        with warnings.catch_warnings():
+            # A date string compared with the datetime column would warn about a naive datetime
+            warnings.simplefilter('error', RuntimeWarning)
+            titles = set(filter_invoices({'date_from': '2026-03-01', 'date_to': '2026-03-01'})
+                         .values_list('title', flat=True))
+        self.assertEqual(titles, {'Early', 'Late'})
+
+
+class FullTextSearchTests(TestCase):
+    """The FTS5 indexes follow saves, renames and deletes, and rank title hits first"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('clerk', password='secret')
+        self.client.force_login(self.user)
+        self.acme = Client.objects.create(clientname='Société Acme')
+        Product.objects.create(title='Widget holder', description='Holds one widget')
+        Product.objects.create(title='Cable', description='Fits any widgetry')
+        Product.objects.create(title='Widget', description='The original')
+        Product.objects.create(title='Souris')
+        self.invoice = Invoice.objects.create(title='Spring order', client=self.acme, notes='Deliver by truck')
+        Invoice.objects.create(title='Truck rental', client=Client.objects.create(clientname='Other'))
+
+    def product_titles(self, text):
+        return list(order_by_rank(full_text_search(Product.objects.all(), text)).values_list('title', flat=True))
+
+    def invoice_titles(self, text):
+        return list(filter_invoices({'search': text}).values_list('title', flat=True))
+
+    def test_prefix_words_ranked_title_first(self):
+        self.assertEqual(self.product_titles('widg'), ['Widget', 'Widget holder', 'Cable'])
+        self.assertEqual(self.product_titles('widget hold'), ['Widget holder'])
+        # Operators and quotes are searched as words, never parsed
+        self.assertEqual(self.product_titles('widget NOT cable'), [])
+        self.assertEqual(self.product_titles('"cable)'), ['Cable'])
+        self.assertEqual(len(self.product_titles('-')), 4)
+
+    def test_invoices_match_client_names_and_follow_renames(self):
+        self.assertEqual(self.invoice_titles('societe'), ['Spring order'])
+        self.assertEqual(self.invoice_titles(self.invoice.uniqueId[:4]), ['Spring order'])
+        self.assertEqual(self.invoice_titles('truck'), ['Truck rental', 'Spring order'])
+
+        self.acme.clientname = 'Globex'
+        self.acme.save()
+        self.assertEqual(self.invoice_titles('societe'), [])
+        self.assertEqual(self.invoice_titles('globex'), ['Spring order'])
+
+        self.acme.delete()
+        self.assertEqual(self.invoice_titles('globex'), [])
+        self.invoice.delete()
+        self.assertEqual(self.invoice_titles('spring'), [])
+
+    def test_product_edits_and_deletes(self):
+        product = Product.objects.get(title='Souris')
+        product.title = 'Clé USB'
+        product.save()
+        self.assertEqual(self.product_titles('cle'), ['Clé USB'])
+        product.delete()
+        self.assertEqual(self.product_titles('cle'), [])
+
+    def test_list_views_search(self):
+        response = self.client.get(reverse('products_list'), {'search': 'widg'})
+        self.assertEqual([p.title for p in response.context['products']], ['Widget', 'Widget holder', 'Cable'])
+        response = self.client.get(reverse('invoices_list'), {'search': 'truck'})
+        self.assertEqual([i.title for i in response.context['invoices']], ['Truck rental', 'Spring order'])
+
+
+class InvoiceStatsTests(TestCase):
+    """Status counters come from one aggregate query, or from the cached InvoiceStats rows"""
+
+    def setUp(self):
+        self.customer = Client.objects.create(clientname='Acme')
+        self.product = Product.objects.create(title='Widget', price=10.0, quantity=1000)
+        for status, quantity in [('CURRENT', 1), ('CURRENT', 2), ('OVERDUE', 3), ('PAID', 4)]:
+            invoice = Invoice.objects.create(title=f'{status} {quantity}', client=self.customer, status=status)
+            invoice.reconcile_lines({self.product.id: quantity})
+            invoice.save()
+
+    def test_status_stats_in_one_query(self):
+        with self.assertNumQueries(1):
+            stats = Invoice.objects.status_stats()
+        self.assertEqual((stats['total_invoices'], stats['current_invoices'], stats['overdue_invoices'],
+                          stats['paid_invoices']), (4, 2, 1, 1))
+        current_total = sum(i.total for i in Invoice.objects.filter(status='CURRENT'))
+        self.assertEqual(stats['current_amount'], current_total)
+
+    def test_cached_counters_follow_save_and_delete(self):
+        self.assertEqual(InvoiceStats.summary(), Invoice.objects.status_stats())
+
+        invoice = Invoice.objects.get(title='CURRENT 1')
+        invoice.status = 'PAID'
+        invoice.save()
+        Invoice.objects.get(title='OVERDUE 3').delete()
+        invoice = Invoice.objects.get(title='PAID 4')
+        invoice.reconcile_lines({self.product.id: 7})
+        invoice.save()
+
+        with self.assertNumQueries(1):
+            summary = InvoiceStats.summary()
+        self.assertEqual(summary, Invoice.objects.status_stats())
+        self.assertEqual((summary['paid_invoices'], summary['overdue_invoices']), (2, 0))
+
+    def test_cached_counters_follow_bulk_deletes_and_updates(self):
+        Invoice.objects.filter(status='CURRENT').delete()
+        self.assertEqual(InvoiceStats.summary(), Invoice.objects.status_stats())
+        self.assertEqual(InvoiceStats.summary()['current_invoices'], 0)
+
+        Invoice.objects.filter(status='OVERDUE').update(status='PAID')
+        Invoice.objects.filter(title='PAID 4').update(total=Decimal('12.500'))
+        summary = InvoiceStats.summary()
+        self.assertEqual(summary, Invoice.objects.status_stats())
+        self.assertEqual((summary['paid_invoices'], summary['overdue_invoices']), (2, 0))
+
+    def test_admin_bulk_delete_updates_the_counters(self):
+        admin = User.objects.create_superuser('admin', password='secret')
+        self.client.force_login(admin)
+        selected = Invoice.objects.filter(status='CURRENT').values_list('pk', flat=True)
+        response = self.client.post(reverse('admin:sales_invoice_changelist'), {
+            'action': 'delete_selected', '_selected_action': list(selected), 'post': 'yes',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Invoice.objects.filter(status='CURRENT').exists())
+        self.assertEqual(InvoiceStats.summary(), Invoice.objects.status_stats())
+
+    def test_deleting_a_product_refreshes_its_invoices_in_bulk(self):
+        self.product.delete()
+        self.assertEqual(set(Invoice.objects.values_list('total', flat=True)), {quantize_amount('1.000')})
+        self.assertEqual(InvoiceStats.summary(), Invoice.objects.status_stats())
+
+    def test_invoices_page_uses_cached_counters_when_unfiltered(self):
+        user = User.objects.create_user('clerk', password='secret')
+        self.client.force_login(user)
+        InvoiceStats.objects.filter(status='PAID').update(count=99)
+
+        response = self.client.get(reverse('invoices_list'))
+        self.assertEqual(response.context['paid_invoices'], 99)
+        response = self.client.get(reverse('invoices_list'), {'client': self.customer.id})
+        self.assertEqual(response.context['paid_invoices'], 1)
+
+
+class CursorPaginationTests(TestCase):
+    """Cursor pages cover every row exactly once in both directions, NULLs and ties included"""
+
+    def setUp(self):
+        prices = [5.0, 2.5, None, 2.5, 9.0, None, 2.5, 1.0, 7.0, None, 5.0]
+        titles = ['b', 'a', None, 'a', 'c', 'd', None, 'e', 'a', 'f', 'g']
+        for i, (title, price) in enumerate(zip(titles, prices)):
+            Product.objects.create(title=title, price=price, quantity=i)
+
+    def walk(self, sort, per_page=3):
+        pages, cursor = [], None
+        while True:
+            page = cursor_page(Product.objects.all(), sort, cursor, per_page=per_page)
+            pages.append([p.id for p in page])
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        # And back again from the last page
+        backwards = [pages[-1]]
+        while page.has_previous():
+            page = cursor_page(Product.objects.all(), sort, page.previous_cursor, per_page=per_page)
+            backwards.insert(0, [p.id for p in page])
+        return pages, backwards
+
+    def test_every_sort_in_both_directions(self):
+        for sort in PRODUCT_SORTS:
+            field = F(sort.lstrip('-'))
+            order = (field.desc(nulls_last=True), '-id') if sort.startswith('-') else (field.asc(nulls_first=True), 'id')
+            expected = list(Product.objects.order_by(*order).values_list('id', flat=True))
+            pages, backwards = self.walk(sort)
+            with self.subTest(sort=sort):
+                self.assertEqual(sum(pages, []), expected)
+                self.assertTrue(all(len(page) == 3 for page in pages[:-1]))
+                self.assertEqual(backwards, pages)
+
+    def test_bad_or_stale_cursors_give_the_first_page(self):
+        first = [p.id for p in cursor_page(Product.objects.all(), 'title', per_page=3)]
+        cursor = cursor_page(Product.objects.all(), 'price', per_page=3).next_cursor
+        for token in (cursor, cursor[:-2] + 'xx', 'garbage'):
+            self.assertEqual([p.id for p in cursor_page(Product.objects.all(), 'title', token, per_page=3)], first)
+
+    def test_deep_pages_are_index_range_scans(self):
+        page = cursor_page(Product.objects.all(), '-price', per_page=2)
+        with CaptureQueriesContext(connection) as ctx:
+            cursor_page(Product.objects.all(), '-price', page.next_cursor, per_page=2)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        sql = ctx.captured_queries[0]['sql']
+        self.assertNotIn('OFFSET', sql)
+        with connection.cursor() as cursor:
+            plan = ' '.join(str(row) for row in cursor.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall())
+        self.assertIn('USING INDEX sales_produ_price', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_list_views(self):
+        user = User.objects.create_user('clerk', password='secret')
+        self.client.force_login(user)
+        for i in range(25):
+            Invoice.objects.create(title=f'Invoice {i}')
+        response = self.client.get(reverse('invoices_list'))
+        self.assertEqual(len(response.context['invoices']), 20)
+        next_cursor = response.context['page_obj'].next_cursor
+        response = self.client.get(reverse('invoices_list'), {'cursor': next_cursor})
+        self.assertEqual(len(response.context['invoices']), 5)
+        self.assertEqual(response.context['page_obj'].estimated_total, 25)
+
+        # Unknown sorts fall back to the default instead of reaching order_by()
+        response = self.client.get(reverse('products_list'), {'sort': 'uniqueId'})
+        self.assertEqual(response.context['page_obj'].sort, 'title')
+        self.assertEqual(response.context['page_obj'].estimated_total, Product.objects.latest('id').id)
+
+
+class ProductImportTests(TestCase):
+    """import_products_excel writes in batches and upserts by title"""
+
+    def workbook(self, rows):
+        wb = Workbook()
+        ws = wb.active
+        ws.append(['Title', 'Currency', 'Description', 'Price', 'Quantity'])
+        for row in rows:
+            ws.append(row)
+        buffer = BytesIO()
+        wb.save(buffer)
+        buffer.seek(0)
+        return buffer
+
+    def test_creates_and_updates_in_batches(self):
+        Product.objects.create(title='Existing', price=1.0, quantity=1)
+        rows = [[f'Item {i}', 'TND', '', i, i] for i in range(25)]
+        rows += [['Existing', 'TND', 'Restocked', 9.5, 40], [None, None, None, None, None]]
+
+        # Per batch: title lookup and one INSERT in a savepoint, plus one UPDATE for the matched row
+        # and one for the catalog document version
+        with self.assertNumQueries(3 * 4 + 2):
+            result = import_products_excel(self.workbook(rows), update_existing=True, batch_size=10)
+
+        self.assertEqual((result['created'], result['updated'], result['errors']), (25, 1, 0))
+        self.assertEqual(Product.objects.count(), 26)
+        existing = Product.objects.get(title='Existing')
+        self.assertEqual((existing.price, existing.quantity), (9.5, 40))
+        self.assertEqual(Product.objects.filter(slug__isnull=True).count(), 0)
+        self.assertEqual(Product.objects.values('uniqueId').distinct().count(), 26)
+
+    def test_repeated_titles_in_a_batch_are_written_once(self):
+        Product.objects.create(title='Existing', price=1.0, quantity=1)
+        rows = [['New', 'TND', '', 1, 1], ['Existing', 'TND', '', 2, 2],
+                ['New', 'EUR', '', 3, 3], ['Existing', 'TND', '', 4, 4]]
+        result = import_products_excel(self.workbook(rows), update_existing=True)
+
+        self.assertEqual((result['created'], result['updated'], result['rows']), (1, 1, 4))
+        self.assertEqual(dict(Product.objects.values_list('title', 'price')), {'New': 3.0, 'Existing': 4.0})
+        self.assertEqual(Product.objects.get(title='New').currency, 'EUR')
+
+        result = import_products_excel(self.workbook([['Twice', 'TND', '', 1, 1], ['Twice', 'EUR', '', 2, 2]]))
+        self.assertEqual((result['created'], result['updated']), (1, 0))
+        self.assertEqual(list(Product.objects.filter(title='Twice').values_list('currency', flat=True)), ['EUR'])
+
+
+class InvoiceImportTests(TestCase):
+    """import_invoices_excel groups rows into multi-line invoices"""
+
+    def workbook(self, rows):
+        wb = Workbook()
+        ws = wb.active
+        ws.append(['Invoice Key', 'Title', 'Client Name', 'Product Title', 'Quantity', 'Status', 'Discount'])
+        for row in rows:
+            ws.append(row)
+        buffer = BytesIO()
+        wb.save(buffer)
+        buffer.seek(0)
+        return buffer
+
+    def setUp(self):
+        Client.objects.create(clientname='Acme')
+        Product.objects.create(title='Apple', price=1.5, quantity=10)
+        Product.objects.create(title='Pear', price=2.0, quantity=3)
+
+    def test_multi_line_invoices_with_stock_deduction(self):
+        rows = [
+            ['A', 'First', 'Acme', 'Apple', 2, 'PAID', 10],
+            ['B', 'Second', 'Acme', 'Pear', 1, None, None],
+            ['A', 'First', 'Acme', 'Pear', 2, None, None],
+            ['C', 'Third', 'Nobody', 'Apple', 1, None, None],
+            ['D', 'Fourth', 'Acme', 'Pear', 5, None, None],
+        ]
+        result = import_invoices_excel(self.workbook(rows))
+
+        self.assertEqual((result['created'], result['updated'], result['errors']), (2, 0, 2))
+        first = Invoice.objects.get(title='First')
+        self.assertEqual(first.status, 'PAID')
+        self.assertTrue(first.inventory_adjusted)
+        self.assertEqual(dict(first.invoice_products.values_list('product__title', 'quantity')),
+                         {'Apple': 2, 'Pear': 2})
+        self.assertEqual(first.total, quantize_amount(first.calculate_total()))
+        self.assertEqual(dict(Product.objects.values_list('title', 'quantity')), {'Apple': 8, 'Pear': 0})
+
+    def test_round_trips_do_not_grow_with_rows(self):
+        def run(count):
+            rows = [[f'K{i}', f'Invoice {i}', 'Acme', 'Apple', 1, None, None] for i in range(count)]
+            Product.objects.filter(title='Apple').update(quantity=1000)
+            with CaptureQueriesContext(connection) as ctx:
+                import_invoices_excel(self.workbook(rows))
+            inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "sales_invoice" ')]
+            return len(inserts), len(ctx.captured_queries) - len(inserts)
+
+        # Only the invoice INSERT is split, every INVOICE_INSERT_BATCH_SIZE rows (999 SQLite parameters)
+        few, many = run(3), run(60)
+        self.assertEqual(few[1], many[1])
+        self.assertEqual((few[0], many[0]), (1, -(-60 // INVOICE_INSERT_BATCH_SIZE)))
+
+    def test_batches_over_many_distinct_products(self):
+        Product.objects.bulk_create(
+            [Product(title=f'Part {i}', price=1.0, quantity=5) for i in range(1500)], batch_size=200,
+        )
+        rows = [[f'K{i % 500}', f'Invoice {i % 500}', 'Acme', f'Part {i}', 2, None, None] for i in range(1500)]
+        result = import_invoices_excel(self.workbook(rows))
+
+        self.assertEqual((result['created'], result['errors']), (500, 0))
+        self.assertNotIn('failed_batches', result)
+        self.assertEqual(Product.objects.filter(title__startswith='Part', quantity=3).count(), 1500)
+
+    def test_failed_batch_is_reported_and_the_import_goes_on(self):
+        with connection.cursor() as cursor:
+            cursor.execute("""CREATE TEMP TRIGGER refuse_line BEFORE INSERT ON sales_invoiceproduct
+                WHEN new.quantity = 3 BEGIN SELECT RAISE(ABORT, 'line refused'); END""")
+        self.addCleanup(lambda: connection.cursor().execute('DROP TRIGGER IF EXISTS temp.refuse_line'))
+        rows = [
+            ['A', 'First', 'Acme', 'Apple', 1, None, None],
+            ['B', 'Second', 'Acme', 'Apple', 3, None, None],
+            ['C', 'Third', 'Acme', 'Apple', 2, None, None],
+        ]
+        result = import_invoices_excel(self.workbook(rows), batch_size=1)
+
+        self.assertEqual((result['created'], result['errors']), (2, 1))
+        self.assertEqual(len(result['failed_batches']), 1)
+        self.assertIn('Rows 3-3: line refused', result['failed_batches'][0])
+        self.assertEqual(set(Invoice.objects.values_list('title', flat=True)), {'First', 'Third'})
+        self.assertEqual(Product.objects.get(title='Apple').quantity, 7)
+
+    def test_update_existing_replaces_lines_by_title(self):
+        import_invoices_excel(self.workbook([['A', 'First', 'Acme', 'Apple', 4, None, None]]))
+        result = import_invoices_excel(
+            self.workbook([['A', 'First', 'Acme', 'Pear', 1, None, None]]), update_existing=True,
+        )
+
+        self.assertEqual((result['created'], result['updated']), (0, 1))
+        first = Invoice.objects.get(title='First')
+        self.assertEqual(dict(first.invoice_products.values_list('product__title', 'quantity')), {'Pear': 1})
+        self.assertEqual(dict(Product.objects.values_list('title', 'quantity')), {'Apple': 10, 'Pear': 2})
+        self.assertEqual(InvoiceStats.summary(), Invoice.objects.status_stats())
+
+    def test_creates_missing_clients_in_bulk(self):
+        rows = [[f'K{i}', f'Invoice {i}', f'New client {i % 30}', 'Apple', 1, None, None] for i in range(60)]
+        Product.objects.filter(title='Apple').update(quantity=1000)
+        with CaptureQueriesContext(connection) as ctx:
+            result = import_invoices_excel(self.workbook(rows), create_clients=True)
+
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "sales_client"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual((result['created'], result['errors'], result['clients_created']), (60, 0, 30))
+        self.assertEqual(Client.objects.filter(slug__startswith='new-client-').count(), 30)
+
+
+class IdentityTests(TestCase):
+    """uniqueId and slug are generated without lookup queries"""
+
+    def test_save_makes_no_lookup_queries(self):
+        client = Client(clientname='Acme Corp')
+        # SAVEPOINT, INSERT, RELEASE: the test transaction makes save_unique use a savepoint
+        with self.assertNumQueries(3):
+            client.save()
+        self.assertEqual(client.slug, f'acme-corp-{client.uniqueId}')
+
+    def test_slug_only_changes_with_the_name(self):
+        client = Client.objects.create(clientname='Acme')
+        slug = client.slug
+        client.adress = 'Tunis'
+        client.save()
+        self.assertEqual(client.slug, slug)
+
+        client.clientname = 'Acme Trading'
+        client.save()
+        self.assertEqual(Client.objects.get(pk=client.pk).slug, f'acme-trading-{client.uniqueId}')
+
+    def test_slug_collision_draws_a_new_unique_id(self):
+        first = Client.objects.create(clientname='Acme')
+        second = Client(clientname='Acme', uniqueId=first.uniqueId)
+        second.save()
+        self.assertNotEqual(second.uniqueId, first.uniqueId)
+        self.assertNotEqual(second.slug, first.slug)
+
+
+class JobTests(TestCase):
+    """Imports and background exports go through the job table"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root, SALES_JOBS_ASYNC=True)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user('clerk', password='secret')
+        self.client.force_login(self.user)
+
+    def upload(self, rows):
+        wb = Workbook()
+        ws = wb.active
+        ws.append(['Title', 'Currency', 'Description', 'Price', 'Quantity'])
+        for row in rows:
+            ws.append(row)
+        buffer = BytesIO()
+        wb.save(buffer)
+        return SimpleUploadedFile('products.xlsx', buffer.getvalue())
+
+    def test_import_is_queued_then_run_by_a_worker(self):
+        response = self.client.post(reverse('import_products'), {
+            'excel_file': self.upload([[f'Item {i}', 'TND', '', i, i] for i in range(5)]),
+        })
+        self.assertEqual(response.status_code, 302)
+        job = Job.objects.get()
+        self.assertEqual((job.kind, job.status), ('import_products', 'QUEUED'))
+        self.assertEqual(Product.objects.count(), 0)
+
+        claimed = Job.claim_next()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertIsNone(Job.claim_next())
+        run_job(claimed)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'DONE')
+        self.assertEqual((job.result['created'], job.processed), (5, 5))
+        self.assertEqual(Product.objects.count(), 5)
+
+    def test_failed_job_records_the_error(self):
+        job = enqueue_job('import_products', upload=SimpleUploadedFile('bad.xlsx', b'not a workbook'))
+        with self.assertLogs('sales.jobs', 'ERROR') as logs:
+            run_job(Job.claim_next())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'FAILED')
+        self.assertTrue(job.error)
+        self.assertIn(f'Job {job.pk} (import_products) failed', logs.output[0])
+
+    def test_background_export_can_be_downloaded(self):
+        Product.objects.create(title='Widget', price=2.5, quantity=3)
+        with override_settings(SALES_JOBS_ASYNC=False):
+            response = self.client.get(reverse('export_products'), {'background': '1'})
+        self.assertRedirects(response, reverse('jobs_list'))
+
+        job = Job.objects.get()
+        status = self.client.get(reverse('job_status', args=[job.id])).json()
+        self.assertEqual((status['status'], status['processed'], status['total']), ('DONE', 1, 1))
+
+        response = self.client.get(status['download_url'])
+        wb = load_workbook(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(wb.active['B2'].value, 'Widget')
+
+
+
+@override_settings(SALES_JOBS_ASYNC=False)
+class QueryBudgetTests(TestCase):
+    """Every route in sales/urls.py stays within a fixed query budget at every dataset size.
+
+    Each route is requested against datasets of SIZES rows (clients, products,
+    invoices, lines per invoice, import rows...). A view fails when it needs
+    more queries than its budget, or more queries on a bigger dataset than on
+    the smallest one. Wall-clock latency is recorded per route and size, and
+    written as JSON to $SALES_PERF_REPORT when that is set.
+    """
+    SIZES = (3, 12, 40)
+
+    # Maximum queries per request, session and user lookups included
+    BUDGETS = {
+        'index': 0,
+        'login': 0,
+        'logout': 4,
+        'dashboard': 7,
+        'settings_view': 3,
+        'clients': 3,
+        'edit_client': 6,
+        'delete-client': 5,
+        'client_autocomplete': 4,
+        'products_list': 5,
+        'add_product': 5,
+        'edit_product': 7,
+        'delete_product': 12,
+        'export_products': 3,
+        'import_products': 10,
+        'download_product_template': 2,
+        'product_autocomplete': 4,
+        'invoices_list': 6,
+        'invoice_create': 17,
+        'invoices_print': 6,
+        'invoice_detail': 6,
+        'invoice_edit': 17,
+        'invoice_data': 4,
+        'invoice_delete': 11,
+        'export_invoices': 4,
+        'import_invoices': 20,
+        'download_invoice_template': 2,
+        'jobs_list': 3,
+        'job_status': 3,
+        'job_download': 3,
+    }
+
+    report = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        path = os.environ.get('SALES_PERF_REPORT')
+        if path:
+            with open(path, 'w') as fileobj:
+                json.dump(cls.report, fileobj, indent=2, sort_keys=True)
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user('clerk', password='secret')
+        self.client.force_login(self.user)
+        self.clients, self.products, self.invoices = [], [], []
+
+    def grow_to(self, size):
+        """Top the dataset up to ``size`` clients, products and invoices of up to 3 lines"""
+        for i in range(len(self.clients), size):
+            self.clients.append(Client.objects.create(clientname=f'Client {i}', emailAddress=f'c{i}@example.com'))
+            self.products.append(Product.objects.create(title=f'Product {i}', price=1.5 + i, quantity=10_000))
+        for i in range(len(self.invoices), size):
+            invoice = Invoice.objects.create(title=f'Invoice {i}', client=self.clients[i], notes=f'Order {i}')
+            invoice.reconcile_lines({self.products[(i + j) % size].id: j + 1 for j in range(min(3, size))})
+            invoice.adjust_inventory()
+            invoice.save()
+            self.invoices.append(invoice)
+        for i in range(size):
+            Job.objects.create(kind='export_products', status='DONE', processed=i, total=size)
+
+    def invoice_with_lines(self, size):
+        """A fresh invoice with one line per product"""
+        invoice = Invoice.objects.create(title=f'{size} lines', client=self.clients[0])
+        invoice.reconcile_lines({product.id: 1 for product in self.products[:size]})
+        invoice.adjust_inventory()
+        invoice.save()
+        return invoice
+
+    def lines_data(self, size):
+        return json.dumps([{'product_id': product.id, 'quantity': 2} for product in self.products[:size]])
+
+    def workbook(self, header, rows):
+        wb = Workbook()
+        ws = wb.active
+        ws.append(header)
+        for row in rows:
+            ws.append(row)
+        buffer = BytesIO()
+        wb.save(buffer)
+        return SimpleUploadedFile('upload.xlsx', buffer.getvalue())
+
+    def route_requests(self, size):
+        """url name -> (client, method, path, data), building whatever each request acts on"""
+        anonymous = self.client_class()
+        other_session = self.client_class()
+        other_session.force_login(self.user)
+
+        popular = Product.objects.create(title='Popular', price=2.0, quantity=10_000)
+        for invoice in self.invoices:
+            InvoiceProduct.objects.create(invoice=invoice, product=popular, quantity=1, unit_price=2.0)
+        editable_product = Product.objects.create(title='Editable', price=1.0, quantity=1)
+        editable_client = Client.objects.create(clientname='Editable')
+        doomed_client = Client.objects.create(clientname='Leaving')
+        Invoice.objects.filter(id__in=[invoice.id for invoice in self.invoices]).update(client=doomed_client)
+        invoice = self.invoice_with_lines(size)
+        doomed_invoice = self.invoice_with_lines(size)
+        job = enqueue_job('export_products', user=self.user)
+
+        return {
+            'index': (anonymous, 'get', reverse('index'), None),
+            'login': (anonymous, 'get', reverse('login'), None),
+            'logout': (other_session, 'get', reverse('logout'), None),
+            'dashboard': (self.client, 'get', reverse('dashboard'), None),
+            'settings_view': (self.client, 'get', reverse('settings_view'), None),
+            'clients': (self.client, 'get', reverse('clients'), None),
+            'edit_client': (self.client, 'post', reverse('edit_client', args=[editable_client.id]),
+                            {'clientname': 'Renamed', 'emailAddress': '', 'adress': '', 'mf': ''}),
+            'delete-client': (self.client, 'post', reverse('delete-client', args=[doomed_client.id]), None),
+            'client_autocomplete': (self.client, 'get', reverse('client_autocomplete'), {'q': 'cli'}),
+            'products_list': (self.client, 'get', reverse('products_list'), {'sort': '-price'}),
+            'add_product': (self.client, 'post', reverse('add_product'),
+                            {'title': 'New', 'currency': 'TND', 'price': '3', 'quantity': '4'}),
+            'edit_product': (self.client, 'post', reverse('edit_product', args=[editable_product.id]),
+                             {'title': 'Renamed', 'currency': 'TND', 'price': '3', 'quantity': '4'}),
+            'delete_product': (self.client, 'post', reverse('delete_product', args=[popular.id]), None),
+            'export_products': (self.client, 'get', reverse('export_products'), None),
+            'import_products': (self.client, 'post', reverse('import_products'), {'excel_file': self.workbook(
+                ['Title', 'Currency', 'Description', 'Price', 'Quantity'],
+                [[f'Imported {i}', 'TND', '', i, i] for i in range(size)],
+            )}),
+            'download_product_template': (self.client, 'get', reverse('download_product_template'), None),
+            'product_autocomplete': (self.client, 'get', reverse('product_autocomplete'), {'q': 'prod'}),
+            'invoices_list': (self.client, 'get', reverse('invoices_list'), {'status': 'CURRENT'}),
+            'invoice_create': (self.client, 'post', reverse('invoice_create'), {
+                'title': 'Created', 'client': self.clients[0].id, 'tva': '19', 'timbre_fiscal': '1',
+                'discount': '0', 'products_data': self.lines_data(size),
+            }),
+            'invoices_print': (self.client, 'get', reverse('invoices_print'), None),
+            'invoice_detail': (self.client, 'get', reverse('invoice_detail', args=[invoice.id]), None),
+            'invoice_edit': (self.client, 'post', reverse('invoice_edit', args=[invoice.id]), {
+                'title': 'Edited', 'client': self.clients[1].id, 'status': 'CURRENT', 'notes': '',
+                'products_data': self.lines_data(size),
+            }),
+            'invoice_data': (self.client, 'get', reverse('invoice_data', args=[invoice.id]), None),
+            'invoice_delete': (self.client, 'post', reverse('invoice_delete', args=[doomed_invoice.id]), None),
+            'export_invoices': (self.client, 'get', reverse('export_invoices'), None),
+            'import_invoices': (self.client, 'post', reverse('import_invoices'), {'create_clients': 'on', 'excel_file': self.workbook(
+                ['Invoice Key', 'Title', 'Client Name', 'Product Title', 'Quantity', 'Status', 'Discount'],
+                [[f'K{i // 2}', f'Imported {i // 2}', f'New client {i // 2}', f'Product {i % size}', 1, 'CURRENT', 0]
+                 for i in range(size)],
+            )}),
+            'download_invoice_template': (self.client, 'get', reverse('download_invoice_template'), None),
+            'jobs_list': (self.client, 'get', reverse('jobs_list'), None),
+            'job_status': (self.client, 'get', reverse('job_status', args=[job.id]), None),
+            'job_download': (self.client, 'get', reverse('job_download', args=[job.id]), None),
+        }
+
+    def measure(self, client, method, path, data):
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            response = getattr(client, method)(path, data)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+        self.assertLess(response.status_code, 400, path)
+        return len(ctx.captured_queries), round(elapsed * 1000, 2)
+
+    def test_every_route_has_a_budget(self):
+        from .urls import urlpatterns
+        self.assertEqual({pattern.name for pattern in urlpatterns}, set(self.BUDGETS))
+
+    def test_query_counts_do_not_grow_with_data(self):
+        counts = {name: [] for name in self.BUDGETS}
+        for size in self.SIZES:
+            self.grow_to(size)
+            for name, request in self.route_requests(size).items():
+                queries, milliseconds = self.measure(*request)
+                counts[name].append(queries)
+                self.report.setdefault(name, {})[size] = {'queries': queries, 'ms': milliseconds}
+
+        for name, per_size in counts.items():
+            with self.subTest(route=name, queries=dict(zip(self.SIZES, per_size))):
+                self.assertLessEqual(max(per_size), self.BUDGETS[name])
+                self.assertLessEqual(max(per_size), per_size[0])
+
+
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir, ignore_errors=True)
+        self.request = RequestFactory().get('/invoices/')
+
+    def run_middleware(self, view):
+        return ProfilingMiddleware(view)(self.request)
+
+    def test_server_timing_counts_queries(self):
+        def view(request):
+            list(Product.objects.all())
+            list(Client.objects.all())
+            return HttpResponse()
+
+        response = self.run_middleware(view)
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="2 queries", app;dur=[\d.]+$')
+
+    @override_settings(SALES_PROFILING_REPEAT_LIMIT=3)
+    def test_repeated_query_shapes_are_logged(self):
+        products = [Product.objects.create(title=f'P{i}', price=1.0, quantity=1) for i in range(4)]
+
+        def view(request):
+            for product in products:
+                Product.objects.get(pk=product.pk)
+            # Same shape, different IN list lengths
+            list(Product.objects.filter(pk__in=[1, 2]))
+            list(Product.objects.filter(pk__in=[1, 2, 3]))
+            return HttpResponse()
+
+        with self.assertLogs('sales.profiling', 'WARNING') as logs:
+            response = self.run_middleware(view)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('ran the same query 4 times', logs.output[0])
+        self.assertIn('repeated;desc="1 repeated query shapes"', response['Server-Timing'])
+
+    def test_sampled_slow_requests_are_profiled(self):
+        with override_settings(SALES_PROFILING_SAMPLE_RATE=1, SALES_PROFILING_SLOW_MS=0,
+                               SALES_PROFILING_DIR=self.profile_dir):
+            self.run_middleware(lambda request: HttpResponse())
+        with override_settings(SALES_PROFILING_SAMPLE_RATE=1, SALES_PROFILING_SLOW_MS=60_000,
+                               SALES_PROFILING_DIR=self.profile_dir):
+            self.run_middleware(lambda request: HttpResponse())
+
+        dumps = os.listdir(self.profile_dir)
+        self.assertEqual(len(dumps), 1)
+        self.assertTrue(dumps[0].endswith('.prof'))
+        pstats.Stats(os.path.join(self.profile_dir, dumps[0]))
+
+
+class CompanySettingsTests(TestCase):
+    def setUp(self):
+        clear_company_settings()
+        self.addCleanup(clear_company_settings)
+        self.user = User.objects.create_user('owner', password='pw')
+        self.client.force_login(self.user)
+        self.invoice = Invoice.objects.create(title='Cached', client=Client.objects.create(clientname='Acme'))
+
+    def settings_queries(self, path):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(path)
+        return response, [q['sql'] for q in ctx.captured_queries if 'sales_settings' in q['sql']]
+
+    def test_pages_read_settings_once_per_process(self):
+        Settings.objects.create(clientname='My Company')
+        path = reverse('invoice_detail', args=[self.invoice.id])
+        response, first = self.settings_queries(path)
+        self.assertContains(response, 'My Company')
+        self.assertEqual(len(first), 1)
+        for path in (path, reverse('invoices_list'), reverse('settings_view')):
+            self.assertEqual(self.settings_queries(path)[1], [])
+
+    def test_saving_or_deleting_settings_clears_the_cache(self):
+        self.assertIsNone(company_settings())
+        company = Settings.objects.create(clientname='Before')
+        self.assertEqual(company_settings().clientname, 'Before')
+        company.clientname = 'After'
+        company.save()
+        self.assertEqual(company_settings().clientname, 'After')
+        company.delete()
+        self.assertIsNone(company_settings())
+
+    def test_other_processes_drop_their_copy_once_settings_change(self):
+        Settings.objects.create(clientname='Before')
+        self.assertEqual(company_settings().clientname, 'Before')
+        # Another process saves: its signals and cache clearing never run here
+        Settings.objects.update(clientname='After')
+        DocumentVersion.objects.filter(name='settings').update(version=F('version') + 1)
+        self.assertEqual(company_settings().clientname, 'After')
+        with self.assertNumQueries(1):
+            self.assertEqual(company_settings().clientname, 'After')
+
+    @override_settings(SALES_SETTINGS_CACHE='default',
+                       CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_shared_cache_serves_other_processes(self):
+        Settings.objects.create(clientname='Shared')
+        company_settings()
+        # Another process: empty local cache, warm shared cache
+        _local.clear()
+        # Only the version check
+        with self.assertNumQueries(1):
+            self.assertEqual(company_settings().clientname, 'Shared')
+
+
+class InvoiceDocumentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_company_settings()
+        self.addCleanup(clear_company_settings)
+        self.user = User.objects.create_user('printer', password='pw')
+        self.client.force_login(self.user)
+        self.customer = Client.objects.create(clientname='Acme')
+        self.product = Product.objects.create(title='Widget', price=2.0, quantity=50)
+        self.invoice = Invoice.objects.create(title='Reprinted', client=self.customer)
+        InvoiceProduct.objects.create(invoice=self.invoice, product=self.product, quantity=3, unit_price=2.0)
+
+    def view(self):
+        response = self.client.get(reverse('invoice_detail', args=[self.invoice.id]))
+        outcome = 'hit' if 'document;desc="hit"' in response['Server-Timing'] else 'miss'
+        return outcome, response.content.decode()
+
+    def test_reprints_are_served_from_the_cache(self):
+        self.assertEqual(self.view()[0], 'miss')
+        outcome, html = self.view()
+        self.assertEqual(outcome, 'hit')
+        self.assertInHTML('<td>Widget</td>', html)
+        self.assertEqual(document_cache_stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_changes_to_anything_shown_invalidate_the_document(self):
+        changes = {
+            'Gadget': lambda: self.update(Product.objects.get(pk=self.product.pk), title='Gadget'),
+            'Acme Renamed': lambda: self.update(self.customer, clientname='Acme Renamed'),
+            'Printer Co': lambda: Settings.objects.create(clientname='Printer Co'),
+            'Second line': lambda: InvoiceProduct.objects.create(
+                invoice=self.invoice, product=Product.objects.create(title='Second line', price=1.0, quantity=5),
+                quantity=1, unit_price=1.0),
+            'Paid in full': lambda: self.update(Invoice.objects.get(pk=self.invoice.pk), notes='Paid in full'),
+        }
+        for text, change in changes.items():
+            with self.subTest(text):
+                self.view()
+                change()
+                outcome, html = self.view()
+                self.assertEqual(outcome, 'miss')
+                self.assertIn(text, html)
+
+    def test_rebuilt_totals_invalidate_the_document(self):
+        Invoice.objects.filter(pk=self.invoice.pk).update(total=Decimal('999.000'), last_updated=timezone.now())
+        self.assertIn('999.000', self.view()[1])
+        call_command('rebuild_invoice_totals', stdout=StringIO())
+        outcome, html = self.view()
+        self.assertEqual(outcome, 'miss')
+        self.assertNotIn('999.000', html)
+
+    def test_versions_are_shared_between_processes(self):
+        self.view()
+        # Another worker edits the product: only the database row is shared with this process
+        Product.objects.filter(pk=self.product.pk).update(title='Renamed elsewhere')
+        DocumentVersion.objects.filter(name='catalog').update(version=F('version') + 1)
+        outcome, html = self.view()
+        self.assertEqual(outcome, 'miss')
+        self.assertIn('Renamed elsewhere', html)
+
+    def test_stats_command_needs_a_shared_cache(self):
+        with self.assertRaisesMessage(CommandError, 'per-process'):
+            call_command('invoice_document_cache', stdout=StringIO())
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}}
+        with override_settings(CACHES=shared):
+            self.view()
+            self.view()
+            # As another process would see them
+            out = StringIO()
+            call_command('invoice_document_cache', '--reset', stdout=out)
+            self.assertEqual(json.loads(out.getvalue()), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+            self.assertEqual(document_cache_stats()['hits'], 0)
+
+    def test_settings_saved_in_another_process_are_rendered_under_the_new_key(self):
+        Settings.objects.create(clientname='Before Co')
+        self.assertIn('Before Co', self.view()[1])
+        # Another worker saves the settings; this process still holds its copy of 'Before Co'
+        Settings.objects.update(clientname='After Co')
+        DocumentVersion.objects.filter(name='settings').update(version=F('version') + 1)
+        outcome, html = self.view()
+        self.assertEqual(outcome, 'miss')
+        self.assertIn('After Co', html)
+        self.assertNotIn('Before Co', html)
+        cache.clear()
+        printed = ''.join(iter_invoices_html(Invoice.objects.filter(pk=self.invoice.pk), '', ''))
+        self.assertIn('After Co', printed)
+
+    def test_unrelated_product_writes_keep_the_documents(self):
+        self.view()
+        Product.objects.create(title='Newcomer', price=1.0, quantity=1)
+        self.update(Product.objects.get(pk=self.product.pk), quantity=10, description='Restocked')
+        self.assertEqual(self.view()[0], 'hit')
+        self.update(Product.objects.get(pk=self.product.pk), price=2.5)
+        self.assertEqual(self.view()[0], 'miss')
+
+    def test_inventory_warning_follows_adjustment(self):
+        self.assertIn('Inventory has not been deducted', self.view()[1])
+        Invoice.objects.get(pk=self.invoice.pk).adjust_inventory()
+        self.assertNotIn('Inventory has not been deducted', self.view()[1])
+
+    def test_product_import_updates_invalidate_the_document(self):
+        self.view()
+        wb = Workbook()
+        wb.active.append(['Title', 'Currency', 'Description', 'Price', 'Quantity'])
+        wb.active.append(['Widget', '$', '', 2, 50])
+        buffer = BytesIO()
+        wb.save(buffer)
+        buffer.seek(0)
+        import_products_excel(buffer, update_existing=True)
+        outcome, html = self.view()
+        self.assertEqual(outcome, 'miss')
+        self.assertIn('$ 6.000', html)
+
+    def update(self, obj, **values):
+        for field, value in values.items():
+            setattr(obj, field, value)
+        obj.save()
+
+
+class InvoicePrintTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('printer', password='pw')
+        self.client.force_login(self.user)
+        product = Product.objects.create(title='Widget', price=2.0, quantity=500)
+        self.invoices = []
+        for i, status in enumerate(['PAID', 'PAID', 'CURRENT']):
+            invoice = Invoice.objects.create(title=f'Month end {i}', status=status,
+                                             client=Client.objects.create(clientname=f'Client {i}'))
+            InvoiceProduct.objects.create(invoice=invoice, product=product, quantity=i + 1, unit_price=2.0)
+            self.invoices.append(invoice)
+
+    def printed(self, **params):
+        response = self.client.get(reverse('invoices_print'), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_prints_the_filtered_invoices(self):
+        html = self.printed(status='PAID')
+        self.assertEqual(html.count('<section class="invoice">'), 2)
+        self.assertIn('Client 0', html)
+        self.assertNotIn('Client 2', html)
+        self.assertTrue(html.rstrip().endswith('</html>'))
+
+    def test_prints_a_list_of_ids(self):
+        html = self.printed(ids=f'{self.invoices[0].id},{self.invoices[2].id},junk')
+        self.assertEqual(html.count('<section class="invoice">'), 2)
+        self.assertNotIn('Client 1', html)
+
+    def test_nothing_to_print(self):
+        self.assertIn('No invoices to print.', self.printed(status='OVERDUE'))
+
+    def test_streams_in_chunks_with_constant_queries(self):
+        chunks = iter_invoices_html(Invoice.objects.order_by('id'), '<head>', '</tail>', chunk_size=2)
+        with self.assertNumQueries(0):
+            self.assertEqual(next(chunks), '<head>')
+        with CaptureQueriesContext(connection) as ctx:
+            rest = list(chunks)
+        self.assertEqual([chunk.count('<section') for chunk in rest], [2, 1, 0])
+        self.assertEqual(rest[-1], '</tail>')
+        # Invoices with clients, then document versions and lines with products for each chunk of two, then settings
+        self.assertLessEqual(len(ctx.captured_queries), 6)
+
+    def test_cached_documents_skip_the_lines(self):
+        self.printed()
+        with CaptureQueriesContext(connection) as ctx:
+            html = self.printed()
+        self.assertEqual(html.count('<section class="invoice">'), 3)
+        self.assertFalse([q for q in ctx.captured_queries if 'sales_invoiceproduct' in q['sql']])
+        self.assertEqual(document_cache_stats()['hits'], 3)
+
+
+class DailyRollupTests(TestCase):
+    """The daily rollups follow every invoice and line write and feed the dashboard"""
+
+    def setUp(self):
+        self.acme = Client.objects.create(clientname='Acme')
+        self.apple = Product.objects.create(title='Apple', price=1.5, quantity=100)
+        self.pear = Product.objects.create(title='Pear', price=2.0, quantity=100)
+        self.invoice = Invoice.objects.create(title='First', client=self.acme)
+        InvoiceProduct.objects.create(invoice=self.invoice, product=self.apple, quantity=4, unit_price=1.5)
+        InvoiceProduct.objects.create(invoice=self.invoice, product=self.pear, quantity=1, unit_price=2.0)
+        self.invoice.refresh_from_db()
+
+    def assertConsistent(self):
+        # Raises CommandError listing the rows that differ from a fresh rebuild
+        call_command('rebuild_rollups', '--check', stdout=StringIO())
+
+    def test_follows_invoice_and_line_writes(self):
+        day = timezone.localdate(self.invoice.date_created)
+        row = ClientDailyRevenue.objects.get(day=day, client=self.acme)
+        self.assertEqual((row.invoices, row.revenue, row.tva, row.units),
+                         (1, self.invoice.total, self.invoice.tva_amount, 5))
+        self.assertEqual(ProductDailySales.objects.get(day=day, product=self.apple).revenue, Decimal('6.000'))
+        self.assertConsistent()
+
+        line = self.invoice.invoice_products.get(product=self.apple)
+        line.quantity = 7
+        line.save()
+        InvoiceProduct.objects.filter(product=self.pear).update(quantity=F('quantity') + 2)
+        self.assertConsistent()
+
+        # Moving an invoice to another day moves its client and product figures with it
+        Invoice.objects.filter(pk=self.invoice.pk).update(date_created=self.invoice.date_created - timedelta(days=40))
+        self.assertFalse(ProductDailySales.objects.filter(day=day).exclude(units=0).exists())
+        self.assertConsistent()
+
+        self.apple.delete()
+        self.acme.delete()
+        self.assertConsistent()
+        Invoice.objects.all().delete()
+        self.assertConsistent()
+        self.assertFalse(ClientDailyRevenue.objects.exclude(invoices=0).exists())
+
+    def test_rebuild_restores_dropped_rows(self):
+        ClientDailyRevenue.objects.all().delete()
+        with self.assertRaises(CommandError):
+            self.assertConsistent()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertConsistent()
+
+    def test_period_report(self):
+        Invoice.objects.create(title='Old', client=self.acme,
+                               date_created=self.invoice.date_created - timedelta(days=800))
+        today = timezone.localdate()
+        report = period_report(today)
+
+        self.assertEqual(len(report['monthly']), 12)
+        self.assertEqual(report['monthly'][-1]['month'], today.replace(day=1))
+        self.assertEqual(report['monthly'][-1]['share'], 100)
+        self.assertEqual(report['totals']['invoices'], 1)
+        self.assertEqual(report['totals']['revenue'], self.invoice.total)
+        self.assertEqual([(row['name'], row['units']) for row in report['top_clients']], [('Acme', 5)])
+        self.assertEqual([row['title'] for row in report['top_products']], ['Apple', 'Pear'])
+
+    def test_month_ranges_use_the_day_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + str(ClientDailyRevenue.objects.filter(day__gte='2025-01-01').query))
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('USING INDEX', plan)
+
+    def test_dashboard_shows_the_figures(self):
+        self.client.force_login(User.objects.create_user('owner', password='pw'))
+        response = self.client.get(reverse('dashboard'))
+        self.assertContains(response, 'Acme')
+        self.assertContains(response, 'Apple')
+        self.assertContains(response, reverse('invoice_detail', args=[self.invoice.id]))
+        self.assertEqual(response.context['stats']['total_invoices'], 1)
+
+
+class ClientBalanceTests(TestCase):
+    """The per-client balances follow invoice writes and sort the clients page"""
+
+    def setUp(self):
+        self.acme = Client.objects.create(clientname='Acme')
+        self.globex = Client.objects.create(clientname='Globex')
+        self.product = Product.objects.create(title='Widget', price=10.0, quantity=1000)
+
+    def invoice(self, client, quantity, status='CURRENT'):
+        invoice = Invoice.objects.create(title='Work', client=client, status=status)
+        InvoiceProduct.objects.create(invoice=invoice, product=self.product, quantity=quantity, unit_price=10.0)
+        invoice.refresh_from_db()
+        return invoice
+
+    def balance(self, client):
+        return ClientBalance.objects.get(client=client)
+
+    def test_follows_invoice_writes(self):
+        self.assertEqual(self.balance(self.globex).outstanding, 0)
+        first = self.invoice(self.acme, 2)
+        second = self.invoice(self.acme, 5, status='OVERDUE')
+        self.invoice(self.acme, 1, status='PAID')
+
+        balance = self.balance(self.acme)
+        self.assertEqual(balance.invoices, 3)
+        self.assertEqual(balance.current_amount, first.total)
+        self.assertEqual(balance.outstanding, first.total + second.total)
+        self.assertEqual(balance.last_invoice_date, Invoice.objects.latest('date_created').date_created)
+
+        first.status = 'PAID'
+        first.save()
+        Invoice.objects.filter(pk=second.pk).update(client=self.globex)
+        self.assertEqual(self.balance(self.acme).outstanding, 0)
+        self.assertEqual(self.balance(self.globex).overdue_amount, second.total)
+        call_command('rebuild_rollups', '--check', stdout=StringIO())
+
+        second.delete()
+        self.assertEqual((self.balance(self.globex).invoices, self.balance(self.globex).last_invoice_date), (0, None))
+        self.acme.delete()
+        self.assertFalse(ClientBalance.objects.filter(client_id=self.acme.pk).exists())
+        call_command('rebuild_rollups', '--check', stdout=StringIO())
+
+    def test_clients_page_sorts_by_exposure(self):
+        self.invoice(self.acme, 1)
+        self.invoice(self.globex, 3, status='OVERDUE')
+        self.client.force_login(User.objects.create_user('owner', password='pw'))
+
+        response = self.client.get(reverse('clients'), {'sort': '-outstanding'})
+        self.assertEqual([client.clientname for client in response.context['clients']], ['Globex', 'Acme'])
+        self.assertContains(response, 'overdue')
+        self.assertEqual([client.clientname for client in self.client.get(reverse('clients')).context['clients']],
+                         ['Acme', 'Globex'])
+
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + str(response.context['clients'].query))
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('sales_client_balance_exposure', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class OverdueSweepTests(TestCase):
+    """Due dates default from payment terms; mark_overdue flags the late CURRENT invoices in bulk"""
+
+    def setUp(self):
+        self.acme = Client.objects.create(clientname='Acme', payment_terms=10)
+        self.globex = Client.objects.create(clientname='Globex')
+        self.today = timezone.localdate()
+
+    def invoice(self, client, days_ago, status='CURRENT', total='100.000'):
+        invoice = Invoice.objects.create(title='Work', client=client, status=status,
+                                         date_created=timezone.now() - timedelta(days=days_ago))
+        Invoice.objects.filter(pk=invoice.pk).update(total=Decimal(total))
+        return invoice
+
+    def test_due_dates_default_from_payment_terms(self):
+        self.assertEqual(self.invoice(self.acme, 0).due_date, self.today + timedelta(days=10))
+        with override_settings(SALES_DEFAULT_PAYMENT_TERMS=45):
+            self.assertEqual(self.invoice(self.globex, 0).due_date, self.today + timedelta(days=45))
+            self.assertEqual(self.invoice(None, 0).due_date, self.today + timedelta(days=45))
+        chosen = Invoice.objects.create(title='Agreed', client=self.acme, due_date=self.today)
+        self.assertEqual(chosen.due_date, self.today)
+
+    def test_sweeps_past_due_current_invoices(self):
+        late = [self.invoice(self.acme, 11), self.invoice(self.acme, 40), self.invoice(self.globex, 31)]
+        self.invoice(self.acme, 10)  # due today
+        self.invoice(self.globex, 5)
+        self.invoice(self.acme, 90, status='PAID')
+        InvoiceStats.rebuild()
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(Invoice.objects.mark_overdue(self.today, batch_size=2), 3)
+        # One UPDATE per batch of two; one more to find nothing left
+        self.assertEqual(len(ctx.captured_queries), 3)
+
+        self.assertEqual(set(Invoice.objects.filter(status='OVERDUE').values_list('id', flat=True)),
+                         {invoice.id for invoice in late})
+        summary = InvoiceStats.summary()
+        self.assertEqual((summary['overdue_invoices'], summary['overdue_amount']), (3, Decimal('300.000')))
+        InvoiceStats.rebuild()
+        self.assertEqual(InvoiceStats.summary(), summary)
+        self.assertEqual(ClientBalance.objects.get(client=self.acme).overdue_amount, Decimal('200.000'))
+        call_command('rebuild_rollups', '--check', stdout=StringIO())
+        self.assertEqual(Invoice.objects.mark_overdue(self.today), 0)
+
+    def test_command(self):
+        self.invoice(self.acme, 11)
+        out = StringIO()
+        call_command('mark_overdue', '--date', str(self.today + timedelta(days=30)), stdout=out)
+        self.assertIn('Marked 1 invoice(s)', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('mark_overdue', '--date', 'tomorrow', stdout=StringIO())
+
+    def test_sweep_reads_the_status_due_date_index(self):
+        due = Invoice.objects.filter(status='CURRENT', due_date__lt=self.today)
+        sql, params = due.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('(status=? AND due_date<?)', plan)
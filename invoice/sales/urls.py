@@ -5,19 +5,21 @@ from .views import (index,
                     login_view,
                     logout_view,settings_view,edit_client,
                     invoice_delete,export_invoices,import_invoices,download_invoice_template
-                    ,invoices_list,invoice_create,invoice_detail,invoice_edit,
+                    ,invoices_list,invoices_print,invoice_create,invoice_detail,invoice_edit,invoice_data,
                     clients,export_products,import_products,download_product_template,
-                    delete_client,products_list,add_product,edit_product,delete_product)
+                    delete_client,products_list,add_product,edit_product,delete_product,
+                    jobs_list,job_status,job_download,product_autocomplete,client_autocomplete)
 
 urlpatterns = [
     path('', index,name='index'),
     path('login', login_view,name='login'),
-    path('login', logout_view,name='logout'),
+    path('logout', logout_view,name='logout'),
     path('dashboard', dashboard,name='dashboard'),
     path('settings', settings_view,name='settings_view'),
     path('clients', clients,name='clients'),
-    path('clients/<int:product_id>/edit/', edit_client,name='edit_client'),
+    path('clients/<int:client_id>/edit/', edit_client,name='edit_client'),
     path('client/<int:pk>/delete/',delete_client, name='delete-client'),
+    path('clients/autocomplete/', client_autocomplete, name='client_autocomplete'),
     path('products/', products_list, name='products_list'),
     path('products/add/', add_product, name='add_product'),
     path('products/<int:product_id>/edit/', edit_product, name='edit_product'),
@@ -25,13 +27,20 @@ urlpatterns = [
     path('products/export/', export_products, name='export_products'),
     path('products/import/', import_products, name='import_products'),
     path('products/template/', download_product_template, name='download_product_template'),
+    path('products/autocomplete/', product_autocomplete, name='product_autocomplete'),
         # Invoices
     path('invoices/', invoices_list, name='invoices_list'),
     path('invoices/create/', invoice_create, name='invoice_create'),
+    path('invoices/print/', invoices_print, name='invoices_print'),
     path('invoices/<int:invoice_id>/', invoice_detail, name='invoice_detail'),
     path('invoices/<int:invoice_id>/edit/', invoice_edit, name='invoice_edit'),
+    path('invoices/<int:invoice_id>/data/', invoice_data, name='invoice_data'),
     path('invoices/<int:invoice_id>/delete/', invoice_delete, name='invoice_delete'),
     path('invoices/export/', export_invoices, name='export_invoices'),
     path('invoices/import/', import_invoices, name='import_invoices'),
     path('invoices/template/', download_invoice_template, name='download_invoice_template'),
+        # Background jobs
+    path('jobs/', jobs_list, name='jobs_list'),
+    path('jobs/<int:job_id>/status/', job_status, name='job_status'),
+    path('jobs/<int:job_id>/download/', job_download, name='job_download'),
 ]
@@ -1,24 +1,39 @@
 from django.contrib.auth.decorators import login_required,user_passes_test
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.utils.http import url_has_allowed_host_and_scheme
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.safestring import mark_safe
 from django.contrib import messages
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse, JsonResponse, FileResponse, Http404
 from django.core.paginator import Paginator
 from django.db.models import Q,Sum, Count
 from django.db import transaction
-from openpyxl import Workbook, load_workbook
+from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment
 from io import BytesIO
 from django.conf import settings
 from datetime import datetime
+from decimal import Decimal
+from .exports import (spooled_response, write_products_xlsx, write_invoices_xlsx,
+                      iter_invoices_csv, iter_invoices_html, iter_invoices_jsonl)
+from .filters import filter_invoices, has_invoice_filters, invoice_sort
+from .jobs import enqueue_job
+from .pagination import CLIENT_SORTS, PRODUCT_SORTS, clean_sort, cursor_page, estimate_rows
+from .reports import period_report
+from .search import autocomplete_limit, full_text_search, match_names, order_by_rank
+from .company import company_settings
+from .documents import render_invoice_document
 from .forms import ClientForm, InvoiceForm,ProductForm, UserLoginForm, SettingsForm
-from .models import Product,Client,Invoice,Settings, InvoiceProduct
+from .models import Product,Client,Invoice,Settings, InvoiceProduct, InsufficientStock, InvoiceStats, Job
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate,logout,login as auth_login
 from random import randint
 from uuid import uuid4
 import json
+import os
 
 
 def anonymous_required(function=None, redirect_url=None):
@@ -34,6 +49,58 @@ def anonymous_required(function=None, redirect_url=None):
         return actual_decorator(function)
     return actual_decorator
 
+def line_quantities(products_list):
+    """Merge posted [{'product_id', 'quantity'}, ...] into {product_id: quantity}"""
+    quantities = {}
+    for product_data in products_list:
+        product_id = int(product_data['product_id'])
+        quantity = int(product_data['quantity'])
+        if quantity <= 0:
+            raise ValueError('Quantity must be greater than 0.')
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+def import_messages(request, result, noun):
+    """Report an import result dict as flash messages"""
+    created_count = result['created']
+    updated_count = result['updated']
+    error_count = result['errors']
+    
+    if created_count > 0 or updated_count > 0:
+        msg_parts = []
+        if created_count > 0:
+            msg_parts.append(f'{created_count} {noun}(s) created')
+        if updated_count > 0:
+            msg_parts.append(f'{updated_count} {noun}(s) updated')
+        
+        success_msg = ' and '.join(msg_parts) + ' successfully!'
+        success_msg += f" ({result['rows']} rows in {result['seconds']}s, {result['rows_per_second']} rows/s)"
+        messages.success(request, success_msg)
+        
+        if result.get('clients_created'):
+            messages.info(request, f"{result['clients_created']} new client(s) created.")
+        
+        if error_count > 0:
+            messages.warning(request, f'{error_count} row(s) had errors and were skipped.')
+        for failure in result.get('failed_batches', []):
+            messages.error(request, f'Batch not imported. {failure}')
+    else:
+        if error_count > 0:
+            messages.error(request, f'Import failed. {error_count} row(s) had errors.')
+            for failure in result.get('failed_batches', []):
+                messages.error(request, f'Batch not imported. {failure}')
+        else:
+            messages.warning(request, f'No {noun}s were imported. Please check your file.')
+
+def job_messages(request, job, noun):
+    """Flash the outcome of an import job, or where to follow it while it is queued"""
+    if job.status == 'DONE':
+        import_messages(request, job.result, noun)
+    elif job.status == 'FAILED':
+        messages.error(request, f'Error processing file: {job.error}')
+    else:
+        messages.info(request, f'Import queued as job #{job.id}. Follow its progress on the Jobs page.')
+
 @anonymous_required
 def login_view(request):  # changed name
     context = {}
@@ -68,13 +135,24 @@ def index(request):
 
 @login_required
 def dashboard(request):
-    context = {}
+    """Status counters, the last 12 months by month, client and product, and the latest invoices"""
+    stats = InvoiceStats.summary() if settings.SALES_CACHED_INVOICE_STATS else Invoice.objects.status_stats()
+    context = {
+        'stats': stats,
+        'outstanding_amount': stats['current_amount'] + stats['overdue_amount'],
+        'report': period_report(timezone.localdate()),
+        'recent_invoices': Invoice.objects.select_related('client').order_by('-date_created', '-id')[:5],
+    }
     return render(request,"sales/dashboard.html", context)
 
 
 @login_required
 def clients(request):
-    clients_qs = Client.objects.all()
+    """Clients with their balance, optionally sorted by what they owe (?sort=-outstanding)"""
+    clients_qs = Client.objects.select_related('balance')
+    if clean_sort(request.GET.get('sort', ''), CLIENT_SORTS, '') == '-outstanding':
+        # Every client has a balance row: the inner join lets SQLite walk the exposure index instead of sorting
+        clients_qs = clients_qs.filter(balance__isnull=False).order_by('-balance__outstanding', '-balance__client_id')
     
     if request.method == 'POST':
         form = ClientForm(request.POST, request.FILES)
@@ -100,6 +178,7 @@ def edit_client(request, client_id):
         emailAddress = request.POST.get('emailAddress')
         adress = request.POST.get('adress')
         mf = request.POST.get('mf')
+        payment_terms = request.POST.get('payment_terms')
         
         try:
             # Update product fields
@@ -107,6 +186,10 @@ def edit_client(request, client_id):
             client.emailAddress = emailAddress if emailAddress else ''
             client.adress = adress if adress else ''
             client.mf = mf if mf else ''
+            # Blank: the company default (SALES_DEFAULT_PAYMENT_TERMS)
+            client.payment_terms = int(payment_terms) if payment_terms else None
+            if client.payment_terms is not None and client.payment_terms < 0:
+                raise ValueError('Payment terms cannot be negative')
 
             
 
@@ -121,7 +204,8 @@ def edit_client(request, client_id):
 @login_required
 def settings_view(request):
     """View and edit company settings"""
-    settings = Settings.objects.first()
+    # The form writes into its instance, so only bind a fresh row, never the shared cached one
+    settings = Settings.objects.first() if request.method == 'POST' else company_settings()
     
     if request.method == 'POST':
         if settings:
@@ -163,24 +247,29 @@ def products_list(request):
     # Search filter
     search_query = request.GET.get('search', '')
     if search_query:
-        products = products.filter(
-            Q(title__icontains=search_query) | 
-            Q(description__icontains=search_query)
-        )
+        products = full_text_search(products, search_query)
     
     # Category filter (if you have categories)
     category = request.GET.get('category', '')
     if category:
         products = products.filter(category_id=category)
     
-    # Sorting
-    sort_by = request.GET.get('sort', 'title')
-    products = products.order_by(sort_by)
+    # Sorting: searches default to best match first
+    sort_by = clean_sort(request.GET.get('sort', ''), PRODUCT_SORTS, '')
+    cursor_pagination = settings.SALES_CURSOR_PAGINATION and bool(sort_by or not search_query)
     
-    # Pagination
-    paginator = Paginator(products, 20)  # 20 products per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Pagination: ranked matches are all scored anyway, so they keep numbered pages
+    if cursor_pagination:
+        page_obj = cursor_page(products, sort_by or 'title', request.GET.get('cursor'),
+                               estimated_total=None if search_query else estimate_rows(Product))
+    else:
+        if sort_by or not search_query:
+            products = products.order_by(sort_by or 'title')
+        else:
+            products = order_by_rank(products)
+        paginator = Paginator(products, 20)  # 20 products per page
+        page_number = request.GET.get('page')
+        page_obj = paginator.get_page(page_number)
     
     # Get categories for filter dropdown (if applicable)
     # categories = Category.objects.all()
@@ -189,6 +278,7 @@ def products_list(request):
         'products': page_obj,
         'page_obj': page_obj,
         'is_paginated': page_obj.has_other_pages(),
+        'cursor_pagination': cursor_pagination,
         'form': ProductForm(),
         # 'categories': categories,
     }
@@ -266,54 +356,12 @@ def delete_product(request, product_id):
 
 @login_required
 def export_products(request):
-    """Export all products to Excel"""
-    products = Product.objects.all().order_by('title')
-    
-    # Create workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Products"
-    
-    # Define headers
-    headers = ['Product ID', 'Title', 'Currency', 'Description', 'Price', 'Quantity']
-    ws.append(headers)
-    
-    # Style the header row
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF")
-    
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-    
-    # Add product data
-    for product in products:
-        ws.append([
-            product.id,
-            product.title,
-            product.currency if product.currency else 'ZAR',
-            product.description if product.description else '',
-            float(product.price) if product.price else 0.0,
-            product.quantity if product.quantity else 0,
-        ])
-    
-    # Adjust column widths
-    ws.column_dimensions['A'].width = 12
-    ws.column_dimensions['B'].width = 30
-    ws.column_dimensions['C'].width = 12
-    ws.column_dimensions['D'].width = 50
-    ws.column_dimensions['E'].width = 12
-    ws.column_dimensions['F'].width = 12
-    
-    # Save to response
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
-    response['Content-Disposition'] = 'attachment; filename=products_export.xlsx'
-    
-    wb.save(response)
-    return response
+    """Export all products to Excel, streamed with constant memory (or as a job with ?background=1)"""
+    if request.GET.get('background'):
+        job = enqueue_job('export_products', user=request.user)
+        messages.info(request, f'Product export queued as job #{job.id}.')
+        return redirect('jobs_list')
+    return spooled_response(write_products_xlsx, 'products_export.xlsx')
 
 @login_required
 def download_product_template(request):
@@ -410,186 +458,53 @@ def import_products(request):
             messages.error(request, 'Invalid file format. Please upload an Excel file (.xlsx or .xls).')
             return redirect('products_list')
         
-        # Validate file size (5MB limit)
-        if excel_file.size > 5 * 1024 * 1024:
-            messages.error(request, 'File size exceeds 5MB limit.')
+        # Validate file size
+        if excel_file.size > settings.SALES_IMPORT_MAX_SIZE:
+            messages.error(request, f'File size exceeds {settings.SALES_IMPORT_MAX_SIZE // (1024 * 1024)}MB limit.')
             return redirect('products_list')
         
-        try:
-            # Load workbook
-            wb = load_workbook(excel_file)
-            ws = wb.active
-            
-            # Get headers from first row
-            headers = [cell.value for cell in ws[1]]
-            
-            # Validate required columns
-            required_columns = ['Title']
-            for col in required_columns:
-                if col not in headers:
-                    messages.error(request, f'Missing required column: {col}')
-                    return redirect('products_list')
-            
-            # Get column indices
-            title_idx = headers.index('Title')
-            currency_idx = headers.index('Currency') if 'Currency' in headers else None
-            description_idx = headers.index('Description') if 'Description' in headers else None
-            price_idx = headers.index('Price') if 'Price' in headers else None
-            quantity_idx = headers.index('Quantity') if 'Quantity' in headers else None
-            
-            # Process rows
-            created_count = 0
-            updated_count = 0
-            error_count = 0
-            
-            for row_num, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
-                try:
-                    # Get values
-                    title = row[title_idx]
-                    
-                    # Skip empty rows
-                    if not title:
-                        continue
-                    
-                    currency = row[currency_idx] if currency_idx is not None and row[currency_idx] else 'ZAR'
-                    description = row[description_idx] if description_idx is not None else ''
-                    
-                    # Handle price
-                    try:
-                        price = float(row[price_idx]) if price_idx is not None and row[price_idx] else 0.0
-                    except (ValueError, TypeError):
-                        price = 0.0
-                    
-                    # Handle quantity
-                    try:
-                        quantity = int(row[quantity_idx]) if quantity_idx is not None and row[quantity_idx] else 0
-                    except (ValueError, TypeError):
-                        quantity = 0
-                    
-                    # Check if product exists (for update)
-                    if update_existing:
-                        product, created = Product.objects.get_or_create(
-                            title=title,
-                            defaults={
-                                'currency': currency,
-                                'description': description,
-                                'price': price,
-                                'quantity': quantity,
-                            }
-                        )
-                        
-                        if not created:
-                            # Update existing product
-                            product.currency = currency
-                            product.description = description
-                            product.price = price
-                            product.quantity = quantity
-                            product.save()
-                            updated_count += 1
-                        else:
-                            created_count += 1
-                    else:
-                        # Create new product
-                        Product.objects.create(
-                            title=title,
-                            currency=currency,
-                            description=description,
-                            price=price,
-                            quantity=quantity,
-                        )
-                        created_count += 1
-                        
-                except Exception as e:
-                    error_count += 1
-                    print(f"Error processing row {row_num}: {str(e)}")
-                    continue
-            
-            # Success message
-            if created_count > 0 or updated_count > 0:
-                msg_parts = []
-                if created_count > 0:
-                    msg_parts.append(f'{created_count} product(s) created')
-                if updated_count > 0:
-                    msg_parts.append(f'{updated_count} product(s) updated')
-                
-                success_msg = ' and '.join(msg_parts) + ' successfully!'
-                messages.success(request, success_msg)
-                
-                if error_count > 0:
-                    messages.warning(request, f'{error_count} row(s) had errors and were skipped.')
-            else:
-                if error_count > 0:
-                    messages.error(request, f'Import failed. {error_count} row(s) had errors.')
-                else:
-                    messages.warning(request, 'No products were imported. Please check your file.')
-                    
-        except Exception as e:
-            messages.error(request, f'Error processing file: {str(e)}')
-            return redirect('products_list')
+        # The file is stored and imported by a background worker
+        job = enqueue_job('import_products', {'update_existing': update_existing}, upload=excel_file, user=request.user)
+        job_messages(request, job, 'product')
     
     return redirect('products_list')
 
 @login_required
 def invoices_list(request):
     """Display all invoices with filtering and search"""
-    invoices = Invoice.objects.all().select_related('client').prefetch_related('product')
-    
-    # Search filter
-    search_query = request.GET.get('search', '')
-    if search_query:
-        invoices = invoices.filter(
-            Q(title__icontains=search_query) | 
-            Q(client__clientname__icontains=search_query) |
-            Q(notes__icontains=search_query) |
-            Q(uniqueId__icontains=search_query)
-        )
-    
-    # Status filter
-    status = request.GET.get('status', '')
-    if status:
-        invoices = invoices.filter(status=status)
+    invoices = filter_invoices(request.GET).select_related('client')
     
-    # Client filter
-    client_id = request.GET.get('client', '')
-    if client_id:
-        invoices = invoices.filter(client_id=client_id)
-    
-    # Date filter
-    date_from = request.GET.get('date_from', '')
-    if date_from:
-        invoices = invoices.filter(date_created__gte=date_from)
-    
-    # Sorting
-    sort_by = request.GET.get('sort', '-date_created')
-    invoices = invoices.order_by(sort_by)
-    
-    # Pagination
-    paginator = Paginator(invoices, 20)  # 20 invoices per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Counts and amounts per status: cached counters when unfiltered, else one aggregate query
+    if settings.SALES_CACHED_INVOICE_STATS and not has_invoice_filters(request.GET):
+        stats = InvoiceStats.summary()
+    else:
+        stats = invoices.status_stats()
     
-    # Get all clients and products for dropdowns
-    clients = Client.objects.all().order_by('clientname')
-    products = Product.objects.all().order_by('title')
+    # Pagination: cursors unless the search is ranked by best match
+    sort_by = invoice_sort(request.GET)
+    cursor_pagination = settings.SALES_CURSOR_PAGINATION and bool(sort_by)
+    if cursor_pagination:
+        page_obj = cursor_page(invoices, sort_by, request.GET.get('cursor'), estimated_total=stats['total_invoices'])
+    else:
+        paginator = Paginator(invoices, 20)  # 20 invoices per page
+        paginator.count = stats['total_invoices']  # already counted, spares the paginator's COUNT
+        page_number = request.GET.get('page')
+        page_obj = paginator.get_page(page_number)
     
-    # Calculate statistics
-    total_invoices = invoices.count()
-    current_invoices = invoices.filter(status='CURRENT').count()
-    overdue_invoices = invoices.filter(status='OVERDUE').count()
-    paid_invoices = invoices.filter(status='PAID').count()
+    # The client filter shows the selected client's name; pickers load the rest on demand
+    filter_client = None
+    if request.GET.get('client', '').isdigit():
+        filter_client = Client.objects.filter(id=request.GET['client']).only('id', 'clientname').first()
     
     context = {
         'invoices': page_obj,
         'page_obj': page_obj,
         'is_paginated': page_obj.has_other_pages(),
-        'clients': clients,
-        'products': products,
+        'cursor_pagination': cursor_pagination,
+        'filter_client': filter_client,
         'form': InvoiceForm(),
-        'total_invoices': total_invoices,
-        'current_invoices': current_invoices,
-        'overdue_invoices': overdue_invoices,
-        'paid_invoices': paid_invoices,
     }
+    context.update(stats)
     
     return render(request, 'sales/invoices.html', context)
 
@@ -607,6 +522,8 @@ def invoice_create(request):
                 tva = float(request.POST.get('tva', 19.00))
                 timbre_fiscal = float(request.POST.get('timbre_fiscal', 1.000))
                 discount = float(request.POST.get('discount', 0.00))
+                # Blank: the client's payment terms from today
+                due_date = parse_date(request.POST.get('due_date') or '')
                 
                 # Get products and quantities from JSON
                 products_data = request.POST.get('products_data')
@@ -616,41 +533,57 @@ def invoice_create(request):
                     messages.error(request, 'No products selected.')
                     return redirect('invoices_list')
                 
+                quantities = line_quantities(products_list)
+                
+                # Fetch every product in one query and validate all lines in memory
+                products = Product.objects.in_bulk(list(quantities))
+                if len(products) != len(quantities):
+                    raise Product.DoesNotExist
+                
+                shortages = [
+                    {
+                        'product_id': product_id,
+                        'title': products[product_id].title,
+                        'available': products[product_id].quantity or 0,
+                        'requested': quantity,
+                    }
+                    for product_id, quantity in quantities.items()
+                    if (products[product_id].quantity or 0) < quantity
+                ]
+                if shortages:
+                    raise InsufficientStock(shortages)
+                
                 # Validate client
                 client = Client.objects.get(id=client_id)
                 
-                # Create invoice
-                invoice = Invoice.objects.create(
+                # Create invoice with its totals already known
+                invoice = Invoice(
                     title=title,
                     status=status,
                     notes=notes,
                     client=client,
                     tva=tva,
                     timbre_fiscal=timbre_fiscal,
-                    discount=discount
+                    discount=discount,
+                    due_date=due_date
                 )
-                
-                # Add products with quantities
-                for product_data in products_list:
-                    product_id = product_data['product_id']
-                    quantity = int(product_data['quantity'])
-                    
-                    product = Product.objects.get(id=product_id)
-                    
-                    # Check if enough inventory
-                    if product.quantity < quantity:
-                        raise ValueError(f'Insufficient inventory for {product.title}. Available: {product.quantity}, Requested: {quantity}')
-                    
-                    # Create InvoiceProduct
-                    InvoiceProduct.objects.create(
+                lines = [
+                    InvoiceProduct(
                         invoice=invoice,
-                        product=product,
+                        product=products[product_id],
                         quantity=quantity,
-                        unit_price=product.price
+                        unit_price=products[product_id].price or 0.0
                     )
+                    for product_id, quantity in quantities.items()
+                ]
+                invoice.subtotal = sum((line.get_line_total() for line in lines), Decimal('0'))
+                invoice.save()
                 
-                # Adjust inventory
-                if invoice.adjust_inventory():
+                # Add products with quantities in a single INSERT
+                InvoiceProduct.objects.bulk_create(lines)
+                
+                # Adjust inventory, reusing the quantities instead of re-reading the lines
+                if invoice.adjust_inventory(quantities):
                     messages.success(request, f'Invoice "{invoice.title}" created successfully! Inventory updated.')
                 else:
                     raise ValueError('Failed to adjust inventory. Insufficient stock.')
@@ -689,6 +622,7 @@ def invoice_edit(request, invoice_id):
                 tva = request.POST.get('tva')
                 timbre_fiscal = request.POST.get('timbre_fiscal')
                 discount = request.POST.get('discount')
+                due_date = request.POST.get('due_date')
                 
                 # Get products data
                 products_data = request.POST.get('products_data')
@@ -706,42 +640,20 @@ def invoice_edit(request, invoice_id):
                     invoice.timbre_fiscal = float(timbre_fiscal)
                 if discount:
                     invoice.discount = float(discount)
+                if due_date:
+                    invoice.due_date = parse_date(due_date)
                 
                 # Update client
                 if client_id:
                     client = Client.objects.get(id=client_id)
                     invoice.client = client
                 
-                # Handle product changes
+                # Handle product changes: only write what differs from the current lines
                 if products_data:
-                    products_list = json.loads(products_data)
+                    quantities = line_quantities(json.loads(products_data))
+                    invoice.reconcile_lines(quantities)
                     
-                    # Restore inventory from old quantities
-                    invoice.restore_inventory()
-                    
-                    # Clear existing invoice products
-                    invoice.invoice_products.all().delete()
-                    
-                    # Add new products with quantities
-                    for product_data in products_list:
-                        product_id = product_data['product_id']
-                        quantity = float(product_data['quantity'])
-                        
-                        product = Product.objects.get(id=product_id)
-                        
-                        # Check inventory
-                        if product.quantity < quantity:
-                            raise ValueError(f'Insufficient inventory for {product.title}. Available: {product.quantity}')
-                        
-                        InvoiceProduct.objects.create(
-                            invoice=invoice,
-                            product=product,
-                            quantity=quantity,
-                            unit_price=product.price
-                        )
-                    
-                    # Adjust inventory with new quantities
-                    if not invoice.adjust_inventory():
+                    if not invoice.inventory_adjusted and not invoice.adjust_inventory(quantities):
                         raise ValueError('Failed to adjust inventory.')
                 
                 invoice.save()
@@ -761,63 +673,75 @@ def invoice_edit(request, invoice_id):
 
 @login_required
 def invoice_detail(request, invoice_id):
-    """View invoice details with inventory-tracked products"""
-    invoice = get_object_or_404(Invoice, id=invoice_id)
-    
-    # Get invoice products with their quantities
-    invoice_products = invoice.invoice_products.select_related('product').all()
-    
-    # Calculate amounts
-    subtotal = invoice.calculate_subtotal()
-    discount_amount = invoice.calculate_discount_amount()
-    subtotal_after_discount = invoice.calculate_subtotal_after_discount()
-    tva_amount = invoice.calculate_tva_amount()
-    total = invoice.calculate_total()
-    
-    # Prepare products with line totals
-    products_with_totals = []
-    invoice_currency = 'TND'
-    
-    for invoice_product in invoice_products:
-        product = invoice_product.product
-        if not invoice_currency or invoice_currency == 'TND':
-            invoice_currency = product.currency or 'TND'
-        
-        products_with_totals.append({
-            'product': product,
-            'invoice_quantity': invoice_product.quantity,  # Quantity in invoice
-            'unit_price': invoice_product.unit_price,      # Price at time of invoice
-            'line_total': invoice_product.get_line_total(),
-            'current_stock': product.quantity,             # Current inventory
-        })
-    
-    # Get all clients and products for edit modal
-    clients = Client.objects.all().order_by('clientname')
-    all_products = Product.objects.all().order_by('title')
-    
-    # Get settings
-    try:
-        from .models import Settings
-        p_settings = Settings.objects.first()
-    except Exception as e:
-        p_settings = None
+    """View an invoice; its printable document comes from the render cache when current"""
+    invoice = get_object_or_404(Invoice.objects.select_related('client'), id=invoice_id)
+    # The edit modal lists the lines too, so the document only reads them on a cache miss
+    invoice_products = list(invoice.invoice_products.select_related('product').order_by('id'))
+    document, hit = render_invoice_document(invoice, invoice_products)
     
     context = {
         'invoice': invoice,
         'invoice_products': invoice_products,
-        'products_with_totals': products_with_totals,
-        'subtotal': subtotal,
-        'discount_amount': discount_amount,
-        'subtotal_after_discount': subtotal_after_discount,
-        'tva_amount': tva_amount,
-        'total': total,
-        'invoiceCurrency': invoice_currency,
-        'clients': clients,
-        'all_products': all_products,
-        'p_settings': p_settings,
+        'invoice_document': mark_safe(document),
     }
     
-    return render(request, 'sales/invoice_detail.html', context)
+    response = render(request, 'sales/invoice_detail.html', context)
+    response['Server-Timing'] = f'document;desc="{"hit" if hit else "miss"}"'
+    return response
+
+@login_required
+def invoice_data(request, invoice_id):
+    """Invoice fields and lines as JSON, used to fill the shared edit modal on the invoices page"""
+    invoice = get_object_or_404(Invoice.objects.select_related('client'), id=invoice_id)
+    lines = invoice.invoice_products.select_related('product').order_by('id')
+    return JsonResponse({
+        'id': invoice.id,
+        'title': invoice.title or '',
+        'client_id': invoice.client_id,
+        'client_name': invoice.client.clientname if invoice.client else '',
+        'status': invoice.status,
+        'tva': str(invoice.tva if invoice.tva is not None else ''),
+        'timbre_fiscal': str(invoice.timbre_fiscal if invoice.timbre_fiscal is not None else ''),
+        'discount': str(invoice.discount if invoice.discount is not None else ''),
+        'notes': invoice.notes or '',
+        'due_date': invoice.due_date.isoformat() if invoice.due_date else '',
+        'edit_url': reverse('invoice_edit', args=[invoice.id]),
+        'lines': [
+            {
+                'product_id': line.product_id,
+                'title': line.product.title,
+                'currency': line.product.currency or 'TND',
+                'price': line.unit_price,
+                # Units already on this invoice are available to it again when editing
+                'available_quantity': (line.product.quantity or 0) + (line.quantity if invoice.inventory_adjusted else 0),
+                'quantity': line.quantity,
+            }
+            for line in lines
+        ],
+    })
+
+@login_required
+def product_autocomplete(request):
+    """Products matching ?q= with price and stock, for the invoice product pickers"""
+    products = Product.objects.only('id', 'title', 'price', 'currency', 'quantity')
+    matches = match_names(products, request.GET.get('q', ''), autocomplete_limit(request.GET))
+    return JsonResponse({'results': [
+        {
+            'id': product.id,
+            'title': product.title or '',
+            'price': product.price or 0.0,
+            'currency': product.currency or 'TND',
+            'available_quantity': product.quantity or 0,
+        }
+        for product in matches
+    ]})
+
+@login_required
+def client_autocomplete(request):
+    """Clients matching ?q=, for the client pickers"""
+    clients = Client.objects.only('id', 'clientname')
+    matches = match_names(clients, request.GET.get('q', ''), autocomplete_limit(request.GET))
+    return JsonResponse({'results': [{'id': client.id, 'name': client.clientname or ''} for client in matches]})
 
 @login_required
 def invoice_delete(request, invoice_id):
@@ -855,60 +779,44 @@ def check_product_stock(request, product_id):
 
 @login_required
 def export_invoices(request):
-    """Export all invoices to Excel"""
-    invoices = Invoice.objects.all().select_related('client', 'product').order_by('-date_created')
-    
-    # Create workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Invoices"
-    
-    # Define headers
-    headers = ['Invoice ID', 'Unique ID', 'Title', 'Client', 'Product', 'Status', 'Date Created', 'Last Updated', 'Notes']
-    ws.append(headers)
-    
-    # Style the header row
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF")
-    
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-    
-    # Add invoice data
-    for invoice in invoices:
-        ws.append([
-            invoice.id,
-            invoice.uniqueId if invoice.uniqueId else '',
-            invoice.title if invoice.title else '',
-            invoice.client.clientName if invoice.client else 'No Client',
-            invoice.product.title if invoice.product else 'No Product',
-            invoice.status,
-            invoice.date_created.strftime('%Y-%m-%d %H:%M') if invoice.date_created else '',
-            invoice.last_updated.strftime('%Y-%m-%d %H:%M') if invoice.last_updated else '',
-            invoice.notes if invoice.notes else '',
-        ])
-    
-    # Adjust column widths
-    ws.column_dimensions['A'].width = 12
-    ws.column_dimensions['B'].width = 15
-    ws.column_dimensions['C'].width = 30
-    ws.column_dimensions['D'].width = 25
-    ws.column_dimensions['E'].width = 25
-    ws.column_dimensions['F'].width = 12
-    ws.column_dimensions['G'].width = 18
-    ws.column_dimensions['H'].width = 18
-    ws.column_dimensions['I'].width = 40
-    
-    # Save to response
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    """Export the filtered invoices to Excel (headers + line items), CSV or JSON lines"""
+    export_format = request.GET.get('format', 'xlsx')
+    if request.GET.get('background'):
+        filters = {key: value for key, value in request.GET.items() if key not in ('format', 'background')}
+        job = enqueue_job('export_invoices', {'format': export_format, 'filters': filters}, user=request.user)
+        messages.info(request, f'Invoice export queued as job #{job.id}.')
+        return redirect('jobs_list')
+    
+    invoices = filter_invoices(request.GET)
+    stamp = datetime.now().strftime('%Y%m%d')
+    
+    if export_format == 'csv':
+        response = StreamingHttpResponse(iter_invoices_csv(invoices), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename=invoices_export_{stamp}.csv'
+        return response
+    
+    if export_format == 'jsonl':
+        response = StreamingHttpResponse(iter_invoices_jsonl(invoices), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename=invoices_export_{stamp}.jsonl'
+        return response
+    
+    return spooled_response(
+        lambda fileobj: write_invoices_xlsx(fileobj, invoices),
+        'invoices_export.xlsx'
     )
-    response['Content-Disposition'] = 'attachment; filename=invoices_export.xlsx'
-    
-    wb.save(response)
-    return response
+
+@login_required
+def invoices_print(request):
+    """Print the filtered invoices (same parameters as the list), or ?ids=1,2,3, as one streamed page"""
+    invoices = filter_invoices(request.GET)
+    ids = [value for raw in request.GET.getlist('ids') for value in raw.split(',') if value.strip().isdigit()]
+    if ids:
+        invoices = invoices.filter(id__in=ids)
+    
+    # The page shell is rendered once and the invoice documents are streamed in between
+    marker = '<!-- invoices -->'
+    head, tail = render_to_string('sales/invoices_print.html', {'invoices': mark_safe(marker)}, request).split(marker)
+    return StreamingHttpResponse(iter_invoices_html(invoices, head, tail), content_type='text/html; charset=utf-8')
 
 @login_required
 def download_invoice_template(request):
@@ -918,7 +826,8 @@ def download_invoice_template(request):
     ws.title = "Invoices Template"
     
     # Define headers
-    headers = ['Title', 'Client Name', 'Product Title', 'Status', 'Notes']
+    headers = ['Invoice Key', 'Title', 'Client Name', 'Product Title', 'Quantity', 'Status',
+               'TVA', 'Timbre Fiscal', 'Discount', 'Notes']
     ws.append(headers)
     
     # Style the header row
@@ -930,19 +839,41 @@ def download_invoice_template(request):
         cell.font = header_font
         cell.alignment = Alignment(horizontal='center', vertical='center')
     
-    # Add sample data
+    # Add sample data: INV-1 has two lines, INV-2 has one
     ws.append([
+        'INV-1',
         'Sample Invoice 1',
         'Sample Client',
         'Sample Product',
+        2,
+        'CURRENT',
+        19,
+        1.000,
+        0,
+        'This is a sample invoice note'
+    ])
+    ws.append([
+        'INV-1',
+        'Sample Invoice 1',
+        'Sample Client',
+        'Another Product',
+        1,
         'CURRENT',
+        19,
+        1.000,
+        0,
         'This is a sample invoice note'
     ])
     ws.append([
+        'INV-2',
         'Sample Invoice 2',
         'Another Client',
         'Another Product',
+        5,
         'PAID',
+        19,
+        1.000,
+        10,
         'Another sample note'
     ])
     
@@ -951,18 +882,25 @@ def download_invoice_template(request):
     instructions = [
         ['Invoice Import Template - Instructions'],
         [''],
-        ['Required Columns:'],
-        ['1. Title - Invoice title (required)'],
-        ['2. Client Name - Exact client name from your system (required)'],
-        ['3. Product Title - Exact product title from your system'],
-        ['4. Status - Invoice status: CURRENT, PAID, or OVERDUE'],
-        ['5. Notes - Additional notes or comments'],
+        ['Columns:'],
+        ['1. Invoice Key - Rows with the same key form one invoice (defaults to Title)'],
+        ['2. Title - Invoice title (required)'],
+        ['3. Client Name - Exact client name from your system (required)'],
+        ['4. Product Title - Exact product title from your system, one product per row'],
+        ['5. Quantity - Quantity of the product on this line (default 1)'],
+        ['6. Status - Invoice status: CURRENT, PAID, or OVERDUE'],
+        ['7. TVA - TVA percentage (default 19)'],
+        ['8. Timbre Fiscal - Timbre fiscal amount (default 1.000)'],
+        ['9. Discount - Discount percentage (default 0)'],
+        ['10. Notes - Additional notes or comments'],
         [''],
         ['Important Notes:'],
         ['- Do not modify the header row'],
         ['- Title and Client Name are required'],
+        ['- Header columns (Title, Client, Status, rates, Notes) are read from the first row of each invoice'],
         ['- Client Name must match exactly with existing clients'],
         ['- Product Title must match exactly with existing products'],
+        ['- Stock is deducted for every imported line; invoices with insufficient stock are skipped'],
         ['- Status values are case-sensitive (use UPPERCASE)'],
         ['- Default status is CURRENT if not specified'],
         ['- Unique ID and slug will be auto-generated'],
@@ -971,15 +909,12 @@ def download_invoice_template(request):
     for row in instructions:
         ws_instructions.append(row)
     
-    ws_instructions.column_dimensions['A'].width = 60
+    ws_instructions.column_dimensions['A'].width = 80
     ws_instructions['A1'].font = Font(bold=True, size=14)
     
     # Adjust column widths
-    ws.column_dimensions['A'].width = 30
-    ws.column_dimensions['B'].width = 25
-    ws.column_dimensions['C'].width = 25
-    ws.column_dimensions['D'].width = 15
-    ws.column_dimensions['E'].width = 40
+    for column, width in zip('ABCDEFGHIJ', [14, 30, 25, 25, 10, 12, 8, 14, 10, 40]):
+        ws.column_dimensions[column].width = width
     
     # Save to response
     response = HttpResponse(
@@ -1006,128 +941,44 @@ def import_invoices(request):
             messages.error(request, 'Invalid file format. Please upload an Excel file (.xlsx or .xls).')
             return redirect('invoices_list')
         
-        # Validate file size (5MB limit)
-        if excel_file.size > 5 * 1024 * 1024:
-            messages.error(request, 'File size exceeds 5MB limit.')
+        # Validate file size
+        if excel_file.size > settings.SALES_IMPORT_MAX_SIZE:
+            messages.error(request, f'File size exceeds {settings.SALES_IMPORT_MAX_SIZE // (1024 * 1024)}MB limit.')
             return redirect('invoices_list')
         
-        try:
-            # Load workbook
-            wb = load_workbook(excel_file)
-            ws = wb.active
-            
-            # Get headers
-            headers = [cell.value for cell in ws[1]]
-            
-            # Validate required columns
-            required_columns = ['Title', 'Client Name']
-            for col in required_columns:
-                if col not in headers:
-                    messages.error(request, f'Missing required column: {col}')
-                    return redirect('invoices_list')
-            
-            # Get column indices
-            title_idx = headers.index('Title')
-            client_name_idx = headers.index('Client Name')
-            product_title_idx = headers.index('Product Title') if 'Product Title' in headers else None
-            status_idx = headers.index('Status') if 'Status' in headers else None
-            notes_idx = headers.index('Notes') if 'Notes' in headers else None
-            
-            # Process rows
-            created_count = 0
-            updated_count = 0
-            error_count = 0
-            
-            for row_num, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
-                try:
-                    # Get values
-                    title = row[title_idx]
-                    client_name = row[client_name_idx]
-                    
-                    # Skip empty rows
-                    if not title or not client_name:
-                        continue
-                    
-                    # Get or validate client
-                    try:
-                        client = Client.objects.get(clientName=client_name)
-                    except Client.DoesNotExist:
-                        error_count += 1
-                        print(f"Row {row_num}: Client '{client_name}' not found")
-                        continue
-                    
-                    # Get product if specified
-                    product = None
-                    if product_title_idx is not None and row[product_title_idx]:
-                        try:
-                            product = Product.objects.get(title=row[product_title_idx])
-                        except Product.DoesNotExist:
-                            print(f"Row {row_num}: Product '{row[product_title_idx]}' not found, skipping product")
-                    
-                    status = row[status_idx] if status_idx is not None and row[status_idx] else 'CURRENT'
-                    notes = row[notes_idx] if notes_idx is not None and row[notes_idx] else ''
-                    
-                    # Validate status
-                    if status not in ['CURRENT', 'OVERDUE', 'PAID']:
-                        status = 'CURRENT'
-                    
-                    # Create or update invoice
-                    if update_existing:
-                        invoice, created = Invoice.objects.get_or_create(
-                            title=title,
-                            defaults={
-                                'client': client,
-                                'product': product,
-                                'status': status,
-                                'notes': notes,
-                            }
-                        )
-                        
-                        if not created:
-                            invoice.client = client
-                            invoice.product = product
-                            invoice.status = status
-                            invoice.notes = notes
-                            invoice.save()
-                            updated_count += 1
-                        else:
-                            created_count += 1
-                    else:
-                        invoice = Invoice.objects.create(
-                            title=title,
-                            client=client,
-                            product=product,
-                            status=status,
-                            notes=notes,
-                        )
-                        created_count += 1
-                        
-                except Exception as e:
-                    error_count += 1
-                    print(f"Error processing row {row_num}: {str(e)}")
-                    continue
-            
-            # Success message
-            if created_count > 0 or updated_count > 0:
-                msg_parts = []
-                if created_count > 0:
-                    msg_parts.append(f'{created_count} invoice(s) created')
-                if updated_count > 0:
-                    msg_parts.append(f'{updated_count} invoice(s) updated')
-                
-                success_msg = ' and '.join(msg_parts) + ' successfully!'
-                messages.success(request, success_msg)
-                
-                if error_count > 0:
-                    messages.warning(request, f'{error_count} row(s) had errors and were skipped.')
-            else:
-                if error_count > 0:
-                    messages.error(request, f'Import failed. {error_count} row(s) had errors.')
-                else:
-                    messages.warning(request, 'No invoices were imported. Please check your file.')
-                    
-        except Exception as e:
-            messages.error(request, f'Error processing file: {str(e)}')
-            return redirect('invoices_list')
+        # The file is stored and imported by a background worker
+        params = {'update_existing': update_existing, 'create_clients': request.POST.get('create_clients') == 'on'}
+        job = enqueue_job('import_invoices', params, upload=excel_file, user=request.user)
+        job_messages(request, job, 'invoice')
     
-    return redirect('invoices_list')
\ No newline at end of file
+    return redirect('invoices_list')
+
+@login_required
+def jobs_list(request):
+    """Recent background imports and exports"""
+    jobs = Job.objects.select_related('created_by').order_by('-id')[:50]
+    return render(request, 'sales/jobs.html', {'jobs': jobs})
+
+@login_required
+def job_status(request, job_id):
+    """Status and progress of one job as JSON, polled by the jobs page"""
+    job = get_object_or_404(Job, id=job_id)
+    return JsonResponse({
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'processed': job.processed,
+        'total': job.total,
+        'result': job.result,
+        'error': job.error,
+        'download_url': reverse('job_download', args=[job.id]) if job.output_file else None,
+    })
+
+@login_required
+def job_download(request, job_id):
+    """Download the file produced by a finished export job"""
+    job = get_object_or_404(Job, id=job_id)
+    if job.status != 'DONE' or not job.output_file:
+        raise Http404('This job has no file to download.')
+    return FileResponse(job.output_file.open('rb'), as_attachment=True,
+                        filename=os.path.basename(job.output_file.name))
@@ -0,0 +1,145 @@
+// Server-side autocomplete for the product and client pickers.
+// Suggestions come from the JSON endpoints (products/autocomplete/, clients/autocomplete/),
+// so pages no longer embed the whole catalog.
+(function () {
+  'use strict'
+
+  function attachAutocomplete(input, options) {
+    const delay = options.delay || 200
+    const menu = document.createElement('ul')
+    menu.className = 'dropdown-menu w-100 shadow-sm'
+    menu.style.maxHeight = '16rem'
+    menu.style.overflowY = 'auto'
+    input.parentNode.classList.add('position-relative')
+    input.parentNode.appendChild(menu)
+    input.setAttribute('autocomplete', 'off')
+
+    let items = []
+    let active = -1
+    let timer = null
+    let controller = null
+
+    function hide() {
+      menu.classList.remove('show')
+      active = -1
+    }
+
+    function highlight(index) {
+      const buttons = menu.querySelectorAll('.dropdown-item')
+      buttons.forEach((button, i) => button.classList.toggle('active', i === index))
+      active = index
+      if (buttons[index]) buttons[index].scrollIntoView({block: 'nearest'})
+    }
+
+    function choose(item) {
+      input.value = options.label(item)
+      hide()
+      options.onSelect(item)
+    }
+
+    function show(results) {
+      items = results
+      menu.innerHTML = ''
+      if (!results.length) {
+        const empty = document.createElement('li')
+        empty.innerHTML = '<span class="dropdown-item-text text-muted small">No matches</span>'
+        menu.appendChild(empty)
+      }
+      results.forEach(item => {
+        const li = document.createElement('li')
+        const button = document.createElement('button')
+        button.type = 'button'
+        button.className = 'dropdown-item small'
+        button.textContent = (options.render || options.label)(item)
+        // mousedown fires before the input's blur, so the menu is still there
+        button.addEventListener('mousedown', event => {
+          event.preventDefault()
+          choose(item)
+        })
+        li.appendChild(button)
+        menu.appendChild(li)
+      })
+      menu.classList.add('show')
+      active = -1
+    }
+
+    function search() {
+      if (controller) controller.abort()
+      controller = new AbortController()
+      const url = `${options.url}?q=${encodeURIComponent(input.value.trim())}`
+      fetch(url, {signal: controller.signal, headers: {'Accept': 'application/json'}})
+        .then(response => response.json())
+        .then(data => {
+          if (document.activeElement === input) show(data.results)
+        })
+        .catch(error => {
+          if (error.name !== 'AbortError') hide()
+        })
+    }
+
+    input.addEventListener('input', () => {
+      if (options.onInput) options.onInput()
+      clearTimeout(timer)
+      timer = setTimeout(search, delay)
+    })
+    input.addEventListener('focus', () => {
+      if (options.selectOnFocus !== false) input.select()
+      search()
+    })
+    input.addEventListener('blur', hide)
+    input.addEventListener('keydown', event => {
+      if (!menu.classList.contains('show')) return
+      if (event.key === 'ArrowDown') {
+        event.preventDefault()
+        highlight(Math.min(active + 1, items.length - 1))
+      } else if (event.key === 'ArrowUp') {
+        event.preventDefault()
+        highlight(Math.max(active - 1, 0))
+      } else if (event.key === 'Enter' && active >= 0) {
+        event.preventDefault()
+        choose(items[active])
+      } else if (event.key === 'Escape') {
+        hide()
+      }
+    })
+  }
+
+  // Text input + hidden id input; the id is cleared as soon as the text is edited
+  function attachClientPicker(input, hidden, url, onChange) {
+    attachAutocomplete(input, {
+      url: url,
+      label: client => client.name,
+      onSelect: client => {
+        hidden.value = client.id
+        if (onChange) onChange(client)
+      },
+      onInput: () => {
+        hidden.value = ''
+      },
+    })
+  }
+
+  // The row element carries the picked product in data-product-id/-price/-stock/-currency
+  function attachProductPicker(input, row, url, onChange) {
+    attachAutocomplete(input, {
+      url: url,
+      label: product => product.title,
+      render: product => `${product.title} (Stock: ${product.available_quantity}) - ${product.currency} ${Number(product.price).toFixed(3)}`,
+      onSelect: product => {
+        row.dataset.productId = product.id
+        row.dataset.price = product.price
+        row.dataset.stock = product.available_quantity
+        row.dataset.currency = product.currency
+        if (onChange) onChange(product)
+      },
+      onInput: () => {
+        delete row.dataset.productId
+        if (onChange) onChange(null)
+      },
+    })
+  }
+
+  window.attachAutocomplete = attachAutocomplete
+  window.attachClientPicker = attachClientPicker
+  window.attachProductPicker = attachProductPicker
+})()